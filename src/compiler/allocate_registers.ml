@@ -6,7 +6,7 @@ open X86_var_def
 (* If `_debug = true`, print extra debugging information. *)
 let _debug = false
 
-module PQ = Priority_queue.Simple (OrderedLoc)
+module PQ = Priority_queue.Heap (OrderedLoc)
 module Color = Graph_coloring.Make (OrderedLoc) (LocMap) (PQ) (LocUgraph)
 
 (* Registers that are relevant to register allocation.
@@ -28,6 +28,20 @@ let last_register_color = ref 0
 
 let register_color_list : (location * int) list ref = ref []
 
+(* Move biasing and coalescing; see `get_variable_location_map`. *)
+let move_biasing = ref false
+
+let coalescing = ref false
+
+let set_move_biasing b = move_biasing := b
+
+let set_coalescing b = coalescing := b
+
+(* The number of moves made redundant by the last allocation. *)
+let num_moves_eliminated = ref 0
+
+let moves_eliminated () = !num_moves_eliminated
+
 (* Counters for spilled stack locations. *)
 let next_stack_index = ref 0
 
@@ -108,10 +122,46 @@ let varmap_of_colormap (vvs : VarSet.t) (color_map : int LocMap.t) :
   in
   LocMap.fold f color_map VarMap.empty
 
+(* Two locations may be coalesced if they are both variables
+ * of the same kind (vector-valued or not), or a variable and
+ * one of the registers used for allocation. *)
+let can_coalesce (vvs : VarSet.t) (l1 : location) (l2 : location) : bool =
+  let allocatable = function
+    | VarL _ -> true
+    | loc -> List.mem_assoc loc !register_color_list
+  in
+  match (l1, l2) with
+  | VarL v1, VarL v2 -> VarSet.mem v1 vvs = VarSet.mem v2 vvs
+  | _ -> allocatable l1 && allocatable l2
+
+(* Color the interference graph `g`, using the move graph `moves`
+ * for coalescing (with `-coalesce`) and move biasing
+ * (with `-move-bias` or `-coalesce`). *)
+let color_graph (g : LocUgraph.t) (moves : LocUgraph.t) (vvs : VarSet.t) :
+  int LocMap.t =
+  let precolored = register_color_map () in
+  let k = !last_register_color + 1 in
+  if !coalescing then
+    let g', moves', merged =
+      Color.coalesce ~k ~can_merge:(can_coalesce vvs) g moves precolored
+    in
+    let colors = Color.color ~moves:moves' ~k g' precolored in
+    (* Merged locations get the color of the location they were merged
+     * into, which may be a register that isn't in the graph. *)
+    let color_of loc =
+      match LocMap.find_opt loc colors with
+      | Some c -> c
+      | None -> LocMap.find loc precolored
+    in
+    LocMap.fold (fun loc rep acc -> LocMap.add loc (color_of rep) acc) merged
+      colors
+  else if !move_biasing then Color.color ~moves ~k g precolored
+  else Color.color ~k g precolored
+
 (* Determine the variable -> location mapping based on the
- * interference graph. *)
-let get_variable_location_map (g : LocUgraph.t) (vvs : VarSet.t) :
-  location VarMap.t =
+ * interference graph and the move graph. *)
+let get_variable_location_map (g : LocUgraph.t) (moves : LocUgraph.t)
+  (vvs : VarSet.t) : location VarMap.t =
   (* Reset the spill counters and location dictionary. *)
   next_stack_index := 1 ;
   (* index 1 --> -8(%rbp) *)
@@ -119,7 +169,7 @@ let get_variable_location_map (g : LocUgraph.t) (vvs : VarSet.t) :
   (* index 1 --> -8(%r15) *)
   Hashtbl.clear spilled_location_dict ;
   (* Perform the graph coloring, and convert to var -> loc map. *)
-  varmap_of_colormap vvs (Color.color g (register_color_map ()))
+  varmap_of_colormap vvs (color_graph g moves vvs)
 
 (* Convert all the instructions with arguments. *)
 let convert_instr (map : location VarMap.t) (ins : instr) : instr =
@@ -160,6 +210,21 @@ let convert_block (map : location VarMap.t) (bl : 'a block) : 'a block =
   let (Block (bi, ins)) = bl in
   Block (bi, List.map (convert_instr map) ins)
 
+(* Count the moves between two different arguments which are
+ * between the same locations after allocation.
+ * `patch_instructions` removes these. *)
+let count_eliminated_moves (map : location VarMap.t)
+  (lbs : (label * 'a block) list) : int =
+  let eliminated instr =
+    match (instr, convert_instr map instr) with
+    | Movq (a1, a2), Movq (b1, b2) -> a1 <> a2 && b1 = b2
+    | _ -> false
+  in
+  List.fold_left
+    (fun n (_, Block (_, instrs)) ->
+      n + List.length (List.filter eliminated instrs) )
+    0 lbs
+
 (* Get the number of spilled locations.
  * The first returned int is the number of variables
  * spilled onto the regular stack.
@@ -245,10 +310,17 @@ let allocate_registers_def (def : (finfo2, binfo1) def) : (finfo3, binfo1) def =
   let {nparams; locals; body = lbs} = fcont in
   (* Allocate registers. *)
   let vvs = vector_vars fcont.locals in
+  let moves =
+    if !move_biasing || !coalescing then
+      Build_interference.make_move_graph finfo.conflicts lbs
+    else LocUgraph.empty
+  in
   let (map : location VarMap.t) =
-    get_variable_location_map finfo.conflicts vvs
+    get_variable_location_map finfo.conflicts moves vvs
   in
   let _ = print_variable_location_map lbl map in
+  num_moves_eliminated :=
+    !num_moves_eliminated + count_eliminated_moves map lbs ;
   let num_spilled, num_spilled_root = get_num_spilled () in
   let finfo' =
     Finfo3 {num_spilled; num_spilled_root; used_callee = get_used_callee map}
@@ -265,4 +337,5 @@ let allocate_registers_def (def : (finfo2, binfo1) def) : (finfo3, binfo1) def =
 let allocate_registers (prog : (finfo2, binfo1) program) :
   (finfo3, binfo1) program =
   let (X86Program defs) = prog in
+  num_moves_eliminated := 0 ;
   X86Program (List.map allocate_registers_def defs)
@@ -3,6 +3,18 @@
 val set_register_color_list : Types.reg list -> unit
 (** Set the registers to be used for register allocation. *)
 
+val set_move_biasing : bool -> unit
+(** Prefer the colors of move-related variables and registers
+    when allocating registers. *)
+
+val set_coalescing : bool -> unit
+(** Conservatively coalesce move-related variables and registers
+    before allocating registers (this implies move biasing). *)
+
+val moves_eliminated : unit -> int
+(** Return the number of moves which the last call to
+    `allocate_registers` made redundant. *)
+
 val allocate_registers :
      (X86_var_def.finfo2, X86_var_def.binfo1) X86_var_def.program
   -> (X86_var_def.finfo3, X86_var_def.binfo1) X86_var_def.program
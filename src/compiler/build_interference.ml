@@ -122,6 +122,36 @@ let make_graph (g : LocUgraph.t) (lbs : (label * binfo2 block) list)
   in
   List.fold_left helper g lbs (* Getting each block and populating g *)
 
+(* Build the move graph: an edge for every `movq` between two variables
+   or between a variable and a register, unless the two interfere.
+   Giving both ends of an edge the same color makes the move redundant. *)
+let make_move_graph (conflicts : LocUgraph.t) (lbs : (label * 'a block) list)
+  : LocUgraph.t =
+  let is_var = function
+    | VarL _ -> true
+    | _ -> false
+  in
+  let add_move g a1 a2 =
+    let u = location_of a1 in
+    let v = location_of a2 in
+    if
+      (is_var u || is_var v)
+      && OrderedLoc.compare u v <> 0
+      && not (LocUgraph.mem_edge conflicts u v)
+    then LocUgraph.add_edge_new g u v
+    else g
+  in
+  List.fold_left
+    (fun g (_, Block (_, instrs)) ->
+      List.fold_left
+        (fun g instr ->
+          match instr with
+          | Movq (((Var _ | Reg _) as a1), ((Var _ | Reg _) as a2)) ->
+            add_move g a1 a2
+          | _ -> g )
+        g instrs )
+    LocUgraph.empty lbs
+
 (* Replace the Binfo2 field in blocks with a placeholder Binfo1 field. *)
 let replace_binfo (lbs : (label * binfo2 block) list) :
   (label * binfo1 block) list =
@@ -5,3 +5,12 @@ val build_interference :
      (X86_var_def.finfo1, X86_var_def.binfo2) X86_var_def.program
   -> (X86_var_def.finfo2, X86_var_def.binfo1) X86_var_def.program
 (** Build the interference graph for a program. *)
+
+val make_move_graph :
+     Types.LocUgraph.t
+  -> (Types.label * 'a X86_var_def.block) list
+  -> Types.LocUgraph.t
+(** Build the move graph of a function's code, given its
+    interference graph: an edge joins the locations of each `movq`
+    between two variables, or a variable and a register, that don't
+    interfere.  Used for move biasing and coalescing. *)
@@ -42,15 +42,38 @@ let pass = ref "pa" (* pa is the last pass *)
 
 let eval = ref false
 
+let eval_all = ref false
+
+let batch = ref false (* evaluate on several input sets *)
+
+let closure_eval = ref false (* evaluate with closure-compiling interpreters *)
+
 let only = ref false (* only do one pass *)
 
 let regs = ref ""
 
+let time_passes = ref "" (* where to write pass timings; "-" is stderr *)
+
+let no_opt = ref false (* skip the `opt` pass when compiling to assembly *)
+
+let move_bias = ref false
+
+let coalesce = ref false
+
+let scalar_replace = ref false (* run the `sr` pass before `ea` *)
+
+let merge_alloc_checks = ref false
+
+let layout_blocks = ref false
+
 let usage_msg =
-  "compile <filename>\n" ^ "    [-pass <pass>] [-only] [-eval]\n"
-  ^ "    [-init-heap-size n] [-no-fix-label]\n"
+  "compile <filename>\n"
+  ^ "    [-pass <pass>] [-only] [-eval] [-eval-all] [-batch] [-closure-eval]\n"
+  ^ "    [-init-heap-size n] [-no-fix-label] [-time-passes <file>]\n"
+  ^ "    [-no-opt] [-move-bias] [-coalesce] [-scalar-replace]\n"
+  ^ "    [-merge-alloc-checks] [-layout-blocks]\n"
   ^ "    [-sexp-width n] [-sexp-indent n]\n" ^ "    [-regs reg1,reg2,...]\n"
-  ^ "    [-help]"
+  ^ "    [-help]\n" ^ "compile -server"
 
 let speclist =
   [ ( "-pass"
@@ -58,13 +81,41 @@ let speclist =
     , "\tSet last compiler pass (one of: " ^ passes_str ^ ")." )
   ; ("-only", Arg.Set only, "\tOnly do one compiler pass")
   ; ("-eval", Arg.Set eval, "\tEvaluate after compiling")
+  ; ( "-eval-all"
+    , Arg.Set eval_all
+    , "\tEvaluate after every pass that has an evaluator" )
+  ; ( "-batch"
+    , Arg.Set batch
+    , "\tEvaluate on each input set on stdin (separated by `;;` lines)" )
+  ; ( "-closure-eval"
+    , Arg.Set closure_eval
+    , "\tEvaluate Lfun and Cfun programs by compiling them to closures" )
   ; ("-init-heap-size", Arg.Set_int init_heap_size, "\tSet initial heap size")
   ; ("-no-fix-label", Arg.Set no_fix_label, "\tDisable `fix_label`")
+  ; ("-no-opt", Arg.Set no_opt, "\tSkip the `opt` pass before `pa`")
+  ; ( "-move-bias"
+    , Arg.Set move_bias
+    , "\tPrefer the registers of move-related variables" )
+  ; ( "-coalesce"
+    , Arg.Set coalesce
+    , "\tCoalesce move-related variables (implies -move-bias)" )
+  ; ( "-scalar-replace"
+    , Arg.Set scalar_replace
+    , "\tKeep the fields of non-escaping vectors in variables" )
+  ; ( "-merge-alloc-checks"
+    , Arg.Set merge_alloc_checks
+    , "\tShare one allocation check between neighbouring vectors" )
+  ; ( "-layout-blocks"
+    , Arg.Set layout_blocks
+    , "\tThread jumps through empty blocks and let jumps fall through" )
   ; ( "-sexp-width"
     , Arg.Set_int pp_line_limit
     , "\tSet S-expression maximum line width" )
   ; ("-sexp-indent", Arg.Set_int pp_indent, "\tSet S-expression indent")
-  ; ("-regs", Arg.Set_string regs, "\tSet registers to use") ]
+  ; ("-regs", Arg.Set_string regs, "\tSet registers to use")
+  ; ( "-time-passes"
+    , Arg.Set_string time_passes
+    , "\tWrite per-pass timings to a file (\"-\" for stderr)" ) ]
 
 let usage () =
   Printf.eprintf "usage: " ;
@@ -75,13 +126,13 @@ let anon_fun filename = input_file := filename
 
 let err_msg msg = Printf.eprintf "error: %s\n%!" msg
 
-let parse_args () =
-  if Array.length Sys.argv = 1 then
+let parse_args argv =
+  if Array.length argv = 1 then
     (* Only the program name; print a usage message. *)
     usage ()
   else (
     Arg.current := 0 ;
-    try Arg.parse_argv Sys.argv speclist anon_fun usage_msg with
+    try Arg.parse_argv argv speclist anon_fun usage_msg with
     | Arg.Help _ -> usage () )
 
 let check_pass pass = List.mem pass passes
@@ -98,53 +149,119 @@ let check_args () =
  * Running the compiler.
  * ---------------------------------------------------------------------- *)
 
+(* Pass timings.  With `-time-passes`, every pass (and parsing) writes
+ * one S-expression line when it finishes:
+ *   (<pass> (time <seconds>) (words <allocated words>) (major_gcs <n>))
+ * `words` counts every word allocated during the pass, whether or not
+ * it survives; `major_gcs` is the number of major collections.
+ * Some passes add their own statistics (`stats`) at the end of the line,
+ * e.g. `ar` adds `(moves_eliminated <n>)`. *)
+let timings_channel = ref None
+
+let open_timings () =
+  match !time_passes with
+  | "" -> ()
+  | "-" -> timings_channel := Some stderr
+  | filename -> timings_channel := Some (open_out filename)
+
+let close_timings () =
+  match !timings_channel with
+  | None -> ()
+  | Some ch ->
+    if ch == stderr then flush ch else close_out ch ;
+    timings_channel := None
+
+let allocated_words (st : Gc.stat) =
+  st.minor_words +. st.major_words -. st.promoted_words
+
+let timed ?(stats = fun () -> []) name f x =
+  match !timings_channel with
+  | None -> f x
+  | Some ch ->
+    let st0 = Gc.quick_stat () in
+    let t0 = Unix.gettimeofday () in
+    let result = f x in
+    let t1 = Unix.gettimeofday () in
+    let st1 = Gc.quick_stat () in
+    let extra =
+      stats ()
+      |> List.map (fun (k, n) -> Printf.sprintf " (%s %d)" k n)
+      |> String.concat ""
+    in
+    Printf.fprintf ch "(%s (time %.6f) (words %.0f) (major_gcs %d)%s)\n%!"
+      name (t1 -. t0)
+      (allocated_words st1 -. allocated_words st0)
+      (st1.major_collections - st0.major_collections)
+      extra ;
+    result
+
 (* Passes. *)
-let tc1 = Type_check_lfun.type_check
+let tc1 prog = timed "tc1" Type_check_lfun.type_check prog
 
-let sh = Shrink.shrink
+let sh prog = timed "sh" Shrink.shrink prog
 
-let un = Uniquify.uniquify
+let un prog = timed "un" Uniquify.uniquify prog
 
-let rf = Reveal_functions.reveal_functions
+let rf prog = timed "rf" Reveal_functions.reveal_functions prog
 
-let lf = Limit_functions.limit_functions
+let lf prog = timed "lf" Limit_functions.limit_functions prog
 
-let tc1b = Type_check_lfun_ref.type_check
+let tc1b prog = timed "tc1b" Type_check_lfun_ref.type_check prog
 
-let ea = Expose_allocation.expose_allocation
+let sr prog =
+  timed "sr"
+    ~stats:(fun () ->
+      [("vectors_replaced", Scalar_replace.vectors_replaced ())] )
+    Scalar_replace.scalar_replace prog
 
-let ug = Uncover_get.uncover_get
+(* With `-scalar-replace`, `sr` runs as part of `ea`. *)
+let ea prog =
+  prog
+  |> (if !scalar_replace then sr else Fun.id)
+  |> timed "ea"
+       ~stats:(fun () ->
+         [("checks_merged", Expose_allocation.checks_merged ())] )
+       Expose_allocation.expose_allocation
 
-let rc = Remove_complex.remove_complex_operands
+let ug prog = timed "ug" Uncover_get.uncover_get prog
 
-let ec = Explicate_control.explicate_control
+let rc prog = timed "rc" Remove_complex.remove_complex_operands prog
 
-let tc2 = Type_check_cfun.type_check
+let ec prog = timed "ec" Explicate_control.explicate_control prog
 
-let ru = Remove_unused.remove_unused_blocks
+let tc2 prog = timed "tc2" Type_check_cfun.type_check prog
 
-let si = Select_instructions.select_instructions
+let ru prog = timed "ru" Remove_unused.remove_unused_blocks prog
 
-let ul = Uncover_live.uncover_live
+let si prog = timed "si" Select_instructions.select_instructions prog
 
-let bi = Build_interference.build_interference
+let ul prog = timed "ul" Uncover_live.uncover_live prog
 
-let ar = Allocate_registers.allocate_registers
+let bi prog = timed "bi" Build_interference.build_interference prog
 
-let rj = Remove_jumps.remove_jumps
+let ar prog =
+  timed "ar"
+    ~stats:(fun () ->
+      [("moves_eliminated", Allocate_registers.moves_eliminated ())] )
+    Allocate_registers.allocate_registers prog
 
-let pi = Patch_instructions.patch_instructions
+let rj prog =
+  timed "rj"
+    ~stats:(fun () -> [("blocks_merged", Remove_jumps.blocks_merged ())])
+    Remove_jumps.remove_jumps prog
 
-let pc = Prelude_conclusion.prelude_conclusion
+let pi prog = timed "pi" Patch_instructions.patch_instructions prog
 
-let opt = Optimize.optimize
+let pc prog = timed "pc" Prelude_conclusion.prelude_conclusion prog
 
-let pa = Print_asm.print_asm
+let opt prog = timed "opt" Optimize.optimize prog
+
+let pa prog = timed "pa" Print_asm.print_asm prog
 
 (* File input. *)
 let read_sexp = S.load_sexp
 
-let read_lfun = Parser.parse
+let read_lfun filename = timed "parse" Parser.parse filename
 
 (* Conversions from S-expressions. *)
 let lfun_in = Lfun.program_of_sexp
@@ -239,42 +356,106 @@ let check_eval_only_error () =
     Printf.printf "ERROR: -eval and -only options are mutually exclusive!\n" ;
     exit 1 )
 
+(* Delay the evaluation of a program, so that the compiler passes
+ * before it run once however many times it's evaluated. *)
+let delay evaluator prog () = evaluator prog
+
+(* Delay the evaluation of an Lfun or Cfun program.
+ * With `-closure-eval`, the program is also compiled to closures once. *)
+let lfun_delayed prog =
+  if !closure_eval then Interp_lfun_closure.compile prog
+  else delay lfun_eval prog
+
+let cfun_delayed prog =
+  if !closure_eval then Interp_cfun_closure.compile prog
+  else delay cfun_eval prog
+
 (* Evaluator passes. *)
 let eval_alist =
-  [ ("lfun", fun exp -> exp |> lfun_eval)
-  ; ("tc1", fun exp -> exp |> tc1 |> lfun_eval)
-  ; ("sh", fun exp -> exp |> tc1 |> sh |> lfun_shrink_eval)
-  ; ("un", fun exp -> exp |> tc1 |> sh |> un |> lfun_shrink_eval)
-  ; ("rf", fun exp -> exp |> tc1 |> sh |> un |> rf |> lfun_ref_eval)
-  ; ("lf", fun exp -> exp |> tc1 |> sh |> un |> rf |> lf |> lfun_ref_eval)
+  [ ("lfun", fun exp -> exp |> lfun_delayed)
+  ; ("tc1", fun exp -> exp |> tc1 |> lfun_delayed)
+  ; ("sh", fun exp -> exp |> tc1 |> sh |> delay lfun_shrink_eval)
+  ; ("un", fun exp -> exp |> tc1 |> sh |> un |> delay lfun_shrink_eval)
+  ; ("rf", fun exp -> exp |> tc1 |> sh |> un |> rf |> delay lfun_ref_eval)
+  ; ( "lf"
+    , fun exp -> exp |> tc1 |> sh |> un |> rf |> lf |> delay lfun_ref_eval )
   ; ( "tc1b"
-    , fun exp -> exp |> tc1 |> sh |> un |> rf |> lf |> tc1b |> lfun_ref_eval )
+    , fun exp ->
+        exp |> tc1 |> sh |> un |> rf |> lf |> tc1b |> delay lfun_ref_eval )
   ; ( "ea"
     , fun exp ->
-        exp |> tc1 |> sh |> un |> rf |> lf |> tc1b |> ea |> lfun_ref_alloc_eval
-    )
+        exp |> tc1 |> sh |> un |> rf |> lf |> tc1b |> ea
+        |> delay lfun_ref_alloc_eval )
   ; ( "ug"
     , fun exp ->
         exp |> tc1 |> sh |> un |> rf |> lf |> tc1b |> ea |> ug
-        |> lfun_ref_alloc_get_eval )
+        |> delay lfun_ref_alloc_get_eval )
   ; ( "rc"
     , fun exp ->
         exp |> tc1 |> sh |> un |> rf |> lf |> tc1b |> ea |> ug |> rc
-        |> lfun_ref_mon_eval )
+        |> delay lfun_ref_mon_eval )
   ; ( "ec"
     , fun exp ->
         exp |> tc1 |> sh |> un |> rf |> lf |> tc1b |> ea |> ug |> rc |> ec
-        |> cfun_eval )
+        |> cfun_delayed )
   ; ( "tc2"
     , fun exp ->
         exp |> tc1 |> sh |> un |> rf |> lf |> tc1b |> ea |> ug |> rc |> ec
-        |> tc2 |> cfun_eval )
+        |> tc2 |> cfun_delayed )
   ; ( "ru"
     , fun exp ->
         exp |> tc1 |> sh |> un |> rf |> lf |> tc1b |> ea |> ug |> rc |> ec
-        |> tc2 |> ru |> cfun_eval ) ]
-
-(* Run the evaluator for a pass and print the result. *)
+        |> tc2 |> ru |> cfun_delayed ) ]
+
+(* Read all of an input channel into a string. *)
+let read_all ch =
+  let buf = Buffer.create 1024 in
+  let rec iter () =
+    match input_char ch with
+    | exception End_of_file -> Buffer.contents buf
+    | c ->
+      Buffer.add_char buf c ;
+      iter ()
+  in
+  iter ()
+
+(* Split a batch of input sets, separated by lines holding only `;;`,
+ * into the input of each set (each of its lines ending in a newline). *)
+let split_batch s =
+  let s =
+    if String.ends_with ~suffix:"\n" s then String.sub s 0 (String.length s - 1)
+    else s
+  in
+  let lines = if s = "" then [] else String.split_on_char '\n' s in
+  let input_of rev_lines =
+    String.concat "" (List.rev_map (fun line -> line ^ "\n") rev_lines)
+  in
+  let rec group rev_lines inputs = function
+    | [] -> List.rev (input_of rev_lines :: inputs)
+    | ";;" :: rest -> group [] (input_of rev_lines :: inputs) rest
+    | line :: rest -> group (line :: rev_lines) inputs rest
+  in
+  group [] [] lines
+
+(* The input sets to evaluate a program on: each of the `-batch`
+ * input sets, or else all of standard input. *)
+let read_inputs () =
+  let input = read_all stdin in
+  if !batch then split_batch input else [input]
+
+(* Evaluate a program (delayed) on an input set.
+ * Return `(value <int>)` or `(error <message>)`. *)
+let eval_result run input =
+  Interp_utils.set_input input ;
+  try slist [satom "value"; satom (string_of_int (run ()))] with
+  | Failure msg -> slist [satom "error"; satom msg]
+  | End_of_file -> slist [satom "error"; satom "end of input"]
+  | (Out_of_memory | Sys.Break) as e -> raise e
+  | e -> slist [satom "error"; satom (Printexc.to_string e)]
+
+(* Run the evaluator for a pass and print the result.
+ * With `-batch`, compile the program once, evaluate it on every
+ * input set and print one `eval_result` line per set. *)
 let run_evaluator pass filename =
   check_eval_only_error () ;
   match List.assoc_opt pass eval_alist with
@@ -285,7 +466,46 @@ let run_evaluator pass filename =
     else (
       Printf.eprintf "invalid pass: %s\n" pass ;
       exit 1 )
-  | Some f -> read_lfun filename |> f |> print_int
+  | Some f ->
+    let run = read_lfun filename |> f in
+    if !batch then
+      List.iter
+        (fun input ->
+          Printf.printf "%s\n%!" (S.to_string (eval_result run input)) )
+        (read_inputs ())
+    else run () |> print_int
+
+(* Run every pass that has an evaluator exactly once, evaluating the
+ * program after each one.  Each evaluation reads from its own copy of
+ * standard input.  Print one S-expression per pass:
+ *   (<pass> (value <int>))  or  (<pass> (error <message>))
+ * With `-batch`, the program is evaluated after each pass on every
+ * input set, and each line has one result per set, in order.
+ * If a pass itself fails, the results for the earlier passes have
+ * already been printed and the error propagates as usual. *)
+let run_eval_all filename =
+  check_eval_only_error () ;
+  let inputs = read_inputs () in
+  let eval pass delayed prog =
+    let results = List.map (eval_result (delayed prog)) inputs in
+    Printf.printf "%s\n%!" (S.to_string (slist (satom pass :: results))) ;
+    prog
+  in
+  read_lfun filename
+  |> eval "lfun" lfun_delayed
+  |> tc1 |> eval "tc1" lfun_delayed
+  |> sh |> eval "sh" (delay lfun_shrink_eval)
+  |> un |> eval "un" (delay lfun_shrink_eval)
+  |> rf |> eval "rf" (delay lfun_ref_eval)
+  |> lf |> eval "lf" (delay lfun_ref_eval)
+  |> tc1b |> eval "tc1b" (delay lfun_ref_eval)
+  |> ea |> eval "ea" (delay lfun_ref_alloc_eval)
+  |> ug |> eval "ug" (delay lfun_ref_alloc_get_eval)
+  |> rc |> eval "rc" (delay lfun_ref_mon_eval)
+  |> ec |> eval "ec" cfun_delayed
+  |> tc2 |> eval "tc2" cfun_delayed
+  |> ru |> eval "ru" cfun_delayed
+  |> ignore
 
 (* The `-only` passes. *)
 let only_alist =
@@ -395,7 +615,8 @@ let run_pass pass filename =
   | None ->
     if pass = "pa" then
       read_lfun filename |> tc1 |> sh |> un |> rf |> lf |> tc1b |> ea |> ug
-      |> rc |> ec |> tc2 |> ru |> si |> ul |> bi |> ar |> rj |> pi |> pc |> opt
+      |> rc |> ec |> tc2 |> ru |> si |> ul |> bi |> ar |> rj |> pi |> pc
+      |> (if !no_opt then Fun.id else opt)
       |> pa |> print_string
     else (
       Printf.eprintf "invalid pass: %s\n" pass ;
@@ -404,24 +625,146 @@ let run_pass pass filename =
 
 let run_compiler () =
   let filename = !input_file in
-  if !eval then run_evaluator !pass filename
+  if !eval_all then run_eval_all filename
+  else if !eval then run_evaluator !pass filename
   else if !only then run_only !pass filename
   else run_pass !pass filename
 
-(* ----------------------------------------------------------------------
- * Entry point.
- * ---------------------------------------------------------------------- *)
-
-let () =
+(* Run the compiler on a full command line (including the program name). *)
+let main argv =
   try
-    parse_args () ;
+    parse_args argv ;
     check_args () ;
     if !regs <> "" then
       Allocate_registers.set_register_color_list (reg_list_of_string !regs) ;
-    run_compiler ()
+    Allocate_registers.set_move_biasing (!move_bias || !coalesce) ;
+    Allocate_registers.set_coalescing !coalesce ;
+    Expose_allocation.set_check_merging !merge_alloc_checks ;
+    Remove_jumps.set_block_layout !layout_blocks ;
+    open_timings () ;
+    Fun.protect ~finally:close_timings run_compiler
   with
   | Failure msg
    |Sys_error msg
    |Type_check.Type_error msg
    |Arg.Bad msg ->
     Printf.eprintf "%s\n%!" msg
+
+(* ----------------------------------------------------------------------
+ * Server mode.
+ * ---------------------------------------------------------------------- *)
+
+(* With `-server`, the compiler reads one request per line on stdin and
+ * writes one reply per line on stdout, both as S-expressions:
+ *
+ *   request: ((args (<arg> ...)) (input <string>))
+ *   reply:   ((status <int>) (stdout <string>) (stderr <string>))
+ *
+ * `args` are the arguments of an ordinary `compile` invocation and
+ * `input` is supplied to it as standard input.  The server announces
+ * itself with a `(ready)` line before reading the first request.
+ *
+ * Each request runs in a forked child of the (already started) server.
+ * This avoids paying the start-up cost on every invocation, but the
+ * global compiler state (gensym counters, register settings, the
+ * command-line flags etc.) never leaks from one request to the next. *)
+
+let parse_request line =
+  let atom = function
+    | S.Atom a -> a
+    | _ -> failwithf "server: invalid request: %s" line
+  in
+  match S.of_string line with
+  | S.List [S.List [S.Atom "args"; S.List args]; S.List [S.Atom "input"; input]]
+    ->
+    (List.map atom args, atom input)
+  | _ -> failwithf "server: invalid request: %s" line
+
+let write_file filename s =
+  let ch = open_out_bin filename in
+  output_string ch s ; close_out ch
+
+let read_file filename =
+  let ch = open_in_bin filename in
+  let s = really_input_string ch (in_channel_length ch) in
+  close_in ch ; s
+
+(* Run `compile` with arguments `args` and standard input `input`
+ * in a child process.  Return the exit status and the contents of
+ * standard output and standard error. *)
+let serve_request args input =
+  let in_file = Filename.temp_file "compile" ".in" in
+  let out_file = Filename.temp_file "compile" ".out" in
+  let err_file = Filename.temp_file "compile" ".err" in
+  write_file in_file input ;
+  flush_all () ;
+  match Unix.fork () with
+  | 0 ->
+    let redirect filename flag fd =
+      let fd' = Unix.openfile filename [flag] 0o600 in
+      Unix.dup2 fd' fd ; Unix.close fd'
+    in
+    redirect in_file Unix.O_RDONLY Unix.stdin ;
+    redirect out_file Unix.O_WRONLY Unix.stdout ;
+    redirect err_file Unix.O_WRONLY Unix.stderr ;
+    ( try
+        main (Array.of_list ("compile" :: args)) ;
+        exit 0
+      with e ->
+        (* Report it as an uncaught exception would be. *)
+        let bt = Printexc.get_raw_backtrace () in
+        Printexc.default_uncaught_exception_handler e bt ;
+        exit 2 )
+  | pid ->
+    let status =
+      match Unix.waitpid [] pid with
+      | _, Unix.WEXITED n -> n
+      | _, (Unix.WSIGNALED _ | Unix.WSTOPPED _) -> -1
+    in
+    let out = read_file out_file in
+    let err = read_file err_file in
+    List.iter Sys.remove [in_file; out_file; err_file] ;
+    (status, out, err)
+
+let serve () =
+  (* Requests and replies go through private copies of the standard
+   * descriptors, so the channels children inherit as their own
+   * stdin/stdout never contain any server traffic. *)
+  let requests = Unix.in_channel_of_descr (Unix.dup Unix.stdin) in
+  let replies = Unix.out_channel_of_descr (Unix.dup Unix.stdout) in
+  let reply sexp =
+    output_string replies (S.to_string sexp) ;
+    output_char replies '\n' ;
+    flush replies
+  in
+  let field name value = slist [satom name; satom value] in
+  reply (slist [satom "ready"]) ;
+  let rec loop () =
+    match input_line requests with
+    | exception End_of_file -> ()
+    | "" -> loop ()
+    | line ->
+      let status, out, err =
+        try
+          let args, input = parse_request line in
+          serve_request args input
+        with
+        | e -> (1, "", Printexc.to_string e ^ "\n")
+      in
+      reply
+        (slist
+           [ field "status" (string_of_int status)
+           ; field "stdout" out
+           ; field "stderr" err ] ) ;
+      loop ()
+  in
+  loop ()
+
+(* ----------------------------------------------------------------------
+ * Entry point.
+ * ---------------------------------------------------------------------- *)
+
+let () =
+  match Sys.argv with
+  | [|_; "-server"|] -> serve ()
+  | argv -> main argv
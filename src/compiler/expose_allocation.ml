@@ -8,6 +8,17 @@ let new_var () = fresh ~base:"$ea" ~sep:"."
 
 let new_void_var () = fresh ~base:"_" ~sep:"."
 
+(* If true, merge the allocation checks of neighbouring vectors. *)
+let merge_checks = ref false
+
+let set_check_merging b = merge_checks := b
+
+(* Number of allocation checks removed by merging
+   in the last call to `expose_allocation`. *)
+let num_merged = ref 0
+
+let checks_merged () = !num_merged
+
 (* weird formatting, but makes sense, show indent of chained OR cases *)
 let is_atom (e : exp) : bool =
   match e with
@@ -23,9 +34,62 @@ let convert_atom (e : exp) : [> `Atom of exp | `VarExp of string * exp] =
   | _ when is_atom e -> `Atom e
   | _ -> `VarExp (new_var (), e)
 
+(* Check if evaluating an expression can't allocate:
+   it contains no vectors and no function calls. *)
+let rec allocation_free (e : L.exp) : bool =
+  match e with
+  | L.Vec _
+   |L.Apply _ ->
+    false
+  | L.Void
+   |L.Bool _
+   |L.Int _
+   |L.Var _
+   |L.FunRef _ ->
+    true
+  | L.Prim (_, es) -> List.for_all allocation_free es
+  | L.Begin (es, e) -> List.for_all allocation_free es && allocation_free e
+  | L.If (e1, e2, e3) ->
+    allocation_free e1 && allocation_free e2 && allocation_free e3
+  | L.While (e1, e2)
+   |L.Let (_, e1, e2)
+   |L.VecSet (e1, _, e2) ->
+    allocation_free e1 && allocation_free e2
+  | L.SetBang (_, e)
+   |L.VecLen e
+   |L.VecRef (e, _) ->
+    allocation_free e
+
+(* Check if a vector only allocates itself. *)
+let is_leaf_vec (e : L.exp) : bool =
+  match e with
+  | L.Vec (es, Some _) -> List.for_all allocation_free es
+  | _ -> false
+
+(* An allocation chain is a sequence of nested `let`s
+   (`(let (x1 e1) (let (x2 e2) ...))`) where each `ei` is either
+   a vector that only allocates itself or allocation-free.
+   Nothing else can allocate between the vectors of the chain,
+   so one check can make room for all of them.
+   Return the number of vectors in the chain starting at `e`
+   and the total number of bytes they need. *)
+let rec chain_size (e : L.exp) : int * int =
+  match e with
+  | L.Let (_, (L.Vec (es, _) as e1), e2) when is_leaf_vec e1 ->
+    let n, nbytes = chain_size e2 in
+    (n + 1, nbytes + ((List.length es + 1) * 8))
+  | L.Let (_, e1, e2) when allocation_free e1 -> chain_size e2
+  | _ -> (0, 0)
+
 let rec expose_allocation_exp (e : L.exp) : exp =
   match e with
   | L.Vec (_, None) -> failwith "[ea:expose_allocation_exp] Vec should be typed"
+  | L.Let (_, e1, _) when !merge_checks && is_leaf_vec e1 -> (
+    match chain_size e with
+    | n, nbytes when n > 1 ->
+      num_merged := !num_merged + n - 1 ;
+      Let (new_void_var (), alloc_check nbytes, expose_chain e)
+    | _ -> expose_let e )
   | L.Vec (es, Some ty) ->
     (* look for vectors at any point *)
     convert_vec (List.map expose_allocation_exp es) ty
@@ -48,10 +112,7 @@ let rec expose_allocation_exp (e : L.exp) : exp =
     let cond = expose_allocation_exp cond in
     let body = expose_allocation_exp body in
     While (cond, body)
-  | L.Let (v, e1, e2) ->
-    let e1 = expose_allocation_exp e1 in
-    let e2 = expose_allocation_exp e2 in
-    Let (v, e1, e2)
+  | L.Let _ -> expose_let e
   | L.VecLen e -> VecLen (expose_allocation_exp e)
   | L.VecRef (e, idx) -> VecRef (expose_allocation_exp e, idx)
   | L.VecSet (e1, idx, e2) ->
@@ -62,7 +123,38 @@ let rec expose_allocation_exp (e : L.exp) : exp =
   | L.Apply (f, args) ->
     Apply (expose_allocation_exp f, List.map expose_allocation_exp args)
 
-and convert_vec (es : exp list) (ty : Types.ty) : exp =
+and expose_let (e : L.exp) : exp =
+  match e with
+  | L.Let (v, e1, e2) ->
+    let e1 = expose_allocation_exp e1 in
+    let e2 = expose_allocation_exp e2 in
+    Let (v, e1, e2)
+  | _ -> expose_allocation_exp e
+
+(* Convert an allocation chain (see `chain_size`)
+   whose allocation check has already been made. *)
+and expose_chain (e : L.exp) : exp =
+  match e with
+  | L.Let (v, (L.Vec (es, Some ty) as vec), e2) when is_leaf_vec vec ->
+    let e1 = convert_vec ~checked:true (List.map expose_allocation_exp es) ty in
+    Let (v, e1, expose_chain e2)
+  | L.Let (v, e1, e2) when allocation_free e1 ->
+    Let (v, expose_allocation_exp e1, expose_chain e2)
+  | _ -> expose_allocation_exp e
+
+(* The expression `(if (< (+ free_ptr nbytes) fromspace_end) (void)
+   (collect nbytes))`, which makes room for `nbytes` bytes. *)
+and alloc_check (nbytes : int) : exp =
+  let if_cond =
+    Prim
+      ( `Lt
+      , [ Prim (`Add, [GlobalVal "free_ptr"; Int nbytes])
+        ; GlobalVal "fromspace_end" ] )
+  in
+  If (if_cond, Void, Collect nbytes)
+
+(* If `checked` is true, room has already been made for the vector. *)
+and convert_vec ?(checked = false) (es : exp list) (ty : Types.ty) : exp =
   (* 1/2 - recurse on all subexps es and generate fresh names *)
   let tagged_es = List.map convert_atom es in
   (* 3 - generate fresh name for result vector *)
@@ -71,15 +163,6 @@ and convert_vec (es : exp list) (ty : Types.ty) : exp =
   (* 4 - generate the if expr *)
   let len = List.length es in
   let nbytes = (len + 1) * 8 in
-  let if_cond =
-    Prim
-      ( `Lt
-      , [ Prim (`Add, [GlobalVal "free_ptr"; Int nbytes])
-        ; GlobalVal "fromspace_end" ] )
-  in
-  let if_then = Void in
-  let if_else = Collect nbytes in
-  let if_exp = If (if_cond, if_then, if_else) in
   (* 5/6 - generate all !vector-set expressions and wrapping _ let's *)
   let enumerated_tagged_es = List.mapi (fun i e -> (i, e)) tagged_es in
   let vector_set_es =
@@ -92,11 +175,10 @@ and convert_vec (es : exp list) (ty : Types.ty) : exp =
       enumerated_tagged_es vector_var
   in
   (* 8 - put it all together *)
+  let allocate = Let (vector_name, Allocate (len, ty), vector_set_es) in
   let inside =
-    Let
-      ( new_void_var ()
-      , if_exp
-      , Let (vector_name, Allocate (len, ty), vector_set_es) )
+    if checked then allocate
+    else Let (new_void_var (), alloc_check nbytes, allocate)
   in
   (* 7 - generate the outermost lets,
      the order is weird here 8 before 7 because we have to build the outer lets
@@ -118,4 +200,5 @@ let expose_allocation_def (ldef : L.def) =
   Def (name, fcont')
 
 let expose_allocation (L.Program ds) =
+  num_merged := 0 ;
   Program (List.map expose_allocation_def ds)
@@ -1,3 +1,12 @@
 (** "Expose allocation" pass: make vector allocation explicit. *)
 
 val expose_allocation : Lfun_ref.program -> Lfun_ref_alloc.program
+
+val set_check_merging : bool -> unit
+(** If the argument is `true`, neighbouring vectors that nothing else
+    can allocate between share one allocation check (and one `Collect`)
+    for all of their bytes. *)
+
+val checks_merged : unit -> int
+(** Return the number of allocation checks that the last call to
+    `expose_allocation` saved by merging. *)
@@ -16,7 +16,15 @@ module type GraphColor = sig
 
   type 'a eltmap
 
-  val color : graph -> int eltmap -> int eltmap
+  val color : ?moves:graph -> k:int -> graph -> int eltmap -> int eltmap
+
+  val coalesce :
+       k:int
+    -> can_merge:(elt -> elt -> bool)
+    -> graph
+    -> graph
+    -> int eltmap
+    -> graph * graph * elt eltmap
 end
 
 module Make
@@ -105,6 +113,32 @@ module Make
     in
     f 0
 
+  (* Move biasing: pick the smallest free, non-negative color
+   * of the already-colored elements that are move-related to `e`,
+   * so that the moves between them can be removed.
+   * If there isn't one, pick the smallest free color.
+   * Colors from `k` up are spills, so a move-related spill color is
+   * only used if no register color (less than `k`) is free anyway. *)
+  let pick_biased_color (moves : graph) (k : int) (e : elt) (map : nodemap)
+    (precolored_map : int eltmap) (set : IntSet.t) : int =
+    let color_of m =
+      match EMap.find_opt m map with
+      | Some {color = Some c; saturation = _} -> Some c
+      | _ -> EMap.find_opt m precolored_map
+    in
+    let default = pick_color set in
+    let usable c =
+      c >= 0 && (not (IntSet.mem c set)) && (c < k || default >= k)
+    in
+    let biased =
+      Graph.neighbors_or_none moves e
+      |> List.filter_map color_of
+      |> List.filter usable
+    in
+    match biased with
+    | [] -> default
+    | c :: cs -> List.fold_left min c cs
+
   (* Add a color to:
    * a) an element's node
    * b) the element's neighbors' saturation maps
@@ -141,7 +175,8 @@ module Make
     in
     EMap.fold handle_node map EMap.empty
 
-  let color (g : graph) (precolored_map : int eltmap) : int eltmap =
+  let color ?moves ~(k : int) (g : graph) (precolored_map : int eltmap) :
+    int eltmap =
     (* Algorithm:
      * - find the uncolored location with the highest priority
      * - remove it from the queue
@@ -163,9 +198,107 @@ module Make
           let node =
             EMap.find_or_fail e map ~err_msg:"color: element not in map!"
           in
-          let color = pick_color node.saturation in
+          let color =
+            match moves with
+            | None -> pick_color node.saturation
+            | Some moves ->
+              pick_biased_color moves k e map precolored_map node.saturation
+          in
           let map', pq'' = add_color g e color map pq' in
           iter map' pq''
     in
     make_final_color_map (iter init_map init_pq)
+
+  (* ------------------------------------------------------------ *)
+
+  (* Conservative coalescing. *)
+
+  module ESet = Set.Make (Elt)
+
+  let coalesce ~(k : int) ~(can_merge : elt -> elt -> bool) (g : graph)
+    (moves : graph) (precolored_map : int eltmap) : graph * graph * elt eltmap
+    =
+    (* The interference graph as a map from elements to neighbor sets,
+     * updated as elements are merged. *)
+    let adj =
+      ref
+        (List.fold_left
+           (fun m (e, ns) -> EMap.add e (ESet.of_list ns) m)
+           EMap.empty (Graph.to_list g) )
+    in
+    (* Map from merged elements to the elements they were merged into. *)
+    let merged = ref EMap.empty in
+    let rec find e =
+      match EMap.find_opt e !merged with
+      | Some e' -> find e'
+      | None -> e
+    in
+    let neighbors e =
+      match EMap.find_opt e !adj with
+      | Some ns -> ns
+      | None -> ESet.empty
+    in
+    let is_precolored e = EMap.mem e precolored_map in
+    let colorable e =
+      match EMap.find_opt e precolored_map with
+      | Some c -> c >= 0
+      | None -> true
+    in
+    (* Precolored elements count as having infinite degree. *)
+    let significant e = is_precolored e || ESet.cardinal (neighbors e) >= k in
+    let briggs u v =
+      let ns = ESet.union (neighbors u) (neighbors v) in
+      ESet.cardinal (ESet.filter significant ns) < k
+    in
+    let george r v =
+      ESet.for_all
+        (fun t -> ESet.mem r (neighbors t) || not (significant t))
+        (neighbors v)
+    in
+    (* Merge `v` into `u`. *)
+    let merge u v =
+      let nv = neighbors v in
+      ESet.iter
+        (fun t ->
+          adj := EMap.add t (ESet.add u (ESet.remove v (neighbors t))) !adj )
+        nv ;
+      adj := EMap.add u (ESet.union (neighbors u) nv) (EMap.remove v !adj) ;
+      merged := EMap.add v u !merged
+    in
+    let try_merge (a, b) =
+      let a = find a and b = find b in
+      if
+        Elt.compare a b <> 0
+        && colorable a && colorable b
+        && (not (is_precolored a && is_precolored b))
+        && (not (ESet.mem b (neighbors a)))
+        && can_merge a b
+      then
+        if is_precolored a then (if george a b then merge a b)
+        else if is_precolored b then (if george b a then merge b a)
+        else if briggs a b then merge a b
+    in
+    let move_pairs =
+      Graph.to_list moves
+      |> List.concat_map (fun (e, ns) ->
+             List.filter_map
+               (fun n -> if Elt.compare e n < 0 then Some (e, n) else None)
+               ns )
+    in
+    List.iter try_merge move_pairs ;
+    (* Rebuild the graphs with the merged elements. *)
+    let g' =
+      let g = EMap.fold (fun e _ g -> Graph.add_vertex g e) !adj Graph.empty in
+      EMap.fold
+        (fun e ns g -> ESet.fold (fun n g -> Graph.add_edge g e n) ns g)
+        !adj g
+    in
+    let moves' =
+      List.fold_left
+        (fun m (a, b) ->
+          let a = find a and b = find b in
+          if Elt.compare a b = 0 then m else Graph.add_edge_new m a b )
+        Graph.empty move_pairs
+    in
+    (g', moves', EMap.mapi (fun e _ -> find e) !merged)
 end
@@ -17,16 +17,50 @@ module type GraphColor = sig
   (** Type of the graph. *)
   type graph
 
-  val color : graph -> int eltmap -> int eltmap
+  val color : ?moves:graph -> k:int -> graph -> int eltmap -> int eltmap
   (** Compute a graph coloring.
         Colors are represented by integers.
         Arguments:
+        - an optional move graph; when it is given, an element
+          gets the (non-negative) color of an already-colored
+          move-related element whenever that color is free
+          (move biasing), unless that color is `k` or more
+          and a color less than `k` is free
+        - the number of register colors (`k`); colors from `k` up
+          stand for spills
         - an interference graph
         - a precolored node map; this is a map
           between graph elements and colors for elements
           which have colors before the algorithm begins
         Return value:
         - a complete mapping of graph elements to colors *)
+
+  val coalesce :
+       k:int
+    -> can_merge:(elt -> elt -> bool)
+    -> graph
+    -> graph
+    -> int eltmap
+    -> graph * graph * elt eltmap
+  (** Conservatively coalesce move-related elements.
+        Arguments:
+        - the number of colors available (`k`)
+        - a predicate saying whether two elements may share a color
+          at all (other than by interfering)
+        - an interference graph
+        - a move graph
+        - a precolored node map (as for `color`); precolored elements
+          with negative colors are never coalesced
+        Two uncolored elements are merged if the result has fewer than
+        `k` neighbors of degree `k` or more (Briggs' test).  An
+        uncolored element is merged into a precolored one if each of its
+        neighbors either interferes with the precolored element already
+        or has degree less than `k` (George's test).
+        Return value:
+        - the coalesced interference graph
+        - the coalesced move graph
+        - a map from every merged element to the element it was
+          merged into, which is what it should be colored like *)
 end
 
 module Make
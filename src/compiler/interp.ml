@@ -45,7 +45,7 @@ let interp_cmp_op_simple (op : cmp_op) (args : [> simple_value] list) :
 let interp_stmt_op_simple (op : stmt_op) (args : [> simple_value] list) :
   simple_value =
   match (op, args) with
-  | `Read, [] -> `IntV (read_int ())
+  | `Read, [] -> `IntV (Interp_utils.read_int ())
   | `Read, _ -> failwith "interp_op: read : wrong number of arguments"
   | `Print, [`IntV i] -> Printf.printf "%d\n" i ; `VoidV
   | `Print, [_] -> failwith "interp_op: print : wrong type"
@@ -54,7 +54,7 @@ let interp_stmt_op_simple (op : stmt_op) (args : [> simple_value] list) :
 let interp_core_op_simple (op : core_op) (args : [> simple_value] list) :
   simple_value =
   match (op, args) with
-  | `Read, [] -> `IntV (read_int ())
+  | `Read, [] -> `IntV (Interp_utils.read_int ())
   | `Read, _ -> failwith "interp_op: read : wrong number of arguments"
   | `Print, [`IntV i] -> Printf.printf "%d\n" i ; `VoidV
   | `Print, [_] -> failwith "interp_op: print : wrong type"
@@ -0,0 +1,231 @@
+open Support.Utils
+open Types
+open Type_check
+open Interp
+open Interp_utils
+open Cfun
+open Interp_lfun_closure
+
+(* ----------------------------------------------------------------------
+ * Closure-compiling interpreter.
+ * ---------------------------------------------------------------------- *)
+
+(* This interpreter gives the same results (and errors) as `Interp_cfun`,
+   compiling each function into closures the way `Interp_lfun_closure`
+   does.  The variables of a function are its arguments and the
+   variables it assigns to; each one gets a slot of the frame.
+   Each block is compiled once, and jumps to it (`goto` and the
+   branches of `if`) call its code directly
+   instead of looking its label up. *)
+
+(* Generate an "uninitialized" default value for any type.
+ * The actual value doesn't matter. *)
+let rec default_val (t : ty) : value =
+  match t with
+  | Unit -> `VoidV
+  | Boolean -> `BoolV false
+  | Integer -> `IntV 0
+  | Vector ts -> `VecV (Array.map default_val ts)
+  | Function (ts, _) ->
+    (* A function with no blocks. *)
+    let fv = new_fun_value (List.length ts) in
+    fv.code <- fail "interp_lbl: no target for label: start" ;
+    `FunV fv
+
+(* What the compiler needs to know about a function:
+   the slots of its variables, the functions of the program
+   and the code of its blocks (filled in once they're compiled,
+   since blocks can jump to each other). *)
+type scope =
+  {slots : int VarMap.t; funs : value VarMap.t; blocks : code ref LabelMap.t}
+
+(* The variables a function body assigns to. *)
+let assigned_vars (body : (label * tail) list) : var list =
+  let rec aux vars = function
+    | Seq (Assign (v, _), t) -> aux (v :: vars) t
+    | Seq (_, t) -> aux vars t
+    | _ -> vars
+  in
+  List.fold_left (fun vars (_, t) -> aux vars t) [] body
+
+(* Give each argument of a function its slot, then each variable
+   it assigns to.  Return the slots and the size of the frame. *)
+let make_slots (args : var list) (vars : var list) : int VarMap.t * int =
+  let slots, n =
+    List.fold_left
+      (fun (slots, i) v -> (VarMap.add v i slots, i + 1))
+      (VarMap.empty, 0) args
+  in
+  List.fold_left
+    (fun (slots, n) v ->
+      if VarMap.mem v slots then (slots, n) else (VarMap.add v n slots, n + 1) )
+    (slots, n) vars
+
+let compile_atm (scope : scope) (a : atm) : code =
+  match a with
+  | Void -> fun _ -> `VoidV
+  | Bool b ->
+    let v = `BoolV b in
+    fun _ -> v
+  | Int i ->
+    let v = `IntV i in
+    fun _ -> v
+  | Var v -> (
+    match VarMap.find_opt v scope.slots with
+    | Some slot -> fun frame -> frame.(slot)
+    | None -> (
+      match VarMap.find_opt v scope.funs with
+      | Some f -> fun _ -> f
+      | None -> fail (Printf.sprintf "interp_atm: unbound name: %s" v) ) )
+
+let compile_args (scope : scope) (atms : atm list) : code array =
+  Array.of_list (List.map (compile_atm scope) atms)
+
+(* Compile `vector-set!`; `who` names the caller in error messages. *)
+let vec_set (who : string) (a1 : code) (i : int) (a2 : code) (frame : frame)
+    : unit =
+  match a1 frame with
+  | `VecV vs ->
+    if i >= 0 && i < Array.length vs then vs.(i) <- a2 frame
+    else failwithf "%s: vector-set! : index out of range" who
+  | _ -> failwithf "%s: vector-set! : wrong types" who
+
+let compile_exp (scope : scope) (e : exp) : code =
+  let comp = compile_atm scope in
+  match e with
+  | Atm a -> comp a
+  | Prim (op, [a1; a2]) ->
+    let a1 = comp a1 in
+    let a2 = comp a2 in
+    fun frame -> (interp_core_op_simple op [a1 frame; a2 frame] :> value)
+  | Prim (op, args) ->
+    let args = List.map comp args in
+    fun frame ->
+      (interp_core_op_simple op (List.map (fun a -> a frame) args) :> value)
+  | Allocate (n, Vector ts) ->
+    if Array.length ts <> n then fail "interp_exp: malformed `Allocate` case"
+    else
+      let size = 8 * (n + 1) in
+      fun _ ->
+        allocate size ;
+        `VecV (Array.map default_val ts)
+  | Allocate (_, t) ->
+    fail
+      (Printf.sprintf "interp_exp: can't allocate type (%s)" (string_of_ty t))
+  | GlobalVal v -> (
+    match v with
+    | "free_ptr" -> fun _ -> `IntV !free_ptr
+    | "fromspace_end" -> fun _ -> `IntV !fromspace_end
+    | _ -> fail (Printf.sprintf "unknown global variable (%s)" v) )
+  | VecLen a -> (
+    let a = comp a in
+    fun frame ->
+      match a frame with
+      | `VecV vs -> `IntV (Array.length vs)
+      | _ -> failwith "interp_exp: vector-length : wrong type" )
+  | VecRef (a, i) -> (
+    let a = comp a in
+    fun frame ->
+      match a frame with
+      | `VecV vs ->
+        if i >= 0 && i < Array.length vs then vs.(i)
+        else failwith "interp_exp: vector-ref : index out of range"
+      | _ -> failwith "interp_exp: vector-ref : wrong types" )
+  | VecSet (a1, i, a2) ->
+    let set = vec_set "interp_exp" (comp a1) i (comp a2) in
+    fun frame ->
+      set frame ;
+      `VoidV
+  | FunRef (Label v, _) -> (
+    match VarMap.find_opt v scope.funs with
+    | Some f -> fun _ -> f
+    | None ->
+      fail (Printf.sprintf "interp_exp: unbound function name: %s" v) )
+  | Call (atm, atms) ->
+    call "interp_exp" (comp atm) (compile_args scope atms)
+
+let compile_stmt (scope : scope) (s : stmt) : frame -> unit =
+  match s with
+  | Assign (v, e) ->
+    let slot = VarMap.find v scope.slots in
+    let e = compile_exp scope e in
+    fun frame -> frame.(slot) <- e frame
+  | PrimS (op, args) ->
+    let args = List.map (compile_atm scope) args in
+    fun frame ->
+      ignore (interp_stmt_op_simple op (List.map (fun a -> a frame) args))
+  | CallS (atm, atms) ->
+    let f = compile_atm scope atm in
+    let c = call "interp_exp" f (compile_args scope atms) in
+    fun frame -> ignore (c frame)
+  | Collect n -> fun _ -> collect n
+  | VecSetS (a1, i, a2) ->
+    vec_set "interp_stmt" (compile_atm scope a1) i (compile_atm scope a2)
+
+(* Compile a jump to the block `lbl`. *)
+let jump (scope : scope) (lbl : label) : code =
+  match LabelMap.find_opt lbl scope.blocks with
+  | Some block -> fun frame -> !block frame
+  | None -> fail ("interp_lbl: no target for label: " ^ string_of_label lbl)
+
+let rec compile_tail (scope : scope) (t : tail) : code =
+  match t with
+  | Return e -> compile_exp scope e
+  | TailCall (atm, atms) ->
+    call "interp_tail" (compile_atm scope atm) (compile_args scope atms)
+  | Seq (stmt, t') ->
+    let s = compile_stmt scope stmt in
+    let t' = compile_tail scope t' in
+    fun frame ->
+      s frame ;
+      t' frame
+  | Goto lbl -> jump scope lbl
+  | IfStmt {op; arg1; arg2; jump_then; jump_else} -> (
+    let arg1 = compile_atm scope arg1 in
+    let arg2 = compile_atm scope arg2 in
+    let jump_then = jump scope jump_then in
+    let jump_else = jump scope jump_else in
+    fun frame ->
+      match interp_cmp_op_simple op [arg1 frame; arg2 frame] with
+      | `BoolV b -> if b then jump_then frame else jump_else frame
+      | _ -> failwith "interp_tail: if: wrong type" )
+
+(* Compile a function body into the function value `fv`. *)
+let compile_fun (funs : value VarMap.t) (fv : fun_value) (f : fun_contents) :
+    unit =
+  let slots, nslots =
+    make_slots (List.map fst f.args) (List.rev (assigned_vars f.body))
+  in
+  let blocks =
+    LabelMap.of_list (List.map (fun (lbl, _) -> (lbl, ref fv.code)) f.body)
+  in
+  let scope = {slots; funs; blocks} in
+  List.iter
+    (fun (lbl, t) -> LabelMap.find lbl blocks := compile_tail scope t)
+    f.body ;
+  (* NOTE: Each function will have its own "start" label. *)
+  fv.code <- jump scope (Label "start") ;
+  fv.nslots <- nslots
+
+let compile (CProgram defs) : unit -> int =
+  let fvs =
+    defs
+    |> List.map (fun (Def (Label name, f)) ->
+           (name, new_fun_value (List.length f.args)) )
+    |> VarMap.of_list
+  in
+  let funs = VarMap.map (fun fv -> (`FunV fv : value)) fvs in
+  List.iter
+    (fun (Def (Label name, f)) -> compile_fun funs (VarMap.find name fvs) f)
+    defs ;
+  let main =
+    match VarMap.find_opt "main" fvs with
+    | None -> fun _ -> failwith "no `main` function"
+    | Some fv -> fun () -> fv.code (Array.make fv.nslots `VoidV)
+  in
+  fun () ->
+    init_gc_globals () ;
+    main ()
+    |> expect_int ~err_msg:"interp: return value" ~to_string:string_of_value
+
+let interp (prog : program) : int = compile prog ()
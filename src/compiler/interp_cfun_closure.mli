@@ -0,0 +1,7 @@
+(** Closure-compiling interpreter for the "Cfun" language. *)
+
+val compile : Cfun.program -> unit -> int
+(** Compile a program into a function that runs it. *)
+
+val interp : Cfun.program -> int
+(** Interpreter. *)
@@ -0,0 +1,243 @@
+open Support.Utils
+open Types
+open Interp
+open Lfun
+
+(* ----------------------------------------------------------------------
+ * Closure-compiling interpreter.
+ * ---------------------------------------------------------------------- *)
+
+(* This interpreter gives the same results (and errors) as `Interp_lfun`,
+   but it does all its name lookups once, before the program runs.
+   Each function is compiled into an OCaml closure that runs on a frame
+   (an array of values): every variable gets a slot of the frame,
+   and every variable reference becomes an access to its slot.
+   Function names are global, so they are looked up at compile time too.
+   Lfun has no `lambda`, so nothing can capture a frame;
+   a new frame is made for each function call.
+
+   Programs are compiled once and can then be run any number of times
+   (e.g. on several input sets with `-batch`).
+   Compilation never fails: errors that `Interp_lfun` would find
+   while running the program are compiled into code that signals them
+   when it runs. *)
+
+type value = [simple_value | `VecV of value array | `FunV of fun_value]
+
+and frame = value array
+
+and code = frame -> value
+
+and fun_value = {arity : int; mutable nslots : int; mutable code : code}
+
+(* Code that fails with an error message. *)
+let fail (msg : string) : code = fun _ -> failwith msg
+
+(* A function value whose code hasn't been compiled yet. *)
+let new_fun_value (arity : int) : fun_value =
+  {arity; nslots = arity; code = fail "function not compiled"}
+
+(* Compile a call of the function computed by `f` on the arguments `args`,
+   which are evaluated in order.  A new frame is made for the callee,
+   with the arguments in its first slots.
+   As in `Interp_lfun.apply`, the number of arguments is only checked
+   once they have all been evaluated.
+   `who` names the caller in error messages. *)
+let call (who : string) (f : code) (args : code array) : code =
+  let nargs = Array.length args in
+  fun frame ->
+    match f frame with
+    | `FunV fv ->
+      let frame' = Array.make (max fv.nslots nargs) `VoidV in
+      for i = 0 to nargs - 1 do
+        frame'.(i) <- args.(i) frame
+      done ;
+      if nargs <> fv.arity then
+        failwithf "apply: expected (%d) arguments but got (%d)" fv.arity nargs ;
+      fv.code frame'
+    | v -> failwithf "%s: applied non-function: (%s)" who (string_of_value v)
+
+(* What the compiler needs to know about the names in scope:
+   the slots of the local variables, the functions of the program
+   (in refs, since they can be `set!` like any other variable)
+   and the next free slot. *)
+type scope =
+  {locals : int VarMap.t; funs : value ref VarMap.t; next_slot : int ref}
+
+(* Give the variable `v` a new slot. *)
+let add_local (scope : scope) (v : var) : scope * int =
+  let slot = !(scope.next_slot) in
+  incr scope.next_slot ;
+  ({scope with locals = VarMap.add v slot scope.locals}, slot)
+
+let prim_code (op : core_op) (args : code list) : code =
+  match args with
+  | [a1; a2] ->
+    fun frame ->
+      let v1 = a1 frame in
+      let v2 = a2 frame in
+      (interp_core_op_simple op [v1; v2] :> value)
+  | _ ->
+    fun frame ->
+      let vs = List.map (fun a -> a frame) args in
+      (interp_core_op_simple op vs :> value)
+
+let rec compile_exp (scope : scope) (e : exp) : code =
+  let comp = compile_exp scope in
+  match e with
+  | Void -> fun _ -> `VoidV
+  | Bool b ->
+    let v = `BoolV b in
+    fun _ -> v
+  | Int i ->
+    let v = `IntV i in
+    fun _ -> v
+  | Var v -> (
+    match VarMap.find_opt v scope.locals with
+    | Some slot -> fun frame -> frame.(slot)
+    | None -> (
+      match VarMap.find_opt v scope.funs with
+      | Some loc -> fun _ -> !loc
+      | None -> fail (Printf.sprintf "variable (%s) not found" v) ) )
+  | Prim (op, args) -> prim_code op (List.map comp args)
+  | SetBang (v, e) -> (
+    let e = comp e in
+    match VarMap.find_opt v scope.locals with
+    | Some slot ->
+      fun frame ->
+        frame.(slot) <- e frame ;
+        `VoidV
+    | None -> (
+      match VarMap.find_opt v scope.funs with
+      | Some loc ->
+        fun frame ->
+          loc := e frame ;
+          `VoidV
+      | None ->
+        let msg = Printf.sprintf "set! : variable (%s) not found" v in
+        fun frame ->
+          ignore (e frame) ;
+          failwith msg ) )
+  | Begin (es, e) ->
+    let es = List.map comp es in
+    let e = comp e in
+    fun frame ->
+      List.iter (fun e -> ignore (e frame)) es ;
+      e frame
+  | If (e1, e2, e3) -> (
+    let e1 = comp e1 in
+    let e2 = comp e2 in
+    let e3 = comp e3 in
+    fun frame ->
+      match e1 frame with
+      | `BoolV b -> if b then e2 frame else e3 frame
+      | _ -> failwith "if : wrong test expression type" )
+  | And (e1, e2) -> (
+    let e1 = comp e1 in
+    let e2 = comp e2 in
+    fun frame ->
+      match e1 frame with
+      | `BoolV false -> `BoolV false
+      | `BoolV true -> (
+        match e2 frame with
+        | `BoolV _ as v -> v
+        | _ -> failwith "and : wrong types" )
+      | _ -> failwith "and : wrong types" )
+  | Or (e1, e2) -> (
+    let e1 = comp e1 in
+    let e2 = comp e2 in
+    fun frame ->
+      match e1 frame with
+      | `BoolV true -> `BoolV true
+      | `BoolV false -> (
+        match e2 frame with
+        | `BoolV _ as v -> v
+        | _ -> failwith "or : wrong types" )
+      | _ -> failwith "or : wrong types" )
+  | While (e1, e2) ->
+    let test = comp e1 in
+    let body = comp e2 in
+    let rec iter frame =
+      match test frame with
+      | `BoolV true ->
+        ignore (body frame) ;
+        iter frame
+      | `BoolV false -> `VoidV
+      | _ -> failwith "while : wrong test expression type"
+    in
+    iter
+  | Let (v, e1, e2) ->
+    let e1 = comp e1 in
+    let scope', slot = add_local scope v in
+    let e2 = compile_exp scope' e2 in
+    fun frame ->
+      frame.(slot) <- e1 frame ;
+      e2 frame
+  | Vec (es, _) ->
+    let es = Array.of_list (List.map comp es) in
+    fun frame -> `VecV (Array.map (fun e -> e frame) es)
+  | VecLen e -> (
+    let e = comp e in
+    fun frame ->
+      match e frame with
+      | `VecV vs -> `IntV (Array.length vs)
+      | _ -> failwith "vector-length : wrong type" )
+  | VecRef (e, i) -> (
+    let e = comp e in
+    fun frame ->
+      match e frame with
+      | `VecV vs ->
+        if i >= 0 && i < Array.length vs then vs.(i)
+        else failwith "vector-ref : index out of range"
+      | _ -> failwith "vector-ref : wrong types" )
+  | VecSet (e1, i, e2) -> (
+    let e1 = comp e1 in
+    let e2 = comp e2 in
+    fun frame ->
+      let vec = e1 frame in
+      let v = e2 frame in
+      match vec with
+      | `VecV vs ->
+        if i >= 0 && i < Array.length vs then (
+          vs.(i) <- v ;
+          `VoidV )
+        else failwith "vector-set! : index out of range"
+      | _ -> failwith "vector-set! : wrong types" )
+  | Apply (e, es) ->
+    call "apply_exp" (comp e) (Array.of_list (List.map comp es))
+
+(* Compile a function body into the function value `fv`.
+   The arguments take the first slots of the frame. *)
+let compile_fun (funs : value ref VarMap.t) (fv : fun_value)
+    (f : fun_contents) : unit =
+  let locals =
+    List.fold_left
+      (fun (locals, i) (v, _) -> (VarMap.add v i locals, i + 1))
+      (VarMap.empty, 0) f.args
+    |> fst
+  in
+  let scope = {locals; funs; next_slot = ref fv.arity} in
+  fv.code <- compile_exp scope f.body ;
+  fv.nslots <- !(scope.next_slot)
+
+let compile (Program (defs, exp) : program) : unit -> int =
+  let fvs =
+    defs
+    |> List.map (fun (Def (name, f)) ->
+           (name, new_fun_value (List.length f.args)) )
+    |> VarMap.of_list
+  in
+  let funs = VarMap.map (fun fv -> ref (`FunV fv : value)) fvs in
+  List.iter
+    (fun (Def (name, f)) -> compile_fun funs (VarMap.find name fvs) f)
+    defs ;
+  let scope = {locals = VarMap.empty; funs; next_slot = ref 0} in
+  let main = compile_exp scope exp in
+  let nslots = !(scope.next_slot) in
+  fun () ->
+    (* Undo any `set!` of a function name by an earlier run. *)
+    VarMap.iter (fun name fv -> VarMap.find name funs := `FunV fv) fvs ;
+    Array.make nslots `VoidV |> main
+    |> expect_int ~err_msg:"interp: return value" ~to_string:string_of_value
+
+let interp (prog : program) : int = compile prog ()
@@ -0,0 +1,32 @@
+(** Closure-compiling interpreter for the "Lfun" language. *)
+
+open Interp
+
+(** Values.  Functions have no environments: their names are global,
+    and their variables are kept in the frames of their calls. *)
+type value = [simple_value | `VecV of value array | `FunV of fun_value]
+
+(** Frames hold the values of the variables of a function call,
+    each in the slot it was given when the function was compiled. *)
+and frame = value array
+
+(** Compiled code. *)
+and code = frame -> value
+
+(** Function values.  The code is filled in after all the functions
+    have been created, since they can refer to each other. *)
+and fun_value = {arity : int; mutable nslots : int; mutable code : code}
+
+(* Reusable parts for later interpreters. *)
+
+val fail : string -> code
+
+val new_fun_value : int -> fun_value
+
+val call : string -> code -> code array -> code
+
+val compile : Lfun.program -> unit -> int
+(** Compile a program into a function that runs it. *)
+
+val interp : Lfun.program -> int
+(** Interpreter. *)
@@ -31,3 +31,22 @@ let allocate n =
   free_ptr := !free_ptr + n ;
   if !free_ptr >= !fromspace_end then
     failwithf "allocate: couldn't allocate %d bytes" n
+
+(*
+ * Input for the `read` operator.
+ *)
+
+(* Remaining input lines, or `None` to read from standard input. *)
+let input_lines : string list option ref = ref None
+
+let set_input s =
+  let lines = String.split_on_char '\n' s in
+  input_lines := Some lines
+
+let read_int () =
+  match !input_lines with
+  | None -> Stdlib.read_int ()
+  | Some [] -> raise End_of_file
+  | Some (line :: rest) ->
+    input_lines := Some rest ;
+    int_of_string line
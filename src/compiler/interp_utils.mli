@@ -14,3 +14,10 @@ val collect : int -> unit
 
 val allocate : int -> unit
 (** Allocate N bytes in the simulated GC. *)
+
+val set_input : string -> unit
+(** Take the input for `read` from the lines of a string
+    instead of from standard input. *)
+
+val read_int : unit -> int
+(** Read an integer (one per line) for the `read` operator. *)
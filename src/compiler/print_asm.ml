@@ -49,8 +49,19 @@ let string_of_instr (i : instr) : string =
   | Global (Label lbl) -> "\n" ^ pad ^ sp ".globl %s" lbl
   | Align i -> pad ^ sp ".align %d" i
 
+(* Remove the jumps to the label that directly follows them,
+   since the code falls through to it anyway. *)
+let remove_fallthrough_jumps (instrs : instr list) : instr list =
+  let fn (acc : instr list) (i : instr) =
+    match (acc, i) with
+    | Jmp (Label l) :: rest, Label l' when l = l' -> i :: rest
+    | _ -> i :: acc
+  in
+  List.rev (List.fold_left fn [] instrs)
+
 let print_asm (prog : program) : string =
   let (X86Program instrs) = prog in
+  let instrs = remove_fallthrough_jumps instrs in
   let s = string_map ~sep:"\n" string_of_instr instrs in
   (* Strip leading newline, if any. *)
   let len = String.length s in
@@ -13,11 +13,31 @@ Algorithm:
   (a directed graph, using the `LabelDgraph` module).
 - Find all blocks which have only a single out edge.
 - If the target of these out edges has only a single in edge,
-    merge the two blocks.
-- Repeat until there are no more mergeable blocks.
+    the two blocks can be merged.
+- Follow each chain of mergeable blocks from its first block
+    and merge the whole chain at once, so the pass is linear
+    in the number of blocks.
+
+With block layout (`-layout-blocks`), first thread the jumps
+through empty blocks (blocks that only jump to another block),
+then merge the chains, and finally order the blocks so that
+each block is followed by the block its last `jmp` goes to
+where possible.  `print_asm` leaves out the jumps to the
+instruction that follows them.
 
 *)
 
+(* Whether to thread jumps and lay out the blocks. *)
+let layout = ref false
+
+let set_block_layout b = layout := b
+
+(* Number of blocks merged into their predecessor by the last call
+   to `remove_jumps`. *)
+let num_merged = ref 0
+
+let blocks_merged () = !num_merged
+
 (* Get a list of all the jump labels in a block.
    NOTE: This is not the same as the similarly-named function
    from the `Ctup` module. *)
@@ -31,6 +51,15 @@ let get_jump_labels (Block (_, instrs) : 'a block) : label list =
   in
   helper instrs
 
+(* Get the target of the `jmp` that ends a block, if any. *)
+let last_jump (Block (_, instrs) : 'a block) : label option =
+  match instrs with
+  | [] -> None
+  | _ -> (
+    match last instrs with
+    | Jmp l -> Some l
+    | _ -> None )
+
 let make_graph (lbs : (label * 'a block) list) : LabelDgraph.t =
   let add_vertices lbs g =
     List.fold_left
@@ -53,56 +82,166 @@ let make_graph (lbs : (label * 'a block) list) : LabelDgraph.t =
   in
   add_edges lbs (add_vertices lbs G.empty)
 
-(* Get a pair of mergeable labels from the graph if there are any. *)
-let get_mergeable_labels (g : G.t) : (label * label) option =
-  let rec find_mergeable vs =
-    match vs with
-    | [] -> None
-    | l :: rest -> (
-      match G.neighbors_out g l with
-      | [ele] -> (
-        match G.neighbors_in g ele with
-        | [l] -> Some (l, ele)
-        | _ -> find_mergeable rest )
-      | _ -> find_mergeable rest )
+(* Remove the jumps to label `l` that end a list of instructions:
+   the final `jmp` and any `jmp_if`s just before it. *)
+let drop_final_jumps (l : label) (instrs : instr list) : instr list =
+  let rec drop = function
+    | (Jmp l' | JmpIf (_, l')) :: rest when l' = l -> drop rest
+    | rest -> rest
   in
-  find_mergeable (G.vertices g)
+  List.rev (drop (List.rev instrs))
+
+(* Get the label of the block that block `l` can be merged with, if any.
+   Block `l` must only jump to that block, with its final jumps,
+   and no other block may jump there.
+   - The start block is never merged into another block,
+     since the prelude jumps to it.
+   - A block that only jumps to itself is never merged.
+   - A block whose final jump goes elsewhere (e.g. to the conclusion)
+     falls through to the wrong code if merged, so it isn't. *)
+let merge_target (start : label) (g : G.t) (lbm : 'a block M.t) (l : label) :
+  label option =
+  match G.neighbors_out g l with
+  | [ele] when ele <> l && ele <> start -> (
+    let (Block (info, instrs) as b) = M.find l lbm in
+    let rest = Block (info, drop_final_jumps ele instrs) in
+    match (G.neighbors_in g ele, last_jump b) with
+    | [_], Some ele'
+      when ele' = ele && not (List.mem ele (get_jump_labels rest)) ->
+      Some ele
+    | _ -> None )
+  | _ -> None
 
-(* Merge two blocks. *)
-let merge_blocks (b1 : 'a block) (b2 : 'a block) : 'a block =
+(* Merge block B into block A, whose final jumps go to block B. *)
+let merge_blocks (ele : label) (b1 : 'a block) (b2 : 'a block) : 'a block =
   let (Block (info1, instrs1)) = b1 in
   let (Block (_, instrs2)) = b2 in
-  let instrs1_butlast = butlast instrs1 in
-  Block (info1, instrs1_butlast @ instrs2)
+  Block (info1, drop_final_jumps ele instrs1 @ instrs2)
 
-(* Merge two blocks A and B if block A only jumps to block B
+(* Merge blocks A and B if block A only jumps to block B
    and block B is only jumped to from block A.
-   The merged block will have the label of the original block A. *)
-let process_blocks (lbs : (label * 'a block) list) : (label * 'a block) list =
-  if List.length lbs < 2 then lbs (* no blocks to merge! *)
+   The merged block will have the label of the original block A.
+   Whole chains of such blocks are merged into their first block;
+   the blocks are returned in label order.
+   (Blocks on a cycle of such jumps can't be reached,
+   as the start block is never merged, so they are dropped.) *)
+let merge_chains (start : label) (lbs : (label * 'a block) list) :
+  (label * 'a block) list =
+  let lbm = M.of_list lbs in
+  let g = make_graph lbs in
+  let next =
+    List.fold_left
+      (fun next l ->
+        match merge_target start g lbm l with
+        | Some ele -> M.add l ele next
+        | None -> next )
+      M.empty (G.vertices g)
+  in
+  num_merged := !num_merged + M.cardinal next ;
+  let merged = M.fold (fun _ ele s -> LabelSet.add ele s) next LabelSet.empty in
+  let rec chain l =
+    let b = M.find l lbm in
+    match M.find_opt l next with
+    | Some ele -> merge_blocks ele b (chain ele)
+    | None -> b
+  in
+  M.fold
+    (fun l _ acc -> if LabelSet.mem l merged then acc else (l, chain l) :: acc)
+    lbm []
+  |> List.rev
+
+(* Map each empty block (a block that only jumps to another block)
+   to the label that its jump finally leads to, past any other empty
+   blocks.  Each empty block is only followed once. *)
+let thread_targets (lbs : (label * 'a block) list) : label M.t =
+  let empty =
+    List.fold_left
+      (fun m (l, Block (_, instrs)) ->
+        match instrs with
+        | [Jmp l'] when l' <> l -> M.add l l' m
+        | _ -> m )
+      M.empty lbs
+  in
+  (* `seen` stops at cycles of empty blocks. *)
+  let rec resolve seen final l =
+    match M.find_opt l final with
+    | Some l' -> (l', final)
+    | None -> (
+      match M.find_opt l empty with
+      | Some l' when not (LabelSet.mem l' seen) ->
+        let l'', final = resolve (LabelSet.add l' seen) final l' in
+        (l'', M.add l l'' final)
+      | _ -> (l, final) )
+  in
+  M.fold
+    (fun l _ final -> snd (resolve (LabelSet.singleton l) final l))
+    empty M.empty
+
+(* Make all jumps to empty blocks go straight to where those blocks
+   jump to, and drop the empty blocks that are no longer jumped to. *)
+let thread_jumps (start : label) (lbs : (label * 'a block) list) :
+  (label * 'a block) list =
+  let final = thread_targets lbs in
+  if M.is_empty final then lbs
   else
-    let lbm = List.fold_left (fun m (l, b) -> M.add l b m) M.empty lbs in
-    let rec process lbm g =
-      match get_mergeable_labels g with
-      | None -> M.bindings lbm
-      | Some (l1, l2) ->
-        let merged_block = merge_blocks (M.find l1 lbm) (M.find l2 lbm) in
-        let new_g = G.merge_vertices g l1 l2 in
-        process (M.add l1 merged_block (M.remove l2 lbm)) new_g
+    let retarget l = Option.value (M.find_opt l final) ~default:l in
+    let thread = function
+      | Jmp l -> Jmp (retarget l)
+      | JmpIf (cc, l) -> JmpIf (cc, retarget l)
+      | i -> i
     in
-    let g = make_graph lbs in
-    process lbm g
+    let lbs' =
+      List.map
+        (fun (l, Block (info, instrs)) ->
+          (l, Block (info, List.map thread instrs)) )
+        lbs
+    in
+    let targets =
+      List.fold_left
+        (fun s (_, b) ->
+          List.fold_left (fun s l -> LabelSet.add l s) s (get_jump_labels b) )
+        LabelSet.empty lbs'
+    in
+    List.filter
+      (fun (l, _) -> l = start || (not (M.mem l final)) || LabelSet.mem l targets)
+      lbs'
+
+(* Order the blocks so that each block is followed, where possible,
+   by the block its last `jmp` goes to.  Start a trace of such blocks
+   at the start block, and the next trace at the first block
+   (in the original order) that hasn't been placed yet. *)
+let layout_blocks (start : label) (lbs : (label * 'a block) list) :
+  (label * 'a block) list =
+  let lbm = M.of_list lbs in
+  let rec trace (placed, acc) l =
+    match M.find_opt l lbm with
+    | Some b when not (LabelSet.mem l placed) -> (
+      let placed_acc = (LabelSet.add l placed, (l, b) :: acc) in
+      match last_jump b with
+      | Some l' -> trace placed_acc l'
+      | None -> placed_acc )
+    | _ -> (placed, acc)
+  in
+  let init = trace (LabelSet.empty, []) start in
+  let _, acc = List.fold_left (fun pa (l, _) -> trace pa l) init lbs in
+  List.rev acc
 
 let remove_jumps_def (def : ('a, binfo1) def) : ('a, binfo1) def =
   (* Unpack the labeled block list (`lbs`) from a definition. *)
   let (Def (lbl, finfo, fcont)) = def in
   let {nparams; locals; body = lbs} = fcont in
+  let start = Label (string_of_label lbl ^ "_start") in
   (* Remove the unnecessary jumps. *)
-  let lbs' = process_blocks lbs in
+  let lbs' =
+    if !layout then
+      lbs |> thread_jumps start |> merge_chains start |> layout_blocks start
+    else merge_chains start lbs
+  in
   (* Put the definition back together. *)
   let fcont' = {nparams; locals; body = lbs'} in
   Def (lbl, finfo, fcont')
 
 let remove_jumps (prog : ('a, binfo1) program) : ('a, binfo1) program =
   let (X86Program defs) = prog in
+  num_merged := 0 ;
   X86Program (List.map remove_jumps_def defs)
@@ -4,3 +4,12 @@
 val remove_jumps :
      ('a, X86_var_def.binfo1) X86_var_def.program
   -> ('a, X86_var_def.binfo1) X86_var_def.program
+
+val set_block_layout : bool -> unit
+(** If the argument is `true`, also thread jumps through empty blocks
+    and order the blocks so that each one is followed, where possible,
+    by the block its last `jmp` goes to. *)
+
+val blocks_merged : unit -> int
+(** Return the number of blocks that the last call to `remove_jumps`
+    merged into their predecessors. *)
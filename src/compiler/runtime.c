@@ -1,7 +1,12 @@
 #include <inttypes.h>
 #include <stdlib.h>
 #include <stdio.h>
+#include <string.h>
 #include <assert.h>
+#include <signal.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/mman.h>
 #include "runtime.h"
 
 // Allow definition of GC_DEBUG on command-line e.g. `-DGC_DEBUG=1`.
@@ -9,20 +14,220 @@
 #define GC_DEBUG 0
 #endif
 
+#ifndef MAP_ANONYMOUS
+#define MAP_ANONYMOUS MAP_ANON
+#endif
+
 // ----------------------------------------------------------------------
 // Garbage collection.
 // ----------------------------------------------------------------------
 
+/*
+  The heap is divided into two generations.
+
+  * The nursery is where the mutator (user program) allocates.  The
+    mutator knows it as fromspace: it bumps `free_ptr` and calls
+    `collect` when the next allocation would pass `fromspace_end`.
+
+  * The old generation holds the objects that have survived a
+    collection.
+
+  Most collections are minor.  A minor collection copies the live
+  objects of the nursery to the end of the old generation (promotes
+  them), with Cheney's algorithm, and leaves the nursery empty.  Old
+  objects are neither copied nor scanned, except the ones that may
+  point into the nursery.  Since every collection empties the
+  nursery, an old object can only point into it if the mutator has
+  stored a pointer into the old object (with `vector-set!`) since the
+  last collection.
+
+  These stores are found with the virtual memory hardware rather than
+  with code in the mutator: the full pages of the old generation are
+  write-protected, so the first store to one of them traps.  The
+  signal handler adds the page to the remembered set and unprotects
+  it; later stores to the page run at full speed.  A minor collection
+  scans the objects on the remembered pages as additional roots and
+  then protects the pages again.  The last, partially filled page of
+  the old generation is never protected and is always scanned.
+
+  When promotion would take the old generation past its limit, the
+  collection is major: all the live objects of both generations are
+  copied into a new old generation, and the old one is unmapped.
+
+  The sizes adapt to the survival rates:
+  * if more than `NURSERY_GROW_SURVIVAL` of the nursery survives a
+    minor collection, the nursery doubles, up to `NURSERY_MAX_BYTES`,
+    so that objects get more time to die before they are promoted
+    (it also grows to fit an allocation that is too large for it);
+  * after a major collection the limit of the old generation is
+    `OLD_GROWTH` times the live data, or `OLD_GROWTH_HIGH` times if
+    more than `OLD_GROW_SURVIVAL` of the old generation survived.
+
+  The old generation is mapped with room to spare beyond its limit;
+  untouched pages of an anonymous mapping don't use any memory.
+*/
+
+#define NURSERY_MAX_BYTES     ((uint64_t)4 << 20)
+#define NURSERY_GROW_SURVIVAL 0.25
+#define OLD_GROWTH            2
+#define OLD_GROWTH_HIGH       4
+#define OLD_GROW_SURVIVAL     0.5
+
 // Often misunderstood: static global variables in C are not
 // accessible to code outside of the module.
-// No one besides the collector ever needs to know tospace exists.
-static int64_t* tospace_begin;
-static int64_t* tospace_end;
+// No one besides the collector ever needs to know the old generation
+// exists.
+
+// The old generation is mapped in [old_begin, old_end) and its objects
+// are in [old_begin, old_free).  A major collection happens before
+// `old_free` would pass `old_limit`.
+static int64_t* old_begin;
+static int64_t* old_end;
+static int64_t* old_free;
+static int64_t* old_limit;
+
+// The pages in [old_begin, old_protected_end) are full and are
+// write-protected, except for the ones in the remembered set.
+static int64_t* old_protected_end;
+
+// 0 if the pages of the old generation can't be protected (the
+// `GC_NO_PROTECT` environment variable is set, or the signal handler
+// couldn't be installed).  Then every minor collection scans the
+// whole old generation.
+static int write_protect = 1;
+
+static uint64_t page_words;
+static uint64_t old_num_pages;
+
+// For each page of the old generation, the offset in words from the
+// beginning of the page of the first object that starts on it, or -1.
+static int32_t* first_object;
+
+// The remembered set: the protected pages of the old generation that
+// have been written to since the last collection, as a flag per page
+// and as a list.  The signal handler adds to it.
+static unsigned char* page_remembered;
+static uint64_t* remembered_pages;
+static volatile uint64_t num_remembered;
+
+// During a collection, the objects in the nursery and the ones in
+// [from_old_begin, from_old_end) are copied to `copy_ptr`.  The latter
+// range is the previous old generation in a major collection and is
+// empty in a minor one.
+static int64_t* from_old_begin;
+static int64_t* from_old_end;
+static int64_t* copy_ptr;
 
 // `initialized` is set during initialization of the heap,
 // and can be checked in order to ensure that initialization has occurred.
 static int initialized = 0;
 
+// Number of calls to `collect`.
+static uint64_t num_collections = 0;
+
+/*
+  GC telemetry.  When the program exits, the runtime can print a
+  summary of its collections:
+
+    (gc (collections <n>) (requested <bytes>) (copied <bytes>)
+        (pause_ns <ns>) (max_pause_ns <ns>) (peak_heap <bytes>)
+        (peak_roots <slots>))
+
+  to stderr, if the `GC_STATS` environment variable is set, and to the
+  file named by the `GC_TRACE` environment variable, if that is set.
+  The trace file also gets one line for each collection, before the
+  summary:
+
+    (collection (kind <minor|major>) (requested <bytes>) (copied <bytes>)
+                (pause_ns <ns>) (heap <bytes>) (roots <slots>))
+
+  `requested` is the allocation that triggered the collection,
+  `copied` is what the collection copied (promoted, for a minor one),
+  `heap` is the size of the nursery plus the part of the old
+  generation in use when the collection started, and `roots` is the
+  number of root stack slots in use.  `peak_heap` is the largest heap
+  size, at any collection or at exit, and `peak_roots` is the
+  high-water mark of the root stack: with telemetry on, the root stack
+  starts out filled with `ROOTSTACK_UNUSED`, and at exit the highest
+  slot that no longer holds it is found.  (The compiled code never
+  stores that value: roots are 0 or aligned pointers.)
+  The trace goes to a file so that stdout and stderr are left to the
+  program.
+*/
+#define ROOTSTACK_FILL   0x5f
+#define ROOTSTACK_UNUSED ((int64_t*) 0x5f5f5f5f5f5f5f5fLL)
+
+static int gc_stats = 0;
+static FILE* gc_trace = NULL;
+static uint64_t total_requested = 0;
+static uint64_t total_copied = 0;
+static uint64_t total_pause_ns = 0;
+static uint64_t max_pause_ns = 0;
+static uint64_t peak_heap = 0;
+static uint64_t peak_roots = 0;
+
+static inline int gc_telemetry(void) {
+  return gc_stats || gc_trace != NULL;
+}
+
+static uint64_t now_ns(void) {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+
+static void trace_collection(const char* kind, uint64_t requested,
+                             uint64_t copied, uint64_t pause_ns,
+                             uint64_t heap, uint64_t roots) {
+  total_requested += requested;
+  total_copied += copied;
+  total_pause_ns += pause_ns;
+  if (pause_ns > max_pause_ns) max_pause_ns = pause_ns;
+  if (heap > peak_heap) peak_heap = heap;
+  if (roots > peak_roots) peak_roots = roots;
+  if (gc_trace) {
+    fprintf(gc_trace, "(collection (kind %s) (requested %" PRIu64 ")"
+            " (copied %" PRIu64 ") (pause_ns %" PRIu64 ") (heap %" PRIu64 ")"
+            " (roots %" PRIu64 "))\n",
+            kind, requested, copied, pause_ns, heap, roots);
+  }
+}
+
+// The number of root stack slots the program has ever used.
+static uint64_t rootstack_high_water(void) {
+  int64_t** p = rootstack_end;
+  while (p > rootstack_begin && p[-1] == ROOTSTACK_UNUSED) {
+    p--;
+  }
+  return p - rootstack_begin;
+}
+
+static void print_gc_summary(FILE* out) {
+  fprintf(out, "(gc (collections %" PRIu64 ") (requested %" PRIu64 ")"
+          " (copied %" PRIu64 ") (pause_ns %" PRIu64 ")"
+          " (max_pause_ns %" PRIu64 ") (peak_heap %" PRIu64 ")"
+          " (peak_roots %" PRIu64 "))\n",
+          num_collections, total_requested, total_copied, total_pause_ns,
+          max_pause_ns, peak_heap, peak_roots);
+}
+
+// Take the final heap size and the root stack's high-water mark into
+// account, and print the summary.
+static void finish_gc_telemetry(void) {
+  uint64_t heap = ((fromspace_end - fromspace_begin) + (old_free - old_begin))
+    * sizeof(int64_t);
+  uint64_t roots = rootstack_high_water();
+  if (heap > peak_heap) peak_heap = heap;
+  if (roots > peak_roots) peak_roots = roots;
+  if (gc_stats) {
+    print_gc_summary(stderr);
+  }
+  if (gc_trace) {
+    print_gc_summary(gc_trace);
+    fclose(gc_trace);
+  }
+}
+
 /*
   Tuple Tag (64 bits)
 
@@ -49,9 +254,11 @@ static const int TAG_VECOF_LENGTH_RSHIFT = 2;
 static const int TAG_VECOF_PTR_BITFIELD_RSHIFT = 1;
 static const int TAG_VECOF_RSHIFT = 63;
 
-// `cheney` implements Cheney's copying collection algorithm.
-// There is a stub and explaination below.
-static void cheney(int64_t** rootstack_ptr);
+// `minor_collection` and `major_collection` implement the two kinds
+// of collection with Cheney's copying algorithm.
+// There are stubs and explainations below.
+static void minor_collection(int64_t** rootstack_ptr);
+static void major_collection(int64_t** rootstack_ptr);
 
 // Check to see if a tag is actually a forwarding pointer.
 static inline int is_forwarding(int64_t tag) {
@@ -122,6 +329,112 @@ int64_t* to_ptr(int64_t* p) {
   }
 }
 
+// Report a failure to get memory for the heap and exit.
+static void out_of_memory(const char* what, uint64_t bytes) {
+  fprintf(stderr, "failed to allocate %" PRIu64 " byte %s\n", bytes, what);
+  exit(EXIT_FAILURE);
+}
+
+static inline int in_nursery(int64_t* p) {
+  return fromspace_begin <= p && p < fromspace_end;
+}
+
+static inline int in_old(int64_t* p) {
+  return old_begin <= p && p < old_free;
+}
+
+// Check if an object is being copied by the current collection.
+static inline int is_collected(int64_t* p) {
+  return in_nursery(p) || (from_old_begin <= p && p < from_old_end);
+}
+
+static inline uint64_t page_of(int64_t* p) {
+  return (p - old_begin) / page_words;
+}
+
+static inline int64_t* page_begin(uint64_t page) {
+  return old_begin + page * page_words;
+}
+
+// Change the protection of the whole pages in [begin, end).
+static void protect(int64_t* begin, int64_t* end, int prot) {
+  if (write_protect && begin < end &&
+      mprotect(begin, (end - begin) * sizeof(int64_t), prot) != 0) {
+    perror("mprotect");
+    exit(EXIT_FAILURE);
+  }
+}
+
+static void remember_page(uint64_t page) {
+  if (!page_remembered[page]) {
+    page_remembered[page] = 1;
+    remembered_pages[num_remembered++] = page;
+  }
+}
+
+// The write barrier: a store to a protected page of the old generation
+// adds the page to the remembered set and unprotects it, and the store
+// is then restarted.  Any other fault is a real one, so the default
+// action is restored and the restarted access faults again.
+static void write_fault(int sig, siginfo_t* info, void* context) {
+  int64_t* addr = (int64_t*) info->si_addr;
+  (void) context;
+  if (old_begin <= addr && addr < old_protected_end) {
+    uint64_t page = page_of(addr);
+    remember_page(page);
+    mprotect(page_begin(page), page_words * sizeof(int64_t),
+             PROT_READ | PROT_WRITE);
+  } else {
+    signal(sig, SIG_DFL);
+  }
+}
+
+static void install_write_barrier(void) {
+  struct sigaction action;
+  memset(&action, 0, sizeof(action));
+  action.sa_sigaction = write_fault;
+  action.sa_flags = SA_SIGINFO;
+  sigemptyset(&action.sa_mask);
+  if (getenv("GC_NO_PROTECT") != NULL ||
+      sigaction(SIGSEGV, &action, NULL) != 0 ||
+      sigaction(SIGBUS, &action, NULL) != 0) {
+    write_protect = 0;
+  }
+}
+
+// Make an empty old generation with room for at least `words` words.
+// The caller sets `old_limit`.
+static void new_old_generation(uint64_t words) {
+  uint64_t page_bytes = page_words * sizeof(int64_t);
+  uint64_t bytes = (words * sizeof(int64_t) + page_bytes - 1)
+    / page_bytes * page_bytes;
+  void* space = mmap(NULL, bytes, PROT_READ | PROT_WRITE,
+                     MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+  if (space == MAP_FAILED) {
+    out_of_memory("old generation", bytes);
+  }
+  old_begin = old_free = old_protected_end = space;
+  old_end = old_begin + bytes / sizeof(int64_t);
+  old_num_pages = bytes / page_bytes;
+
+  if (!(first_object = malloc(old_num_pages * sizeof(int32_t))) ||
+      !(page_remembered = calloc(old_num_pages, 1)) ||
+      !(remembered_pages = malloc(old_num_pages * sizeof(uint64_t)))) {
+    out_of_memory("page table", old_num_pages * sizeof(uint64_t));
+  }
+  memset(first_object, -1, old_num_pages * sizeof(int32_t));
+  num_remembered = 0;
+}
+
+// Make a nursery of `bytes` bytes.
+static void new_nursery(uint64_t bytes) {
+  if (!(fromspace_begin = malloc(bytes))) {
+    out_of_memory("nursery", bytes);
+  }
+  fromspace_end = fromspace_begin + bytes / sizeof(int64_t);
+  free_ptr = fromspace_begin;
+}
+
 // Initialize the state of the collector so that allocations can occur.
 void initialize(uint64_t rootstack_size, uint64_t heap_size)
 {
@@ -131,15 +444,8 @@ void initialize(uint64_t rootstack_size, uint64_t heap_size)
   assert((rootstack_size % sizeof(int64_t)) == 0);
 
   // 2. Allocate memory (You should always check if malloc gave you memory)
-  if (!(fromspace_begin = malloc(heap_size))) {
-    printf("Failed to malloc %" PRIu64 " byte fromspace\n", heap_size);
-    exit(EXIT_FAILURE);
-  }
-
-  if (!(tospace_begin = malloc(heap_size))) {
-    printf("Failed to malloc %" PRIu64 " byte tospace\n", heap_size);
-    exit(EXIT_FAILURE);
-  }
+  // The nursery starts with the requested heap size.
+  new_nursery(heap_size);
 
   if (!(rootstack_begin = malloc(rootstack_size))) {
     printf("Failed to malloc %" PRIu64 " byte rootstack", rootstack_size);
@@ -148,18 +454,32 @@ void initialize(uint64_t rootstack_size, uint64_t heap_size)
 
   // 2.5 Calculate the ends memory we are using.
   // Note: the pointers are for a half open interval [begin, end)
-  fromspace_end = fromspace_begin + (heap_size / sizeof(int64_t));
-  tospace_end = tospace_begin + (heap_size / sizeof(int64_t));
   rootstack_end = rootstack_begin + (rootstack_size / sizeof(int64_t));
 
-  // 3 Initialize the global free pointer
-  free_ptr = fromspace_begin;
+  // 3. Set up the old generation and its write barrier.
+  page_words = sysconf(_SC_PAGESIZE) / sizeof(int64_t);
+  uint64_t heap_words = heap_size / sizeof(int64_t);
+  new_old_generation((OLD_GROWTH + 1) * heap_words);
+  old_limit = old_begin + OLD_GROWTH * heap_words;
+  install_write_barrier();
 
   // Useful for debugging
   initialized = 1;
 
+  gc_stats = getenv("GC_STATS") != NULL;
+  char* trace_name = getenv("GC_TRACE");
+  if (trace_name != NULL && (gc_trace = fopen(trace_name, "w")) == NULL) {
+    perror(trace_name);
+  }
+  if (gc_telemetry()) {
+    memset(rootstack_begin, ROOTSTACK_FILL, rootstack_size);
+    atexit(finish_gc_telemetry);
+  }
+
 }
 
+// Check that the pointers in an object of the old generation point to
+// the old generation, and move `*scan_addr` past the object.
 void validate_vector(int64_t** scan_addr) {
   int64_t* scan_ptr = *scan_addr;
   int64_t tag = *scan_ptr;
@@ -174,9 +494,7 @@ void validate_vector(int64_t** scan_addr) {
       if ((isPtrBits >> i) & 1) {
         int64_t* ptr = (int64_t*) data[i];
         if (is_ptr(ptr)) {
-          int64_t* real_ptr = to_ptr(ptr);
-          assert(real_ptr < fromspace_end);
-          assert(real_ptr >= fromspace_begin);
+          assert(in_old(to_ptr(ptr)));
         }
       }
     }
@@ -186,7 +504,7 @@ void validate_vector(int64_t** scan_addr) {
 void collect(int64_t** rootstack_ptr, uint64_t bytes_requested)
 {
 #if GC_DEBUG > 0
-  printf("collecting, need %llu\n", bytes_requested);
+  printf("collecting, need %" PRIu64 "\n", bytes_requested);
 #endif
 
 #if GC_DEBUG > 1
@@ -198,127 +516,81 @@ void collect(int64_t** rootstack_ptr, uint64_t bytes_requested)
   assert(rootstack_ptr >= rootstack_begin);
   assert(rootstack_ptr < rootstack_end);
 
+  num_collections++;
+
 #ifndef NDEBUG
-  // All pointers in the rootstack point to fromspace.
+  // All pointers in the rootstack point to the heap.
   for (unsigned int i = 0; rootstack_begin + i < rootstack_ptr; i++) {
     int64_t* root = rootstack_begin[i];
     if (is_ptr(root)) {
       int64_t* a_root = to_ptr(root);
-      assert(fromspace_begin <= a_root && a_root < fromspace_end);
+      assert(in_nursery(a_root) || in_old(a_root));
     }
   }
 #endif
 
   // 2. Perform collection.
-  // CHECKME:
-  // If there is already enough space left, does this need to be done?
-  // It seems very expensive to do this for every vector that is allocated.
-  cheney(rootstack_ptr);
+  // Promotion can move the whole nursery to the old generation.
+  uint64_t start_ns = gc_telemetry() ? now_ns() : 0;
+  uint64_t heap_words =
+    (fromspace_end - fromspace_begin) + (old_free - old_begin);
+  uint64_t nursery_words = free_ptr - fromspace_begin;
+  int major = old_free + nursery_words > old_limit;
+  int64_t* promoted_begin = old_free;
+  int grow_nursery = 0;
+  if (major) {
+    major_collection(rootstack_ptr);
+    promoted_begin = old_begin;
+  } else {
+    minor_collection(rootstack_ptr);
+    grow_nursery = old_free - promoted_begin
+      > NURSERY_GROW_SURVIVAL * nursery_words;
+  }
 
-  // 3. Check if collection freed enough space in order to allocate.
-  if (sizeof(int64_t) * (fromspace_end - free_ptr) < bytes_requested) {
+  // 3. Resize the nursery if too much of it survived, or if it can't
+  // fit the bytes requested even though it is empty.
+  uint64_t nursery_bytes = (fromspace_end - fromspace_begin) * sizeof(int64_t);
+  uint64_t new_bytes = nursery_bytes;
+  if (grow_nursery && new_bytes < NURSERY_MAX_BYTES) {
+    new_bytes = 2 * new_bytes;
+  }
+  while (new_bytes <= bytes_requested) {
+    new_bytes = 2 * new_bytes;
+  }
+  if (new_bytes != nursery_bytes) {
 #if GC_DEBUG > 1
-    printf("resizing the heap\n");
-#endif
-    /*
-       If there is not enough room left for the bytes_requested,
-       allocate larger tospace and fromspace.
-
-       In order to determine the new size of the heap double the
-       heap size until it is bigger than the occupied portion of
-       the heap plus the bytes requested.
-
-       This covers the corner case of heaps objects that are
-       more than half the size of the heap. Not a very likely
-       scenario but slightly more robust.
-
-       One corner case that isn't handled is if the heap is size
-       zero. My thought is that malloc probably wouldn't give
-       back a pointer if you asked for 0 bytes. Thus initialize
-       would fail, but our runtime-config.rkt file has a contract
-       on the heap_size parameter that the code generator uses
-       to determine initial heap size to this is a non-issue
-       in reality.
-    */
-
-    unsigned long occupied_bytes = (free_ptr - fromspace_begin) * sizeof(int64_t);
-    unsigned long needed_bytes = occupied_bytes + bytes_requested;
-    unsigned long old_len = fromspace_end - fromspace_begin;
-    unsigned long old_bytes = old_len * sizeof(int64_t);
-    unsigned long new_bytes = old_bytes;
-
-#if 0
-    // this version is good for debugging purposes -Jeremy
-    new_bytes = needed_bytes;
-#else
-    while (new_bytes <= needed_bytes) {
-      new_bytes = 2 * new_bytes;
-    }
+    printf("resizing the nursery to %" PRIu64 "\n", new_bytes);
 #endif
+    free(fromspace_begin);
+    new_nursery(new_bytes);
+  }
+  free_ptr = fromspace_begin;
 
-    // Free and allocate a new tospace of size new_bytes
-    free(tospace_begin);
-
-    if (!(tospace_begin = malloc(new_bytes))) {
-      fprintf(stderr, "failed to malloc %lu byte fromspace", new_bytes);
-      exit(EXIT_FAILURE);
-    }
-
-    tospace_end = tospace_begin + new_bytes / (sizeof(int64_t));
-
-    // The pointers on the stack and in the heap must be updated,
-    // so this cannot be just a memcopy of the heap.
-    // Performing cheney's algorithm again will have the correct
-    // effect, and we have already implemented it.
-    cheney(rootstack_ptr);
-
-    // Cheney flips tospace and fromspace. Thus, we allocate another
-    // tospace not fromspace as we might expect.
-    free(tospace_begin);
-
-    if (!(tospace_begin = malloc(new_bytes))) {
-      fprintf(stderr, "failed to malloc %lu byte tospace", new_bytes);
-      exit(EXIT_FAILURE);
-    }
-
-    tospace_end = tospace_begin + new_bytes / (sizeof(int64_t));
+  if (gc_telemetry()) {
+    trace_collection(major ? "major" : "minor", bytes_requested,
+                     (old_free - promoted_begin) * sizeof(int64_t),
+                     now_ns() - start_ns, heap_words * sizeof(int64_t),
+                     rootstack_ptr - rootstack_begin);
   }
 
-  assert(free_ptr < fromspace_end);
-  assert(free_ptr >= fromspace_begin);
+  assert(free_ptr + bytes_requested / sizeof(int64_t) < fromspace_end);
 
 #ifndef NDEBUG
-  // All pointers in the rootstack point to fromspace
+  // All pointers in the rootstack point to the old generation.
   for (unsigned long i = 0; rootstack_begin + i < rootstack_ptr; i++) {
     int64_t* root = rootstack_begin[i];
     if (is_ptr(root)) {
-      int64_t* a_root = to_ptr(root);
-      assert(fromspace_begin <= a_root && a_root < fromspace_end);
+      assert(in_old(to_ptr(root)));
     }
   }
-  // All pointers in fromspace point to fromspace
-  /*printf("validating pointers in fromspace [%lld, %lld)\n",
-    (int64_t)fromspace_begin, (int64_t)fromspace_end);*/
-  int64_t* scan_ptr = fromspace_begin;
-  while (scan_ptr != free_ptr) {
-    validate_vector(&scan_ptr);
-#if 0
-    int64_t tag = *scan_ptr;
-    unsigned char len = get_vector_length(tag);
-    int64_t isPtrBits = get_vec_ptr_bitfield(tag);
-    int64_t* data = scan_ptr + 1;
-    scan_ptr = scan_ptr + len + 1;
-    for (unsigned char i = 0; i != len; i++) {
-      if ((isPtrBits >> i) & 1) {
-        int64_t* ptr = (int64_t*) data[i];
-        if (is_ptr(ptr)) {
-          int64_t* real_ptr = to_ptr(ptr);
-          assert(real_ptr < fromspace_end);
-          assert(real_ptr >= fromspace_begin);
-        }
-      }
-    }
 #endif
+
+#if GC_DEBUG > 0
+  // All pointers in the old generation point to the old generation.
+  // This reads every page, which doesn't trigger the write barrier.
+  int64_t* scan_ptr = old_begin;
+  while (scan_ptr != old_free) {
+    validate_vector(&scan_ptr);
   }
 #endif
 
@@ -339,16 +611,15 @@ void collect(int64_t** rootstack_ptr, uint64_t bytes_requested)
 static void copy_vector(int64_t** vector_ptr_loc);
 
 /*
-  The Cheney algorithm takes a pointer to the top of the rootstack.
-  It resets the free pointer to be at the beginning of tospace, copies
-  (or reallocates) the data pointed to by the roots into tospace and
-  replaces the pointers in the rootset with pointers to the
-  copies. (See the description of copy_vector below).
+  Both kinds of collection use Cheney's algorithm.  It starts by
+  copying (or reallocating) the data pointed to by the roots to
+  `copy_ptr` and replacing the pointers in the rootset with pointers
+  to the copies. (See the description of copy_vector below).
 
-  While this initial copying of root vectors is occurring the free_ptr
+  While this initial copying of root vectors is occurring `copy_ptr`
   has been maintained to remain at the next free memory location in
-  tospace. Cheney's algorithm then scans a vector at a time until it
-  reaches the free_ptr.
+  the old generation. Cheney's algorithm then scans a vector at a time
+  until it reaches `copy_ptr`.
 
   At each vector we use the meta information stored in the vector tag
   to find the length of the vector and tell which fields inside the
@@ -360,20 +631,19 @@ static void copy_vector(int64_t** vector_ptr_loc);
   This process is a breadth first graph traversal. Copying a vector
   places its contents at the end of a FIFO queue and scanning a vector
   removes it. Eventually the graph traversal will run out of unseen
-  nodes and will "catch up" to the free pointer. When this occurs we
-  know that all live data in the program is contained by tospace,
-  and that everything left in fromspace is unreachable by the program.
-
-  After this point the free pointer will be pointing into what until
-  now we considered tospace. This means the program will allocate
-  objects here. In order to keep track of this we "flip" fromspace and
-  tospace by making the fromspace pointers point to tospace and vice
-  versa.
+  nodes and will "catch up" to `copy_ptr`. When this occurs we
+  know that all live data in the program is in the old generation,
+  and that everything left in the nursery is unreachable by the
+  program, so it can be reused.
+
+  In a minor collection the roots also include the pointers in the
+  objects on the remembered pages, and pointers to old objects are
+  left alone.
 */
 
 void process_vector(int64_t** scan_addr) {
-  // Since this tag is already in tospace we know that it isn't
-  // a forwarding pointer.
+  // Since this tag is already in the old generation we know that it
+  // isn't a forwarding pointer.
   int64_t tag = **scan_addr;
 
   if (is_vecof(tag)) {
@@ -414,12 +684,9 @@ void process_vector(int64_t** scan_addr) {
   }
 }
 
-void cheney(int64_t** rootstack_ptr)
-{
-  // printf("cheney: starting copy, rootstack=%p\n", rootstack_ptr);
-  int64_t* scan_ptr = tospace_begin;
-  free_ptr = tospace_begin;
-
+// Copy the objects pointed to by the roots, then scan the copies
+// from `scan_ptr` until the traversal catches up with `copy_ptr`.
+static void copy_roots(int64_t** rootstack_ptr) {
   /* traverse the root set to create the initial queue */
   for (int64_t** root_loc = rootstack_begin;
        root_loc != rootstack_ptr;
@@ -431,72 +698,122 @@ void cheney(int64_t** rootstack_ptr)
     */
     copy_vector(root_loc);
   }
+}
 
-  /*
-     Here we need to scan tospace until we reach the free_ptr pointer.
-     This will end up being a breadth first search of the pointers in
-     from space.
-  */
-  while (scan_ptr != free_ptr) {
+static void scan_copies(int64_t* scan_ptr) {
+  while (scan_ptr != copy_ptr) {
     process_vector(&scan_ptr);
-#if 0
-    /*
-       I inlined this to leave manipulation of scan_ptr to a single
-       function. This can be accomplished by passing the location
-       of the pointer into helper, but let's not make reasoning
-       through the algorithm any harder.
-
-       The invariant of the outer loop is that scan_ptr is either
-       at the front of a vector, or == to free_ptr.
-    */
+  }
+}
 
-    // Since this tag is already in tospace we know that it isn't
-    // a forwarding pointer.
-    int64_t tag = *scan_ptr;
+// Process the objects of the old generation that overlap a page and
+// that are below `end`.  Objects are smaller than pages, so the
+// object covering the beginning of the page starts on the page or on
+// the one before.
+static void scan_page(uint64_t page, int64_t* end) {
+  int64_t* page_end = page_begin(page + 1);
+  int64_t* scan_ptr;
+  if (page > 0 && first_object[page - 1] >= 0) {
+    scan_ptr = page_begin(page - 1) + first_object[page - 1];
+  } else if (first_object[page] >= 0) {
+    scan_ptr = page_begin(page) + first_object[page];
+  } else {
+    return;
+  }
+  while (scan_ptr < page_end && scan_ptr < end) {
+    int64_t* next_ptr = scan_ptr + get_vec_length(*scan_ptr) + 1;
+    if (next_ptr > page_begin(page)) {
+      process_vector(&scan_ptr);
+    } else {
+      scan_ptr = next_ptr;
+    }
+  }
+}
 
-    // the length of the vector is contained in bits [1,6]
-    int len = get_vector_length(tag);
+// Protect the pages of the old generation that have filled up.
+static void protect_full_pages(void) {
+  int64_t* full_end = page_begin(page_of(old_free));
+  protect(old_protected_end, full_end, PROT_READ);
+  old_protected_end = full_end;
+}
 
-    // Find the next vector or the next free_ptr;
-    // with is len + 1 away from the current;
-    int64_t* next_ptr = scan_ptr + len + 1;
+// Promote the live objects of the nursery to the old generation.
+static void minor_collection(int64_t** rootstack_ptr)
+{
+  int64_t* scan_end = old_free;
+  from_old_begin = from_old_end = NULL;
+  copy_ptr = old_free;
 
-    // each bit low to high says if the next index is a ptr
-    int64_t isPointerBits = get_vec_ptr_bitfield(tag);
+  copy_roots(rootstack_ptr);
 
-    // Advance the scan_ptr then check to
-    // see if we have arrived at the beginning of the next array.
-    scan_ptr += 1;
-    while(scan_ptr != next_ptr) {
-      if ((isPointerBits & 1) == 1) {
-        // since the tag says that the scan ptr in question is a
-        // ptr* we known that scan_ptr currently points to a ptr*
-        // and must be a ptr** itself.
-        copy_vector((int64_t**)scan_ptr);
-      }
-      // Advance the tag so the next check is for the next scan ptr
-      isPointerBits = isPointerBits >> 1;
-      scan_ptr += 1;
+  // The objects on the remembered pages, and on the unprotected last
+  // page, may point into the nursery.
+  if (write_protect) {
+    if (old_protected_end < old_free) {
+      scan_page(page_of(old_protected_end), scan_end);
+    }
+  } else {
+    for (int64_t* p = old_begin; p < scan_end; p += page_words) {
+      remember_page(page_of(p));
     }
-#endif
   }
+  for (uint64_t i = 0; i != num_remembered; i++) {
+    scan_page(remembered_pages[i], scan_end);
+  }
+
+  scan_copies(scan_end);
+  old_free = copy_ptr;
 
-  /* swap the tospace and fromspace */
-  int64_t* tmp_begin = tospace_begin;
-  int64_t* tmp_end = tospace_end;
-  tospace_begin = fromspace_begin;
-  tospace_end = fromspace_end;
-  fromspace_begin = tmp_begin;
-  fromspace_end = tmp_end;
-  // printf("cheney: finished copy\n");
+  // Empty the remembered set and protect its pages again.
+  for (uint64_t i = 0; i != num_remembered; i++) {
+    uint64_t page = remembered_pages[i];
+    page_remembered[page] = 0;
+    protect(page_begin(page), page_begin(page + 1), PROT_READ);
+  }
+  num_remembered = 0;
+  protect_full_pages();
 }
 
+// Copy all the live objects into a new old generation.
+static void major_collection(int64_t** rootstack_ptr)
+{
+  // Forwarding pointers will be written over the old objects.
+  protect(old_begin, old_protected_end, PROT_READ | PROT_WRITE);
+
+  int64_t* prev_begin = old_begin;
+  int64_t* prev_end = old_end;
+  uint64_t prev_words = old_free - old_begin;
+  uint64_t nursery_words = free_ptr - fromspace_begin;
+  free(first_object);
+  free(page_remembered);
+  free(remembered_pages);
+
+  // Make room for everything to survive and for the new limit.
+  uint64_t used = prev_words + nursery_words;
+  new_old_generation(OLD_GROWTH_HIGH * used + (fromspace_end - fromspace_begin));
+  from_old_begin = prev_begin;
+  from_old_end = prev_begin + prev_words;
+  copy_ptr = old_begin;
+
+  copy_roots(rootstack_ptr);
+  scan_copies(old_begin);
+  old_free = copy_ptr;
+
+  from_old_begin = from_old_end = NULL;
+  munmap(prev_begin, (prev_end - prev_begin) * sizeof(int64_t));
+
+  uint64_t live = old_free - old_begin;
+  int growth = live > OLD_GROW_SURVIVAL * used ? OLD_GROWTH_HIGH : OLD_GROWTH;
+  old_limit = old_begin + growth * live + (fromspace_end - fromspace_begin);
+  protect_full_pages();
+}
 
 /*
   `copy_vector` takes a pointer (`location`) to a vector pointer,
-  copies the vector data from fromspace into tospace, and updates the
-  vector pointer so that it points to the the data's new address in
-  tospace.
+  copies the vector data to `copy_ptr` in the old generation, and
+  updates the vector pointer so that it points to the the data's new
+  address.  Vectors that aren't being collected (the old generation,
+  in a minor collection) stay where they are.
 
    Precondition:
      *  original vector pointer location
@@ -540,7 +857,8 @@ void cheney(int64_t** rootstack_ptr)
   point to the new data instead).
 
   As a side note any time you are allocating new data you must maintain
-  the invariant that the free_ptr points to the next free memory address.
+  the invariant that `copy_ptr` points to the next free memory address,
+  and record the objects that start new pages in `first_object`.
 */
 void copy_vector(int64_t** vector_ptr_loc)
 {
@@ -553,9 +871,9 @@ void copy_vector(int64_t** vector_ptr_loc)
   }
 
   old_vector_ptr = to_ptr(old_vector_ptr);
-#if 0
-  printf("copy_vector %ll\n", (int64_t)old_vector_ptr);
-#endif
+  if (!is_collected(old_vector_ptr)) {
+    return;
+  }
 
   int64_t tag = old_vector_ptr[0];
 
@@ -563,7 +881,6 @@ void copy_vector(int64_t** vector_ptr_loc)
   // would have left a forwarding pointer.
 
   if (is_forwarding(tag)) {
-    //printf("\talready copied to %lld\n", tag);
     // Since we left a forwarding pointer, we have already
     // moved this vector. All we need to do is update the pointer
     // that was pointing to the old vector. The
@@ -571,34 +888,26 @@ void copy_vector(int64_t** vector_ptr_loc)
     *vector_ptr_loc = (int64_t*) (tag | old_tag);
 
   } else {
-#if 0
-    printf("\tfirst time copy\n");
-#endif
     // This is the first time we have followed this pointer.
 
-    // Since we are about to jumble all the pointers around let's
-    // set up some structure to the world.
-
-    // The new vector is going to be where the free_ptr currently points.
-    int64_t* new_vector_ptr = free_ptr;
-#if 0
-      printf("\tto address: %lld\n", (int64_t)new_vector_ptr);
-#endif
+    // The new vector is going to be where copy_ptr currently points.
+    int64_t* new_vector_ptr = copy_ptr;
+    uint64_t page = page_of(new_vector_ptr);
+    if (first_object[page] < 0) {
+      first_object[page] = new_vector_ptr - page_begin(page);
+    }
 
     // The tag we grabbed earlier contains some usefull info for
     // forwarding copying the vector.
     int length = get_vec_length(tag);
-#if 0
-    printf("\tlen: %d\n", length);
-#endif
     // Copy the old vector to the new one.
     // The "length" is the number of elements, so to include the
     // tag, we need to iterate from 0 to length + 1;
     for (int i = 0; i != length + 1; i++) {
       new_vector_ptr[i] = old_vector_ptr[i];
     }
-    // the free ptr can be updated to point to the next free ptr.
-    free_ptr = free_ptr + length + 1;
+    // the copy ptr can be updated to point to the next free ptr.
+    copy_ptr = copy_ptr + length + 1;
 
     // We need to set the forwarding pointer in the old_vector
     old_vector_ptr[0] = (int64_t) new_vector_ptr;
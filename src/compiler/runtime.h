@@ -4,8 +4,11 @@
 // 64-bits.
 #include <stdint.h>
 
-// Fromspace is our heap which is conceptually an array of 64 bit data
-// unless meta information tells us more about about their contents.
+// Fromspace is the nursery of our heap, where new objects are
+// allocated; it is conceptually an array of 64 bit data unless meta
+// information tells us more about about their contents.  Objects that
+// survive a collection are moved to the old generation, which only
+// the collector knows about.
 int64_t* fromspace_begin;
 int64_t* fromspace_end;
 
@@ -26,7 +29,7 @@ void initialize(uint64_t rootstack_size, uint64_t heap_size);
 
 // Collect garbage data making room for a requested amount of memory.
 // Use the pointers in the rootstack to determine what values in the
-// heap are still live.
+// heap are still live.  Afterwards fromspace is empty.
 void collect(int64_t** rootstack_ptr, uint64_t bytes_requested);
 
 // Read an integer from stdin.
@@ -0,0 +1,162 @@
+open Support.Utils
+open Types
+open Lfun_ref
+
+let fresh = make_gensym ()
+
+(* Function to create new names for the fields of replaced vectors. *)
+let new_field_var (v : var) (i : int) : var =
+  fresh ~base:(Printf.sprintf "%s.%d" v i) ~sep:"."
+
+(* Number of vectors replaced by the last call to `scalar_replace`. *)
+let num_replaced = ref 0
+
+let vectors_replaced () = !num_replaced
+
+(* A vector reached from a variable by `vector-ref`s:
+   the variable and the indices, innermost last
+   (so `(vector-ref (vector-ref v 0) 1)` is `(v, [1; 0])`).
+   When `v` is replaced, so are the vectors in the fields that
+   don't escape either, and they are reached by the same paths. *)
+type path = var * int list
+
+module PathSet = Set.Make (struct
+  type t = path
+
+  let compare = compare
+end)
+
+let rec path_of (e : exp) : path option =
+  match e with
+  | Var v -> Some (v, [])
+  | VecRef (e, i) -> Option.map (fun (v, is) -> (v, i :: is)) (path_of e)
+  | _ -> None
+
+(* Collect, in one traversal of a function body, the paths of the
+   vectors that escape.  A vector doesn't escape if it is only used as
+   the vector of `vector-ref`, `vector-set!` and `vector-length`
+   expressions (whose indices are always constants); any other use
+   (e.g. passing it to a function, storing it in another vector,
+   returning it, comparing it or assigning to it) lets it escape.
+   Assigning to a field with `vector-set!` lets the field escape,
+   since it becomes a `set!` of the field's variable.
+   Variable names are unique after `uniquify`,
+   so no `Let` can shadow a vector variable. *)
+let escaping_paths (e : exp) : PathSet.t =
+  let escaping = ref PathSet.empty in
+  let escape p = escaping := PathSet.add p !escaping in
+  (* `e` is used as a value. *)
+  let rec use e =
+    match path_of e with
+    | Some p -> escape p
+    | None -> visit e
+  (* `e` is used as the vector of an access. *)
+  and access e =
+    match path_of e with
+    | Some _ -> ()
+    | None -> visit e
+  (* `e` isn't a path. *)
+  and visit e =
+    match e with
+    | Void
+     |Bool _
+     |Int _
+     |Var _
+     |FunRef _ ->
+      ()
+    | VecLen e
+     |VecRef (e, _) ->
+      access e
+    | VecSet (e1, i, e2) ->
+      ( match path_of e1 with
+      | Some (v, is) -> escape (v, i :: is)
+      | None -> visit e1 ) ;
+      use e2
+    | SetBang (v, e) -> escape (v, []) ; use e
+    | Prim (_, es)
+     |Vec (es, _) ->
+      List.iter use es
+    | Begin (es, e) -> List.iter use es ; use e
+    | If (e1, e2, e3) -> use e1 ; use e2 ; use e3
+    | While (e1, e2)
+     |Let (_, e1, e2) ->
+      use e1 ; use e2
+    | Apply (e, es) -> use e ; List.iter use es
+  in
+  use e ; !escaping
+
+(* Rewrite a function body, given the escaping paths `escaping`.
+   `fields` maps each replaced vector variable to the variables
+   holding its fields; the uses of replaced vectors are rewritten
+   to uses of those variables as the traversal reaches them. *)
+let rec replace_exp (escaping : PathSet.t) (fields : var array VarMap.t)
+  (e : exp) : exp =
+  let aux = replace_exp escaping fields in
+  let fields_of = function
+    | Var v -> VarMap.find_opt v fields
+    | _ -> None
+  in
+  match e with
+  | Let (v, e1, e2) ->
+    replace_let escaping fields (v, []) v (aux e1) (fun fields ->
+        replace_exp escaping fields e2 )
+  | Void
+   |Bool _
+   |Int _
+   |Var _
+   |FunRef _ ->
+    e
+  | VecRef (e, i) -> (
+    let e' = aux e in
+    match fields_of e' with
+    | Some fs -> Var fs.(i)
+    | None -> VecRef (e', i) )
+  | VecSet (e1, i, e2) -> (
+    let e1' = aux e1 in
+    let e2' = aux e2 in
+    match fields_of e1' with
+    | Some fs -> SetBang (fs.(i), e2')
+    | None -> VecSet (e1', i, e2') )
+  | VecLen e -> (
+    let e' = aux e in
+    match fields_of e' with
+    | Some fs -> Int (Array.length fs)
+    | None -> VecLen e' )
+  | Prim (op, es) -> Prim (op, List.map aux es)
+  | SetBang (v, e) -> SetBang (v, aux e)
+  | Begin (es, e) -> Begin (List.map aux es, aux e)
+  | If (e1, e2, e3) -> If (aux e1, aux e2, aux e3)
+  | While (e1, e2) -> While (aux e1, aux e2)
+  | Vec (es, ty) -> Vec (List.map aux es, ty)
+  | Apply (e, es) -> Apply (aux e, List.map aux es)
+
+(* Rebuild `(let (v e1) body)`, where `v` holds the vector at the path
+   `(root, is)` and `e1` has already been rewritten; `body fields`
+   rewrites the body.  If `e1` allocates a vector that doesn't escape,
+   bind each of its fields to a new variable instead, in the order they
+   were evaluated in.  The fields may be vectors that don't escape
+   either. *)
+and replace_let (escaping : PathSet.t) (fields : var array VarMap.t)
+  ((root, is) : path) (v : var) (e1 : exp)
+  (body : var array VarMap.t -> exp) : exp =
+  match e1 with
+  | Vec (es, Some _) when not (PathSet.mem (root, is) escaping) ->
+    incr num_replaced ;
+    let fs = Array.of_list (List.mapi (fun i _ -> new_field_var v i) es) in
+    let fields = VarMap.add v fs fields in
+    let rec bind_fields i fields = function
+      | [] -> body fields
+      | e :: es ->
+        replace_let escaping fields (root, i :: is) fs.(i) e (fun fields ->
+            bind_fields (i + 1) fields es )
+    in
+    bind_fields 0 fields es
+  | _ -> Let (v, e1, body fields)
+
+let scalar_replace_def (Def (name, {args; ret; body})) =
+  let escaping = escaping_paths body in
+  Def (name, {args; ret; body = replace_exp escaping VarMap.empty body})
+
+let scalar_replace (Program defs) =
+  num_replaced := 0 ;
+  Program (List.map scalar_replace_def defs)
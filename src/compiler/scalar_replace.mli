@@ -0,0 +1,9 @@
+(** "Scalar replacement" pass: keep the fields of vectors that don't
+    escape from their function in local variables instead of allocating
+    the vectors. *)
+
+val scalar_replace : Lfun_ref.program -> Lfun_ref.program
+
+val vectors_replaced : unit -> int
+(** Return the number of vectors replaced by the last call to
+    `scalar_replace`. *)
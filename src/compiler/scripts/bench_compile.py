@@ -0,0 +1,155 @@
+"""
+bench_compile.py:
+    Measure how compile time scales with program size.
+    Generate programs of increasing size with `gen_bench.py`,
+    compile each one with `-time-passes` and tabulate the time
+    taken by every pass, along with its empirical growth exponent
+    (1 is linear, 2 is quadratic) between the two largest sizes.
+"""
+
+import sys, os, math, time, random
+import subprocess as p
+import compile_server
+import result_cache
+import gen_bench
+from compile_server import run_compile
+from profile_passes import passes, read_timings
+from scratch import scratch_dir
+
+
+sizes       = [100, 1000, 10000, 100000]  # numbers of variables
+funs_per    = 100  # one function per this many variables
+timeout     = 600  # seconds
+warn_growth = 1.3  # flag passes growing faster than this exponent
+csv_file    = None
+
+
+def bench_size(size, tmpdir):
+    """
+    Generate and compile a program with `size` variables.
+    Return `(timings, total, error)`: a dict from pass names to
+    `(time, words, major_gcs)`, the total wall time, and an error
+    message (or `None` if the compilation succeeded).
+    """
+    gen_bench.nvars = size
+    gen_bench.nfuns = size // funs_per
+    progname = os.path.join(tmpdir, f'bench_{size}.src')
+    with open(progname, 'w') as f:
+        f.write(gen_bench.generate(random.Random(gen_bench.seed)))
+    timings_file = os.path.join(tmpdir, f'bench_{size}.timings')
+
+    start = time.perf_counter()
+    try:
+        (_, stderr_data, ret) = \
+            run_compile([progname, '-time-passes', timings_file],
+                        timeout=timeout)
+        error = None
+        if stderr_data != '' or ret != 0:
+            error = stderr_data.strip().split('\n')[-1] or f'exit code {ret}'
+    except p.TimeoutExpired:
+        error = f'timed out after {timeout} seconds'
+    total = time.perf_counter() - start
+
+    timings = {}
+    if os.path.exists(timings_file):
+        timings = read_timings(timings_file)
+    return (timings, total, error)
+
+
+def growth(t1, t2, n1, n2):
+    """Return the exponent `k` such that `t2 / t1 = (n2 / n1) ** k`."""
+    if t1 <= 0 or t2 <= 0:
+        return None
+    return math.log(t2 / t1) / math.log(n2 / n1)
+
+
+def report(results):
+    """Print a table of pass times against program sizes."""
+    done = [size for size in sizes if size in results]
+    print(f'{"pass":<8}' + ''.join(f'{size:>12}' for size in done) +
+          f'{"growth":>9}')
+    rows = passes + ['total']
+    for name in rows:
+        line = f'{name:<8}'
+        times = []
+        for size in done:
+            (timings, total, _) = results[size]
+            t = total if name == 'total' else \
+                timings.get(name, (None,))[0]
+            times.append(t)
+            line += f'{"-":>12}' if t is None else f'{t:>12.4f}'
+        k = None
+        if len(done) >= 2 and None not in times[-2:]:
+            k = growth(times[-2], times[-1], done[-2], done[-1])
+        if k is None:
+            line += f'{"-":>9}'
+        else:
+            line += f'{k:>9.2f}' + (' !' if k > warn_growth else '')
+        print(line)
+    for size in done:
+        error = results[size][2]
+        if error is not None:
+            print(f'\nsize {size}: FAILED: {error}')
+
+
+def write_csv(filename, results):
+    """Write one `size,pass,time,words,major_gcs` line per measurement."""
+    with open(filename, 'w') as f:
+        print('size,pass,time,words,major_gcs', file=f)
+        for (size, (timings, _, _)) in sorted(results.items()):
+            for name in passes:
+                if name in timings:
+                    (t, words, gcs) = timings[name]
+                    print(f'{size},{name},{t},{words:.0f},{gcs}', file=f)
+
+
+def usage():
+    """Print a usage message and exit."""
+    progname = os.path.basename(sys.argv[0])
+    usagestr = f'usage: {progname} [-sizes n1,n2,...] [-funs-per n] ' + \
+               '[-alloc rate] [-branch rate] [-seed n] [-csv file] ' + \
+               '[-no-server]'
+    print(usagestr, file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    # Timings have to be measured, never looked up.
+    result_cache.enabled = False
+
+    try:
+        while args:
+            flag = args.pop(0)
+            if flag == '-sizes':
+                sizes = sorted(int(n) for n in args.pop(0).split(','))
+            elif flag == '-funs-per':
+                funs_per = int(args.pop(0))
+            elif flag == '-alloc':
+                gen_bench.alloc_rate = float(args.pop(0))
+            elif flag == '-branch':
+                gen_bench.branch_rate = float(args.pop(0))
+            elif flag == '-seed':
+                gen_bench.seed = int(args.pop(0))
+            elif flag == '-csv':
+                csv_file = args.pop(0)
+            elif flag == '-no-server':
+                compile_server.use_server = False
+            else:
+                usage()
+    except (ValueError, IndexError):
+        usage()
+    if funs_per <= 0 or any(size <= 0 for size in sizes):
+        usage()
+
+    results = {}
+    with scratch_dir('bench-') as tmpdir:
+        for size in sizes:
+            print(f'size {size}...', file=sys.stderr)
+            results[size] = bench_size(size, tmpdir)
+            if results[size][2] is not None:
+                break  # larger sizes won't do any better
+    report(results)
+    if csv_file is not None:
+        write_csv(csv_file, results)
@@ -0,0 +1,229 @@
+"""
+bench_run.py:
+    Measure how fast the generated code runs.
+    Every program is compiled with each register option,
+    with and without the `opt` pass, and each executable is run
+    repeatedly (after some warm-up runs) on the program's first input set.
+    Report the median and 95th percentile run times, the number of
+    garbage collections and some static metrics of the generated code:
+    the instruction count, spill slots and root-stack slots.
+"""
+
+import sys, os, re, glob, math, time
+import subprocess as p
+from subprocess import PIPE
+import compile_server
+import run_eval_tests
+from compile_server import run_compile
+from run_eval_tests import get_metadata, build_executable, reg_options
+from runtime_cache import runtime_object
+from scratch import scratch_dir
+
+
+nruns     = 10  # timed runs of each executable
+nwarmup   = 2   # untimed runs before the timed ones
+timeout   = 60  # seconds
+opt_modes = [True, False]
+gc_patt   = re.compile(r'^\(gc \(collections (\d+)\)', re.MULTILINE)
+spill_patt      = re.compile(r'\(num_spilled (\d+)\)')
+spill_root_patt = re.compile(r'\(num_spilled_root (\d+)\)')
+compiler_flags  = []  # passed on to the compiler
+compiler_flag_names = ['-move-bias', '-coalesce', '-scalar-replace',
+                       '-merge-alloc-checks', '-layout-blocks']
+
+
+class Error(Exception):
+    """Exception class for benchmark errors."""
+    pass
+
+
+def config_name(reg_opt, opt):
+    """Return a short name for a compiler configuration."""
+    name = reg_opt if reg_opt != '' else 'all'
+    return name + ('' if opt else ' no-opt')
+
+
+def compile_args(progname, reg_opt, opt):
+    """Return the compiler arguments for a configuration."""
+    args = [progname]
+    if reg_opt != '':
+        args += ['-regs', reg_opt]
+    if not opt:
+        args.append('-no-opt')
+    return args + compiler_flags
+
+
+def compile_checked(args):
+    """Run the compiler and return its output, which must be clean."""
+    (stdout_data, stderr_data, ret) = run_compile(args, timeout=timeout)
+    if stderr_data != '' or ret != 0:
+        raise Error(f'compile {" ".join(args)} failed\n{stderr_data}')
+    return stdout_data
+
+
+def static_metrics(progname, reg_opt, opt):
+    """
+    Compile `progname` in a configuration and return
+    `(asm_code, instructions, spills, root_spills)`, where the last
+    two are the numbers of stack and root-stack slots for spilled
+    variables, summed over all functions.
+    """
+    args = compile_args(progname, reg_opt, opt)
+    asm_code = compile_checked(args)
+    instructions = 0
+    for line in asm_code.splitlines():
+        line = line.strip()
+        if line and not line.startswith('.') and not line.endswith(':'):
+            instructions += 1
+    # The spill counts are in the function info after `pi`.
+    pi_code = compile_checked(args + ['-pass', 'pi'])
+    spills = sum(map(int, spill_patt.findall(pi_code)))
+    root_spills = sum(map(int, spill_root_patt.findall(pi_code)))
+    return (asm_code, instructions, spills, root_spills)
+
+
+def time_runs(executable_name, inputs, output):
+    """
+    Run an executable `nwarmup + nruns` times, checking its result.
+    Return the list of timed run times and the number of collections.
+    """
+    env = dict(os.environ, GC_STATS='1')
+    samples = []
+    collections = None
+    for i in range(nwarmup + nruns):
+        start = time.perf_counter()
+        proc = p.Popen([executable_name], text=True, env=env,
+                       stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        (_, stderr_data) = proc.communicate(input=inputs, timeout=timeout)
+        elapsed = time.perf_counter() - start
+        if proc.returncode != int(output):
+            raise Error(f'invalid output; expected [{output}] '
+                        f'but got [{proc.returncode}]')
+        match = gc_patt.search(stderr_data)
+        if match:
+            collections = int(match.group(1))
+        if i >= nwarmup:
+            samples.append(elapsed)
+    return (samples, collections)
+
+
+def percentile(samples, q):
+    """Return the `q`-th percentile (nearest rank) of `samples`."""
+    samples = sorted(samples)
+    return samples[max(0, math.ceil(q / 100 * len(samples)) - 1)]
+
+
+def bench_program(progname, runtime_name):
+    """
+    Benchmark every configuration of the program `progname`.
+    Return a dict from configurations `(reg_opt, opt)` to
+    `(median, p95, collections, instructions, spills, root_spills)`.
+    """
+    (inputs, output) = get_metadata(progname)[0]
+    basename = os.path.basename(progname)
+    results = {}
+    with scratch_dir('bench-') as builddir:
+        for opt in opt_modes:
+            for reg_opt in reg_options:
+                (asm_code, instructions, spills, root_spills) = \
+                    static_metrics(progname, reg_opt, opt)
+                executable_name = build_executable(
+                    builddir, basename, asm_code, runtime_name, {},
+                    run_eval_tests.compile_arm64)
+                (samples, collections) = \
+                    time_runs(executable_name, inputs, output)
+                results[(reg_opt, opt)] = \
+                    (percentile(samples, 50), percentile(samples, 95),
+                     collections, instructions, spills, root_spills)
+    return results
+
+
+def report_program(progname, results):
+    """Print the results for one program."""
+    print(f'{progname}:')
+    print(f'  {"config":<16}{"median ms":>10}{"p95 ms":>10}{"GCs":>6}'
+          f'{"instrs":>8}{"spills":>8}{"root":>6}')
+    for ((reg_opt, opt), (median, p95, gcs, instrs, spills, roots)) \
+            in results.items():
+        gcs = '-' if gcs is None else gcs
+        print(f'  {config_name(reg_opt, opt):<16}{median * 1e3:>10.3f}'
+              f'{p95 * 1e3:>10.3f}{gcs:>6}{instrs:>8}{spills:>8}{roots:>6}')
+    print()
+
+
+def report_summary(all_results):
+    """
+    Print the geometric mean, over all programs, of each configuration's
+    median run time and instruction count relative to the first one.
+    """
+    configs = list(next(iter(all_results.values())))
+    base = configs[0]
+    print(f'Relative to {config_name(*base)} '
+          f'(geometric mean over {len(all_results)} programs):')
+    print(f'  {"config":<16}{"time":>8}{"instrs":>8}')
+    for config in configs:
+        time_ratios = []
+        instr_ratios = []
+        for results in all_results.values():
+            time_ratios.append(results[config][0] / results[base][0])
+            instr_ratios.append(results[config][3] / results[base][3])
+        print(f'  {config_name(*config):<16}'
+              f'{geometric_mean(time_ratios):>8.3f}'
+              f'{geometric_mean(instr_ratios):>8.3f}')
+
+
+def geometric_mean(xs):
+    """Return the geometric mean of positive numbers."""
+    return math.exp(sum(math.log(x) for x in xs) / len(xs))
+
+
+def usage():
+    """Print a usage message and exit."""
+    progname = os.path.basename(sys.argv[0])
+    usagestr = f'usage: {progname} [-runs n] [-warmup n] ' + \
+               '[-regs "r1;r2;..."] [-move-bias] [-coalesce] ' + \
+               '[-scalar-replace] [-merge-alloc-checks] ' + \
+               '[-layout-blocks] ' + \
+               '[-no-server] [file1 ...]'
+    print(usagestr, file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    try:
+        while args and args[0].startswith('-'):
+            flag = args.pop(0)
+            if flag == '-runs':
+                nruns = int(args.pop(0))
+            elif flag == '-warmup':
+                nwarmup = int(args.pop(0))
+            elif flag == '-regs':
+                reg_options = args.pop(0).split(';')
+            elif flag in compiler_flag_names:
+                compiler_flags.append(flag)
+            elif flag == '-no-server':
+                compile_server.use_server = False
+            else:
+                usage()
+    except (ValueError, IndexError):
+        usage()
+    if nruns <= 0 or nwarmup < 0:
+        usage()
+
+    filenames = args or sorted(glob.glob('tests/*.src'),
+                               key=run_eval_tests.extract_number)
+    runtime_name = runtime_object(run_eval_tests.c_compiler)
+    all_results = {}
+    for progname in filenames:
+        try:
+            all_results[progname] = bench_program(progname, runtime_name)
+        # `build_executable` raises a plain `Exception` when a program
+        # doesn't assemble or link; that fails only this program.
+        except Exception as e:
+            print(f'{progname}: ERROR: {e}\n')
+            continue
+        report_program(progname, all_results[progname])
+    if all_results:
+        report_summary(all_results)
@@ -3,10 +3,16 @@ compare.py:
     Compare compiler outputs for a particular input file and pass.
 """
 
-import sys, re, os, random
+import sys, re, os, random, glob, difflib, itertools, time
 import subprocess as p
 from subprocess import PIPE
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import compile_server
+import result_cache
+import results
+import refpack
+from compile_server import run_compile
 
 
 passes  = ['lfun', 'tc1', 'sh', 'un', 'rf', 'lf', 'tc1b', 'ea', 'ug',
@@ -18,6 +24,58 @@ timeout = 5  # seconds
 pause   = False
 diff    = False
 nrandom = -1
+changed = False
+njobs   = 1  # number of worker threads for `-diff`
+since   = 'HEAD'
+jsonl_file = None  # write JSON Lines results here (implies `-diff`)
+junit_file = None  # write a JUnit XML report here (implies `-diff`)
+pack       = None  # `refpack.Pack` to read the reference files from
+
+# The passes whose `-only` output each compiler module can affect.
+# Language definitions affect every pass that reads or writes them.
+# Modules that aren't listed (e.g. `types.ml`, `compile.ml`
+# and the support library) are assumed to affect every pass.
+module_passes = {
+    'type_check':          ['tc1', 'tc1b', 'tc2'],
+    'type_check_lfun':     ['tc1'],
+    'shrink':              ['sh'],
+    'uniquify':            ['un'],
+    'reveal_functions':    ['rf'],
+    'limit_functions':     ['lf'],
+    'type_check_lfun_ref': ['tc1b'],
+    'scalar_replace':      ['ea'],
+    'expose_allocation':   ['ea'],
+    'uncover_get':         ['ug'],
+    'remove_complex':      ['rc'],
+    'explicate_control':   ['ec'],
+    'type_check_cfun':     ['tc2'],
+    'remove_unused':       ['ru'],
+    'select_instructions': ['si'],
+    'uncover_live':        ['ul'],
+    'build_interference':  ['bi'],
+    'graph_coloring':      ['ar'],
+    'allocate_registers':  ['ar'],
+    'remove_jumps':        ['rj'],
+    'patch_instructions':  ['pi'],
+    'prelude_conclusion':  ['pc'],
+    'alloc_utils':         ['pc'],
+    'optimize':            ['opt'],
+    'print_asm':           ['pa'],
+    'lfun':                ['tc1', 'sh'],
+    'lfun_shrink':         ['sh', 'un', 'rf'],
+    'lfun_ref':            ['rf', 'lf', 'tc1b', 'ea'],
+    'lfun_ref_alloc':      ['ea', 'ug'],
+    'lfun_ref_alloc_get':  ['ug', 'rc'],
+    'lfun_ref_mon':        ['rc', 'ec'],
+    'cfun':                ['ec', 'tc2', 'ru', 'si'],
+    'x86_var_def':         ['si', 'ul', 'bi', 'ar', 'rj', 'pi'],
+    'x86_def':             ['pi', 'pc'],
+    'x86_asm':             ['pc', 'opt', 'pa'],
+    # Only used for `.src` files and evaluation, never by `-only`.
+    'parser':              [],
+    'interp':              [],
+    'interp_utils':        [],
+}
 
 
 def fatal_error(msg):
@@ -106,13 +164,145 @@ def random_filenames(filenames, n):
     return order_filenames(new_filenames)
 
 
-def diff_filename(infilename):
+def git_lines(args):
+    """Run a git command and return its output lines."""
+    proc = p.Popen(['git'] + args, text=True,
+                   stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
+    if proc.returncode != 0:
+        fatal_error(f'git {" ".join(args)}: {stderr_data.strip()}')
+    return stdout_data.splitlines()
+
+
+def changed_files(since):
+    """
+    Return the files that differ from git revision `since`
+    (including untracked files), relative to the current directory.
+    """
+    top = git_lines(['rev-parse', '--show-toplevel'])[0]
+    names = git_lines(['diff', '--name-only', since]) + \
+        git_lines(['-C', top, 'ls-files', '--others', '--exclude-standard'])
+    return [os.path.relpath(os.path.join(top, name)) for name in names]
+
+
+def affected_passes(filenames):
+    """
+    Return the set of passes whose output can be affected by
+    changes to the files `filenames`.
+    """
+    affected = set()
+    for filename in filenames:
+        (root, ext) = os.path.splitext(os.path.basename(filename))
+        if ext not in ['.ml', '.mli'] and os.path.basename(filename) != 'dune':
+            continue
+        if ext in ['.ml', '.mli'] and root.startswith('interp_'):
+            root = 'interp'
+        in_compiler = os.path.dirname(os.path.abspath(filename)) == os.getcwd()
+        if in_compiler and root in module_passes:
+            affected.update(module_passes[root])
+        else:
+            affected.update(passes[1:])
+    return affected
+
+
+def changed_filenames(filenames):
+    """
+    Select the input files from `filenames` (all of `reference`
+    if empty) whose comparison is affected by the changes since
+    git revision `since`: either the pass being tested changed,
+    or its input or reference output file did.
+    """
+    if filenames == []:
+        filenames = all_filenames()
+    changes = changed_files(since)
+    affected = affected_passes(changes)
+    changes = set(changes)
+    selected = []
+    for infilename in filenames:
+        match = inpatt.match(infilename)
+        if not match or match.group(2) not in passes[:-1]:
+            continue
+        outfilename = get_output_filename(infilename) + match.group(3)
+        if passes[passes.index(match.group(2)) + 1] in affected or \
+                infilename in changes or outfilename in changes:
+            selected.append(infilename)
+    return selected
+
+
+def split_lines(text):
+    """
+    Split text into lines, ignoring a final newline
+    and any carriage returns at the ends of lines.
+    """
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return [line.rstrip('\r') for line in lines]
+
+
+def all_filenames():
+    """
+    Return the names of all the reference files,
+    in comparison order if they come from the pack.
+    """
+    if pack is not None:
+        return ['reference/' + name for name in pack.names()]
+    return glob.glob('reference/*')
+
+
+def reference_exists(filename):
+    """Return `True` if the reference file `filename` exists."""
+    if pack is not None and os.path.basename(filename) in pack:
+        return True
+    return os.path.isfile(filename)
+
+
+def input_path(infilename):
+    """
+    Return a path of the input file `infilename` for the compiler.
+    Input files that are only in the pack are extracted first.
+    """
+    name = os.path.basename(infilename)
+    if pack is not None and not os.path.isfile(infilename) and name in pack:
+        return pack.extract(name)
+    return infilename
+
+
+def read_reference(outfilename):
+    """Return the contents of the reference output file `outfilename`."""
+    if pack is not None and outfilename in pack:
+        return pack.read(outfilename)
+    with open('reference/' + outfilename, 'r') as reffile:
+        return reffile.read()
+
+
+def diff_lines(outlines, reflines, outfilename):
+    """
+    Compare the compiler output lines `outlines` to the reference
+    lines `reflines` for the output file `outfilename`.
+    Return a unified diff as a list of lines,
+    which is empty if the outputs are the same.
+    """
+    # Identical outputs (the usual case) only need a linear scan.
+    if outlines == reflines:
+        return []
+    return list(difflib.unified_diff(outlines, reflines,
+                                     fromfile=outfilename,
+                                     tofile='reference/' + outfilename,
+                                     lineterm=''))
+
+
+def diff_filename(infilename, info):
     """
     Compare the compiler output for a file `infilename`
     to the corresponding output file for that pass
     located in the `reference` directory.
     The pass is inferred from the filename extension.
-    Do the comparison by invoking the `diff` program.
+    The comparison is done in memory; return `(status, report)`,
+    where `status` is 'pass', 'fail' or 'error' (the compiler failed)
+    and `report` is the report to print.
+    Record the time taken to compile (in `info['times']`)
+    and whether the output came from the cache (in `info['cached']`).
     """
 
     match = inpatt.match(infilename)
@@ -132,55 +322,58 @@ def diff_filename(infilename):
     outpass = passes[inpass_i + 1]
 
     if regs == '':
-        args = ['./compile', infilename, '-pass', outpass, '-only',
+        args = [input_path(infilename), '-pass', outpass, '-only',
                 '-no-fix-label']
     else:
-        args = ['./compile', infilename, '-pass', outpass, '-only',
+        args = [input_path(infilename), '-pass', outpass, '-only',
                 '-no-fix-label', '-regs', regs]
 
-    proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
-    ret = proc.returncode
+    start = time.perf_counter()
+    (stdout_data, stderr_data, ret) = \
+        run_compile(args, timeout=timeout, info=info)
+    info['times']['compile'] = time.perf_counter() - start
 
     # Compiling the source file shouldn't return anything on stderr.
     if stderr_data != '':
-        print(stderr_data)
-        raise Error('compile: non-empty stderr data')
+        raise Error(f'compile: non-empty stderr data\n{stderr_data}')
 
+    report = ''
+    status = None
     if ret != 0:
-        print(f'compilation of {infilename} failed!')
+        report += f'compilation of {infilename} failed!\n'
+        status = 'error'
 
-    # Copy the output to a file.
     if regs == '':
         outfilename = root + '.' + outpass
     else:
         outfilename = root + '.' + outpass + ',' + regs
 
-    with open(outfilename, 'w') as outfile:
-        print(stdout_data, file=outfile, end='')
-
-    reffilename = 'reference/' + outfilename
-
-    # Call the `diff` program.
-    args = ['diff', '--strip-trailing-cr', outfilename, reffilename]
-    proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
-    ret = proc.returncode
-
-    if stderr_data != '':
-        print(stderr_data)
-        raise Error('diff: non-empty stderr data')
+    # With a pack, identical outputs only need their hashes compared.
+    if pack is not None and outfilename in pack and \
+            pack.matches(outfilename, stdout_data):
+        lines = []
+    else:
+        reflines = split_lines(read_reference(outfilename))
+        lines = diff_lines(split_lines(stdout_data), reflines, outfilename)
 
-    if ret == 0:
-        print("OK")
+    if lines == []:
+        report += 'OK\n'
     else:
-        print("DIFFERENT")
-        print('----')
-        print(stdout_data, end='')
-        print('----')
+        report += 'DIFFERENT\n----\n'
+        report += ''.join(line + '\n' for line in lines)
+        report += '----\n'
+    if status is None:
+        status = 'pass' if lines == [] else 'fail'
+    return (status, report)
 
-    # Remove the compiled file.
-    os.remove(outfilename)
+
+def diff_record(infilename, status, message, info):
+    """Return the `results.Record` for comparing `infilename`."""
+    match = inpatt.match(infilename)
+    option = passes[passes.index(match.group(2)) + 1] + match.group(3)
+    return results.Record(infilename, None, 'compare', option, status,
+                          None, None, message, info['times'],
+                          info.get('cached', False))
 
 
 def get_output_filename(infilename):
@@ -231,15 +424,13 @@ def compare_filename(infilename):
     outpass = passes[inpass_i + 1]
 
     if regs == '':
-        args = ['./compile', infilename, '-pass', outpass, '-only',
+        args = [input_path(infilename), '-pass', outpass, '-only',
                 '-no-fix-label']
     else:
-        args = ['./compile', infilename, '-pass', outpass, '-only',
+        args = [input_path(infilename), '-pass', outpass, '-only',
                 '-no-fix-label', '-regs', regs]
 
-    proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
-    ret = proc.returncode
+    (stdout_data, stderr_data, ret) = run_compile(args, timeout=timeout)
 
     # Compiling the source file shouldn't return anything on stderr.
     if stderr_data != '':
@@ -250,57 +441,35 @@ def compare_filename(infilename):
         print(f'compilation of {infilename} failed!')
 
     # Generate the student output lines.
-    outlines = []
-    line = '# Student version.'
-    outlines.append(line)
-    lines = stdout_data.split('\n')[:-1]
-    for line in lines:
-        outlines.append(line)
+    outlines = ['# Student version.'] + split_lines(stdout_data)
     out_max_len = max(map(len, outlines))
 
     # Generate the reference output lines.
-    reflines = []
-    line = '# Reference version.'
-    reflines.append(line)
     if regs == '':
         outfilename = root + '.' + outpass
     else:
         outfilename = root + '.' + outpass + ',' + regs
-    with open('reference/' + outfilename, 'r') as inref:
-        for line in inref:
-            reflines.append(line[:-1])
+    reflines = ['# Reference version.'] + \
+        split_lines(read_reference(outfilename))
     ref_max_len = max(map(len, reflines))
 
     pad = 10  # characters
 
     # Display output side-by-side.
-    while outlines or reflines:
-        # Get the next lines.
-        if outlines:
-            outline = outlines.pop(0)
-        else:
-            outline = ''
-        if reflines:
-            refline = reflines.pop(0)
-        else:
-            refline = ''
-
-        # Pad the sublines to the max lengths.
-        outdiff = out_max_len - len(outline)
-        assert outdiff >= 0
-        outline += ' ' * outdiff
-
-        refdiff = ref_max_len - len(refline)
-        assert refdiff >= 0
-        refline += ' ' * refdiff
-
-        line = outline + (' ' * pad) + refline
+    for (outline, refline) in itertools.zip_longest(outlines, reflines,
+                                                    fillvalue=''):
+        # Pad the lines to the max lengths.
+        line = outline.ljust(out_max_len) + (' ' * pad) + \
+            refline.ljust(ref_max_len)
         print(line)
 
 
 if __name__ == '__main__':
     usagestr = 'usage: python compare.py ' + \
-               '[-pause] [-diff] [-random n] filename [filename ...]'
+               '[-pause] [-diff] [-random n] [-no-server] [-no-cache] ' + \
+               '[-changed [-since rev]] [-j n] ' + \
+               '[-jsonl file] [-junit file] [-pack file] ' + \
+               'filename [filename ...]'
 
     args = sys.argv[1:]
 
@@ -312,6 +481,68 @@ if __name__ == '__main__':
         args.remove('-diff')
         diff = True
 
+    if '-no-server' in args:
+        args.remove('-no-server')
+        compile_server.use_server = False
+
+    if '-no-cache' in args:
+        args.remove('-no-cache')
+        result_cache.enabled = False
+
+    if '-changed' in args:
+        args.remove('-changed')
+        changed = True
+
+    if '-since' in args:
+        i = args.index('-since')
+        args.remove('-since')
+        try:
+            since = args.pop(i)
+        except IndexError:
+            print('ERROR: no argument for `-since` option',
+                  file=sys.stderr)
+            sys.exit(1)
+
+    if '-j' in args:
+        i = args.index('-j')
+        args.remove('-j')
+        try:
+            njobs = int(args.pop(i))
+        except (ValueError, IndexError):
+            njobs = 0
+        if njobs <= 0:
+            print('ERROR: `-j` argument must be a positive integer',
+                  file=sys.stderr)
+            sys.exit(1)
+
+    for flag in ['-jsonl', '-junit']:
+        if flag in args:
+            i = args.index(flag)
+            args.remove(flag)
+            try:
+                if flag == '-jsonl':
+                    jsonl_file = args.pop(i)
+                else:
+                    junit_file = args.pop(i)
+            except IndexError:
+                print(f'ERROR: no argument for `{flag}` option',
+                      file=sys.stderr)
+                sys.exit(1)
+            diff = True
+
+    if '-pack' in args:
+        i = args.index('-pack')
+        args.remove('-pack')
+        try:
+            pack = refpack.Pack(args.pop(i))
+        except IndexError:
+            print('ERROR: no argument for `-pack` option',
+                  file=sys.stderr)
+            sys.exit(1)
+        except (refpack.Error, OSError) as e:
+            print(f'ERROR: {e}', file=sys.stderr)
+            sys.exit(1)
+
     if '-random' in args:
         i = args.index('-random')
         args.remove('-random')
@@ -331,11 +562,23 @@ if __name__ == '__main__':
             sys.exit(1)
 
     filenames = args
+    if changed:
+        filenames = changed_filenames(filenames)
+        if len(filenames) < 1:
+            print('No comparisons are affected by the changes.')
+            sys.exit(0)
+    # With a pack and no files, compare everything in it;
+    # the pack is already in comparison order.
+    in_order = False
+    if filenames == [] and pack is not None:
+        filenames = all_filenames()
+        in_order = True
     # Skip '.pa' pass; you can't compile it.
     orig_filenames = filenames[:]
     filenames = list(filter(lambda s: not s.endswith('.pa'), filenames))
     filenames = list(filter(lambda s: '.pa,' not in s, filenames))
-    filenames = order_filenames(filenames)
+    if not in_order:
+        filenames = order_filenames(filenames)
     if nrandom > 0:
         filenames = random_filenames(filenames, nrandom)
 
@@ -344,28 +587,51 @@ if __name__ == '__main__':
         sys.exit(1)
 
     if diff:
-        for infilename in filenames:
-            if not os.path.isfile(infilename):
-                print(f'ERROR: input file {infilename} does not exist!')
-                continue
-            print(infilename, ': ', end='')
-            try:
-                diff_filename(infilename)
-            except Error as e:
-                print()
-                print(f'==================================')
-                print() 
-                print(f'{infilename}: ERROR: {e}')
-                print()
-                print(f'==================================')
-                print()
+        # Compile and compare on `njobs` threads,
+        # but report the results in order.
+        records = []
+        with ThreadPoolExecutor(max_workers=njobs) as executor:
+            futures = {}
+            for infilename in filenames:
+                if reference_exists(infilename):
+                    info = {'times': {}}
+                    futures[infilename] = \
+                        (executor.submit(diff_filename, infilename, info),
+                         info)
+            for infilename in filenames:
+                if infilename not in futures:
+                    print(f'ERROR: input file {infilename} does not exist!')
+                    records.append(diff_record(infilename, 'error',
+                                               'input file does not exist',
+                                               {'times': {}}))
+                    continue
+                print(infilename, ': ', end='')
+                (future, info) = futures[infilename]
+                try:
+                    (status, report) = future.result()
+                    print(report, end='')
+                    message = None if status == 'pass' else report.strip()
+                    records.append(diff_record(infilename, status,
+                                               message, info))
+                except Error as e:
+                    records.append(diff_record(infilename, 'error',
+                                               str(e), info))
+                    print()
+                    print(f'==================================')
+                    print()
+                    print(f'{infilename}: ERROR: {e}')
+                    print()
+                    print(f'==================================')
+                    print()
+        results.write_reports(records, jsonl_file, junit_file,
+                              name='compare')
     else:
         for infilename in filenames:
             print('--------------')
             print('input: ' + infilename)
             print('output: ' + get_output_filename(infilename))
             print()
-            if not os.path.isfile(infilename):
+            if not reference_exists(infilename):
                 print(f'ERROR: input file {infilename} does not exist!')
                 continue
             try:
@@ -0,0 +1,232 @@
+"""
+compile_server.py:
+    Run `./compile` through a pool of warm `compile -server` processes
+    instead of starting a new compiler process for every check.
+    The protocol is described in `compile.ml` (see "Server mode").
+"""
+
+import sys, os, atexit, queue, signal, threading
+import subprocess as p
+from subprocess import PIPE
+import result_cache
+
+
+compile_program = './compile'
+use_server      = True  # set to `False` to always start a new process
+idle_servers    = queue.Queue()
+all_servers     = []
+servers_lock    = threading.Lock()
+
+
+# ----------------------------------------------------------------------
+# S-expression encoding and decoding.
+# ----------------------------------------------------------------------
+
+def quote_atom(s):
+    """Encode a string as a quoted S-expression atom."""
+    escapes = {ord('"'): b'\\"', ord('\\'): b'\\\\',
+               ord('\n'): b'\\n', ord('\t'): b'\\t', ord('\r'): b'\\r'}
+    result = bytearray(b'"')
+    for c in s.encode():
+        if c in escapes:
+            result += escapes[c]
+        elif 32 <= c < 127:
+            result.append(c)
+        else:
+            result += b'\\%03d' % c
+    result += b'"'
+    return bytes(result)
+
+
+def encode_request(args, input):
+    """Encode a server request as a single line."""
+    args_sexp = b' '.join(quote_atom(arg) for arg in args)
+    return b'((args (' + args_sexp + b')) (input ' + \
+        quote_atom(input) + b'))\n'
+
+
+def parse_sexp(data):
+    """
+    Parse a single S-expression from the bytes `data`.
+    Atoms are returned as strings and lists as Python lists.
+    """
+    simple_escapes = {ord('n'): b'\n', ord('t'): b'\t', ord('r'): b'\r',
+                      ord('b'): b'\b', ord(' '): b' ', ord('\\'): b'\\',
+                      ord('"'): b'"', ord("'"): b"'"}
+    delimiters = b'()"; \t\r\n'
+    stack = [[]]
+    i = 0
+    while i < len(data):
+        c = data[i]
+        if c in b' \t\r\n':
+            i += 1
+        elif c == ord('('):
+            stack.append([])
+            i += 1
+        elif c == ord(')'):
+            lst = stack.pop()
+            stack[-1].append(lst)
+            i += 1
+        elif c == ord('"'):
+            atom = bytearray()
+            i += 1
+            while data[i] != ord('"'):
+                if data[i] != ord('\\'):
+                    atom.append(data[i])
+                    i += 1
+                    continue
+                c = data[i + 1]
+                if c in simple_escapes:
+                    atom += simple_escapes[c]
+                    i += 2
+                elif c == ord('x'):
+                    atom.append(int(data[i + 2:i + 4], 16))
+                    i += 4
+                elif c == ord('\n'):
+                    # Line continuation: skip leading blanks.
+                    i += 2
+                    while data[i] in b' \t':
+                        i += 1
+                else:
+                    atom.append(int(data[i + 1:i + 4]))
+                    i += 4
+            stack[-1].append(atom.decode(errors='replace'))
+            i += 1
+        else:
+            j = i
+            while j < len(data) and data[j] not in delimiters:
+                j += 1
+            stack[-1].append(data[i:j].decode())
+            i = j
+    return stack[0][0]
+
+
+# ----------------------------------------------------------------------
+# Compiler servers.
+# ----------------------------------------------------------------------
+
+class CompileServer:
+    """A single `compile -server` process."""
+
+    def __init__(self):
+        self.proc = p.Popen([compile_program, '-server'],
+                            stdin=PIPE, stdout=PIPE,
+                            start_new_session=True)
+        self.timed_out = False
+        line = self.proc.stdout.readline()
+        if line.strip() != b'(ready)':
+            self.kill()
+            raise Exception('compiler does not support server mode')
+
+    def kill(self):
+        """Kill the server and any request it is running."""
+        self.timed_out = True
+        try:
+            # The server runs in its own session, so this also kills
+            # the child process handling the current request.
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def close(self):
+        """Ask the server to exit once it has no more requests."""
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (OSError, p.TimeoutExpired):
+            self.kill()
+
+    def request(self, args, input, timeout=None):
+        """
+        Run the compiler with `args` and standard input `input`.
+        Return `(stdout, stderr, returncode)`.
+        If there is no reply within `timeout` seconds, kill the server
+        and raise `subprocess.TimeoutExpired`.
+        """
+        self.proc.stdin.write(encode_request(args, input))
+        self.proc.stdin.flush()
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self.kill)
+            timer.start()
+        try:
+            line = self.proc.stdout.readline()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if line == b'':
+            if self.timed_out:
+                raise p.TimeoutExpired([compile_program] + args, timeout)
+            raise Exception('compile server exited unexpectedly')
+        reply = dict(parse_sexp(line))
+        return (reply['stdout'], reply['stderr'], int(reply['status']))
+
+
+def acquire_server():
+    """
+    Return an idle server, starting a new one if none is available.
+    Return `None` (and stop using servers) if the compiler
+    can't run in server mode.
+    """
+    global use_server
+    try:
+        return idle_servers.get_nowait()
+    except queue.Empty:
+        pass
+    with servers_lock:
+        if not use_server:
+            return None
+        try:
+            server = CompileServer()
+        except Exception as e:
+            print(f'WARNING: {e}; running the compiler directly',
+                  file=sys.stderr)
+            use_server = False
+            return None
+        all_servers.append(server)
+        return server
+
+
+def close_servers():
+    """Shut down all the servers."""
+    for server in all_servers:
+        server.close()
+
+
+atexit.register(close_servers)
+
+
+def run_compile(args, input='', timeout=None, info=None):
+    """
+    Run the compiler with the command-line arguments `args`
+    and standard input `input`.
+    Return `(stdout, stderr, returncode)`.
+    Results are looked up in (and added to) the result cache.
+    If `info` is a dict, `info['cached']` is set to whether
+    the result came from the cache.
+    """
+    key = None
+    if info is not None:
+        info['cached'] = False
+    if result_cache.enabled and os.path.isfile(compile_program):
+        key = result_cache.compile_key(compile_program, args, input)
+        cached = result_cache.lookup(key)
+        if cached is not None:
+            if info is not None:
+                info['cached'] = True
+            return tuple(cached)
+
+    server = acquire_server() if use_server else None
+    if server is None:
+        proc = p.Popen([compile_program] + args, text=True,
+                       stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        (stdout_data, stderr_data) = \
+            proc.communicate(input=input, timeout=timeout)
+        result = (stdout_data, stderr_data, proc.returncode)
+    else:
+        result = server.request(args, input, timeout)
+        idle_servers.put(server)
+
+    if key is not None:
+        result_cache.store(key, list(result))
+    return result
@@ -0,0 +1,367 @@
+"""
+gen_bench.py:
+    Generate large, random, type-correct Lfun programs for benchmarking.
+    The generator evaluates each program itself and writes the result
+    as `;; OUTPUT:` metadata, so the programs can also be used as tests.
+
+    Every value is an integer or a vector of integers, and the generator
+    tracks a bound on the magnitude of every integer expression,
+    so that no program can overflow.  Functions only call functions
+    defined before them, so every program terminates.
+"""
+
+import sys, os, random
+
+
+nvars       = 100   # number of `let`-bound variables
+nfuns       = 0     # number of function definitions
+depth       = 2     # maximum nesting depth of right-hand sides
+alloc_rate  = 0.1   # fraction of bindings that allocate a vector
+branch_rate = 0.1   # fraction of subexpressions that are `if`s
+seed        = 0
+max_params  = 3     # maximum number of function parameters
+max_veclen  = 4     # maximum vector length
+window      = 16    # operands usually come from the last `window` vars
+far_rate    = 0.05  # ... but sometimes from any variable in scope
+max_bound   = 1 << 40  # bound on the magnitude of any integer
+param_bound = 1 << 20  # bound on the magnitude of function arguments
+min_work    = 1000  # bindings a body may evaluate, counting calls
+
+compare_ops = ['<', '<=', '>', '>=', '=']
+
+
+# ----------------------------------------------------------------------
+# Abstract syntax.
+# ----------------------------------------------------------------------
+
+# Expressions are tuples:
+#   ('int', n)
+#   ('var', name)
+#   ('prim', op, [exp, ...])         op is '+', '-', a comparison,
+#                                    'and', 'or' or 'not'
+#   ('if', exp, exp, exp)
+#   ('let', [(name, exp), ...], exp)  a chain of nested lets
+#   ('vector', [exp, ...])
+#   ('vector-ref', exp, i)
+#   ('vector-set!', exp, i, exp)
+#   ('call', name, [exp, ...])
+# Functions are `(name, [param, ...], body)`; all types are `Integer`.
+
+
+class Scope:
+    """The variables in scope in a function body, with their bounds."""
+
+    def __init__(self, params, bound):
+        self.ints = [(p, bound) for p in params]  # (name, bound)
+        self.vecs = []  # (name, [element bound, ...])
+        self.count = 0
+
+    def fresh(self, prefix):
+        self.count += 1
+        return f'{prefix}{self.count}'
+
+
+class Generator:
+    """Random generator of programs with known bounds."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.funs = []  # (name, nparams, result bound, work)
+        # Calls are only made while the work (the number of bindings
+        # evaluated, including calls) of the current body is in budget,
+        # which keeps the running time of programs linear in their size.
+        self.work = 0
+        self.max_work = max(min_work, 2 * nvars)
+
+    def pick(self, items):
+        """
+        Pick an item, usually from the end of `items` (the most
+        recently bound variables), to keep live ranges realistic.
+        """
+        if self.rng.random() < far_rate or len(items) <= window:
+            return self.rng.choice(items)
+        return self.rng.choice(items[-window:])
+
+    def constant(self, bound_limit=100):
+        limit = min(100, bound_limit)
+        n = self.rng.randint(-limit, limit)
+        return (('int', n), abs(n))
+
+    def int_exp(self, scope, depth, bound_limit=max_bound):
+        """
+        Return `(exp, bound)`: a random integer expression
+        whose value is at most `bound <= bound_limit` in magnitude.
+        """
+        choices = ['const']
+        if scope.ints:
+            choices += ['var', 'var']
+        if depth > 0:
+            choices += ['add', 'sub', 'neg']
+            if self.rng.random() < branch_rate:
+                choices = ['if']
+        if scope.vecs:
+            choices.append('ref')
+        if self.funs and depth > 0:
+            choices.append('call')
+        kind = self.rng.choice(choices)
+
+        if kind == 'var':
+            (name, bound) = self.pick(scope.ints)
+            if bound <= bound_limit:
+                return (('var', name), bound)
+        elif kind in ['add', 'sub']:
+            (e1, b1) = self.int_exp(scope, depth - 1, bound_limit)
+            (e2, b2) = self.int_exp(scope, depth - 1, bound_limit)
+            if b1 + b2 <= bound_limit:
+                op = '+' if kind == 'add' else '-'
+                return (('prim', op, [e1, e2]), b1 + b2)
+            return (e1, b1)
+        elif kind == 'neg':
+            (e, b) = self.int_exp(scope, depth - 1, bound_limit)
+            return (('prim', '-', [e]), b)
+        elif kind == 'if':
+            cond = self.bool_exp(scope, depth - 1)
+            (e1, b1) = self.int_exp(scope, depth - 1, bound_limit)
+            (e2, b2) = self.int_exp(scope, depth - 1, bound_limit)
+            return (('if', cond, e1, e2), max(b1, b2))
+        elif kind == 'ref':
+            (name, bounds) = self.pick(scope.vecs)
+            i = self.rng.randrange(len(bounds))
+            if bounds[i] <= bound_limit:
+                return (('vector-ref', ('var', name), i), bounds[i])
+        elif kind == 'call':
+            (fname, nparams, bound, work) = self.rng.choice(self.funs)
+            if bound <= bound_limit and \
+                    self.work + work <= self.max_work:
+                self.work += work
+                args = [self.int_exp(scope, depth - 1, param_bound)[0]
+                        for _ in range(nparams)]
+                return (('call', fname, args), bound)
+        return self.constant(bound_limit)
+
+    def bool_exp(self, scope, depth):
+        """Return a random boolean expression."""
+        r = self.rng.random()
+        if depth > 0 and r < 0.15:
+            op = self.rng.choice(['and', 'or'])
+            return ('prim', op, [self.bool_exp(scope, depth - 1),
+                                 self.bool_exp(scope, depth - 1)])
+        if depth > 0 and r < 0.2:
+            return ('prim', 'not', [self.bool_exp(scope, depth - 1)])
+        op = self.rng.choice(compare_ops)
+        return ('prim', op, [self.int_exp(scope, max(depth - 1, 0))[0],
+                             self.int_exp(scope, max(depth - 1, 0))[0]])
+
+    def body(self, scope, nbindings):
+        """
+        Return `(exp, bound)`: a chain of `nbindings` lets
+        ending in the sum of some of the variables it binds.
+        """
+        bindings = []
+        self.work = nbindings
+        for _ in range(nbindings):
+            r = self.rng.random()
+            if scope.vecs and r < alloc_rate / 4:
+                # Update a vector element, keeping within its bound.
+                (name, bounds) = self.pick(scope.vecs)
+                i = self.rng.randrange(len(bounds))
+                (e, _) = self.int_exp(scope, depth, bounds[i])
+                bindings.append((scope.fresh('_'),
+                                 ('vector-set!', ('var', name), i, e)))
+            elif r < alloc_rate:
+                elems = [self.int_exp(scope, depth)
+                         for _ in range(self.rng.randint(1, max_veclen))]
+                name = scope.fresh('v')
+                bindings.append((name, ('vector', [e for (e, _) in elems])))
+                scope.vecs.append((name, [b for (_, b) in elems]))
+            else:
+                (e, b) = self.int_exp(scope, depth)
+                name = scope.fresh('x')
+                bindings.append((name, e))
+                scope.ints.append((name, b))
+
+        # Use several of the variables, so they aren't all dead.
+        (result, bound) = self.constant()
+        for _ in range(min(8, len(scope.ints))):
+            (name, b) = self.pick(scope.ints)
+            if bound + b <= max_bound:
+                result = ('prim', '+', [result, ('var', name)])
+                bound += b
+        if bindings == []:
+            return (result, bound)
+        return (('let', bindings, result), bound)
+
+    def program(self):
+        """Return `(defs, exp)`: a random program."""
+        defs = []
+        per_body = max(1, nvars // (nfuns + 1))
+        for i in range(nfuns):
+            nparams = self.rng.randint(1, max_params)
+            params = [f'p{j}' for j in range(nparams)]
+            scope = Scope(params, param_bound)
+            (body, bound) = self.body(scope, per_body)
+            name = f'f{i}'
+            defs.append((name, params, body))
+            self.funs.append((name, nparams, bound, self.work))
+        scope = Scope([], 0)
+        (exp, _) = self.body(scope, max(1, nvars - per_body * nfuns))
+        return (defs, exp)
+
+
+# ----------------------------------------------------------------------
+# Evaluation.
+# ----------------------------------------------------------------------
+
+def evaluate(exp, env, funs):
+    """Evaluate an expression in the environment `env`."""
+    tag = exp[0]
+    if tag == 'int':
+        return exp[1]
+    if tag == 'var':
+        return env[exp[1]]
+    if tag == 'prim':
+        (_, op, args) = exp
+        if op == 'and':
+            return evaluate(args[0], env, funs) and \
+                evaluate(args[1], env, funs)
+        if op == 'or':
+            return evaluate(args[0], env, funs) or \
+                evaluate(args[1], env, funs)
+        vals = [evaluate(arg, env, funs) for arg in args]
+        if op == 'not':
+            return not vals[0]
+        if op == '-' and len(vals) == 1:
+            return -vals[0]
+        return {'+': lambda a, b: a + b, '-': lambda a, b: a - b,
+                '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+                '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+                '=': lambda a, b: a == b}[op](*vals)
+    if tag == 'if':
+        if evaluate(exp[1], env, funs):
+            return evaluate(exp[2], env, funs)
+        return evaluate(exp[3], env, funs)
+    if tag == 'let':
+        env = dict(env)
+        for (name, rhs) in exp[1]:
+            env[name] = evaluate(rhs, env, funs)
+        return evaluate(exp[2], env, funs)
+    if tag == 'vector':
+        return [evaluate(e, env, funs) for e in exp[1]]
+    if tag == 'vector-ref':
+        return evaluate(exp[1], env, funs)[exp[2]]
+    if tag == 'vector-set!':
+        evaluate(exp[1], env, funs)[exp[2]] = evaluate(exp[3], env, funs)
+        return None
+    if tag == 'call':
+        (params, body) = funs[exp[1]]
+        args = [evaluate(arg, env, funs) for arg in exp[2]]
+        return evaluate(body, dict(zip(params, args)), funs)
+    raise ValueError(f'unknown expression: {tag}')
+
+
+# ----------------------------------------------------------------------
+# Printing.
+# ----------------------------------------------------------------------
+
+def exp_to_string(exp):
+    """Return the concrete syntax of an expression."""
+    tag = exp[0]
+    if tag == 'int':
+        return str(exp[1])
+    if tag == 'var':
+        return exp[1]
+    if tag == 'prim':
+        return '(' + ' '.join([exp[1]] + [exp_to_string(e)
+                                          for e in exp[2]]) + ')'
+    if tag == 'if':
+        return '(if ' + ' '.join(exp_to_string(e) for e in exp[1:]) + ')'
+    if tag == 'let':
+        # Long chains are printed flat, one binding per line.
+        lines = [f'(let ({name} {exp_to_string(rhs)})'
+                 for (name, rhs) in exp[1]]
+        return '\n'.join(lines + [exp_to_string(exp[2])]) + \
+            ')' * len(exp[1])
+    if tag == 'vector':
+        return '(vector ' + ' '.join(exp_to_string(e) for e in exp[1]) + ')'
+    if tag == 'vector-ref':
+        return f'(vector-ref {exp_to_string(exp[1])} {exp[2]})'
+    if tag == 'vector-set!':
+        return f'(vector-set! {exp_to_string(exp[1])} {exp[2]} ' + \
+            f'{exp_to_string(exp[3])})'
+    if tag == 'call':
+        return '(' + ' '.join([exp[1]] + [exp_to_string(e)
+                                          for e in exp[2]]) + ')'
+    raise ValueError(f'unknown expression: {tag}')
+
+
+def generate(rng=None):
+    """
+    Generate a program with the current settings.
+    Return its text, including the `;; OUTPUT:` line.
+    """
+    if rng is None:
+        rng = random.Random(seed)
+    # Calls nest up to `nfuns` deep in the evaluator.
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100 * nfuns + 1000))
+    (defs, exp) = Generator(rng).program()
+    funs = {name: (params, body) for (name, params, body) in defs}
+    value = evaluate(exp, {}, funs)
+
+    # Programs return their result as an exit code,
+    # so check the value in the program and return 42 if it's right.
+    check = ('if', ('prim', '=', [exp, ('int', value)]),
+             ('int', 42), ('int', 0))
+
+    lines = [f';; OUTPUT: 42',
+             f';; gen_bench.py -vars {nvars} -funs {nfuns} -depth {depth} '
+             f'-alloc {alloc_rate} -branch {branch_rate} -seed {seed}',
+             '']
+    for (name, params, body) in defs:
+        formals = ' '.join(f'({p} : Integer)' for p in params)
+        lines.append(f'(define ({name} {formals}) : Integer')
+        lines.append(exp_to_string(body) + ')')
+        lines.append('')
+    lines.append(exp_to_string(check))
+    return '\n'.join(lines) + '\n'
+
+
+def usage():
+    """Print a usage message and exit."""
+    progname = os.path.basename(sys.argv[0])
+    usagestr = f'usage: {progname} [-vars n] [-funs n] [-depth n] ' + \
+               '[-alloc rate] [-branch rate] [-seed n] [-o file]'
+    print(usagestr, file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    outfile = None
+    try:
+        while args:
+            flag = args.pop(0)
+            if flag == '-o':
+                outfile = args.pop(0)
+            elif flag == '-vars':
+                nvars = int(args.pop(0))
+            elif flag == '-funs':
+                nfuns = int(args.pop(0))
+            elif flag == '-depth':
+                depth = int(args.pop(0))
+            elif flag == '-alloc':
+                alloc_rate = float(args.pop(0))
+            elif flag == '-branch':
+                branch_rate = float(args.pop(0))
+            elif flag == '-seed':
+                seed = int(args.pop(0))
+            else:
+                usage()
+    except (ValueError, IndexError):
+        usage()
+
+    text = generate()
+    if outfile is None:
+        print(text, end='')
+    else:
+        with open(outfile, 'w') as f:
+            print(text, file=f, end='')
@@ -0,0 +1,169 @@
+"""
+profile_passes.py:
+    Compile test programs with `-time-passes` and report
+    which compiler passes (and which inputs) take the most time
+    and allocate the most memory.
+"""
+
+import sys, os, glob, statistics
+from concurrent.futures import ThreadPoolExecutor
+import compile_server
+import result_cache
+from compile_server import run_compile, parse_sexp
+from scratch import scratch_dir
+
+
+passes  = ['parse', 'tc1', 'sh', 'un', 'rf', 'lf', 'tc1b', 'ea', 'ug',
+           'rc', 'ec', 'tc2', 'ru', 'si', 'ul', 'bi', 'ar', 'rj',
+           'pi', 'pc', 'opt', 'pa']
+timeout = 60  # seconds
+nruns   = 1   # compile each file this many times; report the median
+ntop    = 10  # number of (file, pass) pairs to list
+njobs   = 1   # number of worker threads
+regs    = ''
+
+
+class Error(Exception):
+    """Exception class for compiler errors."""
+    pass
+
+
+def read_timings(filename):
+    """
+    Read a `-time-passes` file.
+    Return a dict from pass names to `(time, words, major_gcs)`.
+    """
+    timings = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            if not line.startswith('('):
+                continue
+            (name, *fields) = parse_sexp(line.encode())
+            fields = dict(fields)
+            timings[name] = (float(fields['time']), float(fields['words']),
+                             int(fields['major_gcs']))
+    return timings
+
+
+def profile_file(progname):
+    """
+    Compile the program `progname` all the way to assembly language
+    `nruns` times.  Return a dict from pass names to
+    `(time, words, major_gcs)`, taking the (low) median of each
+    over the runs.
+    """
+    runs = []
+    with scratch_dir('profile-') as tmpdir:
+        timings_file = os.path.join(tmpdir, 'timings')
+        args = [progname, '-time-passes', timings_file]
+        if regs != '':
+            args += ['-regs', regs]
+        for _ in range(nruns):
+            (_, stderr_data, ret) = run_compile(args, timeout=timeout)
+            if stderr_data != '' or ret != 0:
+                raise Error(f'{progname}: compilation failed\n{stderr_data}')
+            runs.append(read_timings(timings_file))
+    timings = {}
+    for name in runs[0]:
+        samples = [run[name] for run in runs if name in run]
+        timings[name] = tuple(statistics.median_low(s[i] for s in samples)
+                              for i in range(3))
+    return timings
+
+
+def report(profiles):
+    """
+    Print the totals for each pass over all files, hottest first,
+    followed by the `ntop` most expensive (file, pass) pairs.
+    """
+    totals = {}
+    for timings in profiles.values():
+        for (name, (t, words, gcs)) in timings.items():
+            (t0, words0, gcs0) = totals.get(name, (0.0, 0.0, 0))
+            totals[name] = (t0 + t, words0 + words, gcs0 + gcs)
+    total_time = sum(t for (t, _, _) in totals.values()) or 1.0
+
+    print(f'Passes (totals over {len(profiles)} files):\n')
+    print(f'{"pass":<8}{"time (s)":>12}{"% time":>9}'
+          f'{"Mwords":>12}{"major GCs":>11}')
+    order = sorted(totals, key=lambda name: -totals[name][0])
+    for name in order:
+        (t, words, gcs) = totals[name]
+        print(f'{name:<8}{t:>12.4f}{100 * t / total_time:>8.1f}%'
+              f'{words / 1e6:>12.2f}{gcs:>11}')
+    missing = [name for name in passes if name not in totals]
+    if missing:
+        print(f'\n(no timings for: {" ".join(missing)})')
+
+    pairs = [(t, words, progname, name)
+             for (progname, timings) in profiles.items()
+             for (name, (t, words, _)) in timings.items()]
+    pairs.sort(reverse=True)
+    print('\nHottest inputs:\n')
+    print(f'{"time (s)":>10}{"Mwords":>10}  pass  file')
+    for (t, words, progname, name) in pairs[:ntop]:
+        print(f'{t:>10.4f}{words / 1e6:>10.2f}  {name:<5} {progname}')
+
+
+def usage():
+    """Print a usage message and exit."""
+    progname = os.path.basename(sys.argv[0])
+    usagestr = f'usage: {progname} [-runs n] [-top n] [-j n] ' + \
+               '[-regs reg1,reg2,...] [-no-server] [file1 ...]'
+    print(usagestr, file=sys.stderr)
+    sys.exit(1)
+
+
+def int_option(args, flag):
+    """Remove `flag` and its positive integer argument from `args`."""
+    i = args.index(flag)
+    args.pop(i)
+    try:
+        n = int(args.pop(i))
+    except (ValueError, IndexError):
+        n = 0
+    if n <= 0:
+        print(f'ERROR: `{flag}` argument must be a positive integer',
+              file=sys.stderr)
+        sys.exit(1)
+    return n
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    # Timings have to be measured, never looked up.
+    result_cache.enabled = False
+
+    if '-runs' in args:
+        nruns = int_option(args, '-runs')
+    if '-top' in args:
+        ntop = int_option(args, '-top')
+    if '-j' in args:
+        njobs = int_option(args, '-j')
+    if '-regs' in args:
+        i = args.index('-regs')
+        args.pop(i)
+        if i >= len(args):
+            usage()
+        regs = args.pop(i)
+    if '-no-server' in args:
+        compile_server.use_server = False
+        args.remove('-no-server')
+    if any(arg.startswith('-') for arg in args):
+        usage()
+
+    filenames = args or sorted(glob.glob('tests/*.src'))
+    if filenames == []:
+        usage()
+
+    profiles = {}
+    with ThreadPoolExecutor(max_workers=njobs) as executor:
+        futures = [(f, executor.submit(profile_file, f)) for f in filenames]
+        for (progname, future) in futures:
+            try:
+                profiles[progname] = future.result()
+            except Error as e:
+                print(f'ERROR: {e}', file=sys.stderr)
+    if profiles:
+        report(profiles)
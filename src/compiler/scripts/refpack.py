@@ -0,0 +1,270 @@
+"""
+refpack.py:
+    Pack the reference outputs (`reference/<test>.<pass>[,regs]`)
+    into a single indexed file, and read them back through a memory map.
+
+    A pack starts with the line `REFPACK 1`, then the size of the index
+    in bytes on a line of its own, then the index: one line
+    `name offset size sha256` per entry, in comparison order
+    (test number, pass, registers).  The contents of the entries follow,
+    at the given offsets from the end of the index.
+
+    usage: python scripts/refpack.py pack [-pack file] [dir]
+           python scripts/refpack.py unpack [-pack file] [-o dir] [name ...]
+           python scripts/refpack.py update [-pack file] file1 [file2 ...]
+           python scripts/refpack.py list [-pack file]
+"""
+
+import sys, os, mmap, hashlib, threading
+
+
+pack_file   = 'reference.pack'
+magic       = b'REFPACK 1\n'
+extract_dir = '.cache/refpack'  # where `extract` writes input files
+
+
+class Error(Exception):
+    """Exception class for malformed packs."""
+    pass
+
+
+def entry_name(test, inpass, regs=''):
+    """Return the entry name for a test, pass and register option."""
+    return f'{test}.{inpass}' + (f',{regs}' if regs != '' else '')
+
+
+def content_hash(data):
+    """Return the SHA-256 hash of `data` (bytes)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class Pack:
+    """A read-only, memory-mapped pack of reference files."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.order = []
+        self.index = {}  # name -> (offset, size, hash)
+        self.extracted = {}  # name -> path, for `extract`
+        self.lock = threading.Lock()
+        self.read_index()
+
+    def read_index(self):
+        """Read the index at the start of the pack."""
+        m = self.map
+        if m[:len(magic)] != magic:
+            raise Error(f'{self.filename}: not a reference pack')
+        pos = len(magic)
+        end = m.find(b'\n', pos)
+        try:
+            index_size = int(m[pos:end])
+        except ValueError:
+            raise Error(f'{self.filename}: invalid index size')
+        start = end + 1
+        base = start + index_size
+        for line in m[start:base].decode().splitlines():
+            (name, offset, size, digest) = line.split(' ')
+            (offset, size) = (base + int(offset), int(size))
+            if offset + size > len(m):
+                raise Error(f'{self.filename}: truncated entry {name}')
+            self.order.append(name)
+            self.index[name] = (offset, size, digest)
+
+    def names(self):
+        """Return the names of all the entries, in comparison order."""
+        return self.order[:]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def read_bytes(self, name):
+        """Return the contents of the entry `name` as bytes."""
+        (offset, size, _) = self.index[name]
+        return self.map[offset:offset + size]
+
+    def read(self, name):
+        """Return the contents of the entry `name` as a string."""
+        return self.read_bytes(name).decode()
+
+    def hash(self, name):
+        """Return the content hash of the entry `name`."""
+        return self.index[name][2]
+
+    def matches(self, name, text):
+        """
+        Return `True` if the entry `name` is exactly `text`.
+        Only the hashes are compared, so this is cheap.
+        """
+        return content_hash(text.encode()) == self.hash(name)
+
+    def extract(self, name):
+        """
+        Write the entry `name` to `extract_dir/reference/name`
+        (unless it's already there) and return that path,
+        for passing to the compiler as an input file.
+        The path is always the same, so result caching still works.
+        """
+        with self.lock:
+            if name in self.extracted:
+                return self.extracted[name]
+            dirname = os.path.join(extract_dir, 'reference')
+            path = os.path.join(dirname, name)
+            data = self.read_bytes(name)
+            if not same_contents(path, data):
+                os.makedirs(dirname, exist_ok=True)
+                write_atomically(path, [data])
+            self.extracted[name] = path
+            return path
+
+    def close(self):
+        self.map.close()
+
+
+def same_contents(path, data):
+    """Return `True` if the file `path` exists and contains `data`."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def write_atomically(path, chunks):
+    """Write a sequence of byte strings to `path` atomically."""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp, path)
+
+
+def write_pack(filename, entries):
+    """
+    Write the pack `filename` from a list of `(name, data)` pairs,
+    which must already be in comparison order.
+    """
+    lines = []
+    offset = 0
+    for (name, data) in entries:
+        lines.append(f'{name} {offset} {len(data)} {content_hash(data)}\n')
+        offset += len(data)
+    index = ''.join(lines).encode()
+    header = magic + f'{len(index)}\n'.encode() + index
+    write_atomically(filename, [header] + [data for (_, data) in entries])
+
+
+def pack_directory(dirname, filename, key):
+    """
+    Pack all the files in the directory `dirname` into `filename`,
+    ordering them by `key` (a function of the entry name).
+    Return the number of entries.
+    """
+    names = sorted(os.listdir(dirname), key=key)
+    entries = []
+    for name in names:
+        with open(os.path.join(dirname, name), 'rb') as f:
+            entries.append((name, f.read()))
+    write_pack(filename, entries)
+    return len(entries)
+
+
+def unpack(filename, dirname, names=None):
+    """
+    Write the entries `names` (default: all) of the pack `filename`
+    into the directory `dirname`.  Return the number written.
+    """
+    pack = Pack(filename)
+    try:
+        names = names or pack.names()
+        os.makedirs(dirname, exist_ok=True)
+        for name in names:
+            if name not in pack:
+                raise Error(f'{filename}: no entry {name}')
+            with open(os.path.join(dirname, name), 'wb') as f:
+                f.write(pack.read_bytes(name))
+        return len(names)
+    finally:
+        pack.close()
+
+
+def update(filename, paths, key):
+    """
+    Replace (or add) the entries of the pack `filename` named after
+    the files `paths` with the contents of those files.
+    Return the number of entries added.
+    """
+    pack = Pack(filename)
+    try:
+        entries = {name: pack.read_bytes(name) for name in pack.names()}
+    finally:
+        pack.close()
+    nadded = 0
+    for path in paths:
+        name = os.path.basename(path)
+        if name not in entries:
+            nadded += 1
+        with open(path, 'rb') as f:
+            entries[name] = f.read()
+    write_pack(filename, [(name, entries[name])
+                          for name in sorted(entries, key=key)])
+    return nadded
+
+
+def usage():
+    """Print a usage message and exit."""
+    progname = os.path.basename(sys.argv[0])
+    print(f'usage: {progname} pack [-pack file] [dir]\n'
+          f'       {progname} unpack [-pack file] [-o dir] [name ...]\n'
+          f'       {progname} update [-pack file] file1 [file2 ...]\n'
+          f'       {progname} list [-pack file]', file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    from compare import compare_index
+
+    def key(name):
+        return compare_index('reference/' + name)
+
+    args = sys.argv[1:]
+    if not args:
+        usage()
+    command = args.pop(0)
+    outdir = 'reference'
+    try:
+        while args and args[0].startswith('-'):
+            flag = args.pop(0)
+            if flag == '-pack':
+                pack_file = args.pop(0)
+            elif flag == '-o' and command == 'unpack':
+                outdir = args.pop(0)
+            else:
+                usage()
+    except IndexError:
+        usage()
+
+    try:
+        if command == 'pack' and len(args) <= 1:
+            n = pack_directory(args[0] if args else 'reference',
+                               pack_file, key)
+            print(f'{pack_file}: packed {n} files')
+        elif command == 'unpack':
+            n = unpack(pack_file, outdir, args)
+            print(f'{outdir}: unpacked {n} files')
+        elif command == 'update' and args:
+            n = update(pack_file, args, key)
+            print(f'{pack_file}: updated {len(args) - n} '
+                  f'and added {n} entries')
+        elif command == 'list' and not args:
+            pack = Pack(pack_file)
+            for name in pack.names():
+                (_, size, digest) = pack.index[name]
+                print(f'{name} {size} {digest}')
+            pack.close()
+        else:
+            usage()
+    except (Error, OSError) as e:
+        print(f'ERROR: {e}', file=sys.stderr)
+        sys.exit(1)
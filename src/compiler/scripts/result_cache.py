@@ -0,0 +1,132 @@
+"""
+result_cache.py:
+    On-disk cache of compiler and program run results.
+    Results are stored as JSON files under `cache_dir`, sharded by the
+    first two hex digits of their key.  Keys are content hashes of
+    everything a result depends on (the compiler binary, input files,
+    command-line arguments, standard input), so a stale entry is never
+    found, just eventually evicted.  Eviction is least-recently-used,
+    based on file modification times, which are refreshed on every hit.
+"""
+
+import os, json, hashlib, tempfile, threading, atexit
+
+
+cache_dir  = '.cache/results'
+max_bytes  = 64 * 1024 * 1024  # evict down to this size on exit
+enabled    = True
+hash_memo  = {}  # (filename, mtime, size) -> content hash
+memo_lock  = threading.Lock()
+nstored    = 0
+runtime_env_names = ['GC_NO_PROTECT', 'GC_STATS']
+
+
+def file_hash(filename):
+    """
+    Return the SHA-256 hash of the contents of `filename`.
+    Hashes are remembered until the file's size or timestamp changes.
+    """
+    st = os.stat(filename)
+    memo_key = (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+    with memo_lock:
+        if memo_key in hash_memo:
+            return hash_memo[memo_key]
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with memo_lock:
+        hash_memo[memo_key] = digest
+    return digest
+
+
+def make_key(*parts):
+    """Make a cache key from a sequence of JSON-serializable parts."""
+    data = json.dumps(parts, separators=(',', ':')).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def runtime_env():
+    """
+    Return the settings of the environment variables that change
+    how the runtime behaves (see `runtime.c`), for run-result keys.
+    """
+    return [os.environ.get(name) for name in runtime_env_names]
+
+
+def compile_key(compile_program, args, input):
+    """
+    Make the cache key for running `compile_program` with
+    the command-line arguments `args` and standard input `input`.
+    Arguments naming existing files contribute their contents too.
+    """
+    files = [file_hash(arg) for arg in args if os.path.isfile(arg)]
+    return make_key('compile', file_hash(compile_program),
+                    args, files, input)
+
+
+def entry_path(key):
+    """Return the path of the cache file for `key`."""
+    return os.path.join(cache_dir, key[:2], key[2:] + '.json')
+
+
+def lookup(key):
+    """Return the cached value for `key`, or `None` if there isn't one."""
+    if not enabled:
+        return None
+    path = entry_path(key)
+    try:
+        with open(path, 'r') as f:
+            value = json.load(f)
+        os.utime(path)  # mark as recently used
+        return value
+    except (OSError, ValueError):
+        return None
+
+
+def store(key, value):
+    """Store a JSON-serializable `value` under `key`."""
+    global nstored
+    if not enabled:
+        return
+    path = entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    (fd, tmpname) = tempfile.mkstemp(suffix='.tmp',
+                                     dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmpname, path)
+    nstored += 1
+
+
+def evict():
+    """
+    Remove the least recently used entries
+    until the cache is no bigger than `max_bytes`.
+    """
+    if nstored == 0 or not os.path.isdir(cache_dir):
+        return
+    entries = []
+    total = 0
+    for (dirpath, _, filenames) in os.walk(cache_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    entries.sort()
+    for (_, size, path) in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+atexit.register(evict)
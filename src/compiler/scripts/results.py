@@ -0,0 +1,103 @@
+"""
+results.py:
+    Machine-readable test results, for CI and for tracking regressions.
+    Each `Record` is one check (a file, input set and pass or
+    register option); records can be written as JSON Lines
+    (one object per line) or as a JUnit XML report.
+"""
+
+import os, json
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+
+# The stages that a check's wall-clock time is split into.
+# Stages that weren't run (or whose result came from the cache)
+# are left out of a record's `times`.
+stages = ['compile', 'assemble', 'link', 'run']
+
+# The outcome of one check.
+#   file:     the test file
+#   input:    the index of the input/output pair, or `None`
+#   kind:     'eval', 'asm', 'compare' or 'file' (a missing test file)
+#   option:   the pass name or register option being checked
+#   status:   'pass', 'fail' (wrong output) or 'error' (anything else)
+#   expected: the expected value, or `None`
+#   actual:   the value produced, or `None`
+#   message:  the error message, or `None` if the check passed
+#   times:    a dict from stage names to seconds
+#   cached:   `True` if the outcome came from the result cache
+Record = namedtuple('Record', ['file', 'input', 'kind', 'option', 'status',
+                               'expected', 'actual', 'message', 'times',
+                               'cached'])
+
+
+def record_name(record):
+    """Return the name of a record's check, e.g. `input 1: eval sh`."""
+    name = record.kind
+    if record.option:
+        name += ' ' + record.option
+    if record.input is not None:
+        name = f'input {record.input + 1}: {name}'
+    return name
+
+
+def record_dict(record):
+    """Return a record as a JSON-serializable dict."""
+    d = record._asdict()
+    d['times'] = {stage: round(t, 6) for (stage, t) in record.times.items()}
+    d['time'] = round(sum(record.times.values()), 6)
+    return d
+
+
+def write_jsonl(filename, records):
+    """Write `records` to `filename` as JSON Lines."""
+    with open(filename, 'w') as f:
+        for record in records:
+            print(json.dumps(record_dict(record)), file=f)
+
+
+def write_junit(filename, records, name='tests'):
+    """
+    Write `records` to `filename` as a JUnit XML report,
+    with one test suite per test file.
+    """
+    suites = {}
+    for record in records:
+        suites.setdefault(record.file, []).append(record)
+
+    root = ET.Element('testsuites', name=name)
+    for (file, file_records) in suites.items():
+        suite = ET.SubElement(root, 'testsuite', name=file)
+        counts = {'pass': 0, 'fail': 0, 'error': 0}
+        total = 0.0
+        for record in file_records:
+            time = sum(record.times.values())
+            total += time
+            counts[record.status] += 1
+            case = ET.SubElement(suite, 'testcase',
+                                 classname=os.path.basename(file),
+                                 name=record_name(record),
+                                 time=f'{time:.6f}')
+            if record.status == 'pass':
+                continue
+            tag = 'failure' if record.status == 'fail' else 'error'
+            message = record.message or ''
+            elem = ET.SubElement(case, tag,
+                                 message=message.split('\n', 1)[0])
+            elem.text = message
+        suite.set('tests', str(len(file_records)))
+        suite.set('failures', str(counts['fail']))
+        suite.set('errors', str(counts['error']))
+        suite.set('time', f'{total:.6f}')
+
+    ET.ElementTree(root).write(filename, encoding='unicode',
+                               xml_declaration=True)
+
+
+def write_reports(records, jsonl_file=None, junit_file=None, name='tests'):
+    """Write `records` to whichever report files were requested."""
+    if jsonl_file is not None:
+        write_jsonl(jsonl_file, records)
+    if junit_file is not None:
+        write_junit(junit_file, records, name)
@@ -6,6 +6,9 @@ run_asm.py:
 import sys, re, glob, os.path
 import subprocess as p
 from subprocess import PIPE
+import result_cache
+from runtime_cache import runtime_object
+from scratch import scratch_dir
 
 
 verbose       = True
@@ -21,74 +24,85 @@ class Error(Exception):
 
 def run_assembly_program(progname, arm64=False):
     """
-    Compile the program `progname` to assembly language.
-    Also compile `runtime.c` and link to make an executable.
+    Assemble the program `progname` and link it with the cached
+    `runtime.c` object to make an executable.
     If `arm64` is `True`, compile on an Apple Arm64 computer
     using Rosetta Stone.
     """
     basename = os.path.basename(progname)
 
-    # Compile the assembly language program to a `.o` file.
-    args = [c_compiler, '-c', progname]
-    if arm64:
-        args += ['-arch', 'x86_64']
+    # Get the (cached) `runtime.c` object file.
+    runtime_flags = ['-arch', 'x86_64'] if arm64 else []
+    runtime_name = runtime_object(c_compiler, runtime_flags)
     if verbose:
-        print(f'COMMAND: {" ".join(args)}')
-    proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
-
-    # Compiling an assembly language program with a C compiler
-    # shouldn't return anything on stderr.
-    if stderr_data != '':
-        print(stderr_data)
-        raise Exception('non-empty stderr data from compiling assembly code')
-
-    # Compile the `runtime.c` program to a `.o` file.
-    args = [c_compiler, '-c', 'runtime.c']
-    if arm64:
-        args += ['-arch', 'x86_64']
-    if verbose:
-        print(f'COMMAND: {" ".join(args)}')
-    proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
-
-    # Compiling 'runtime.c' with a C compiler
-    # shouldn't return anything on stderr.
-    if stderr_data != '':
-        print(stderr_data)
-        raise Exception('non-empty stderr data from compiling `runtime.c`')
-
-    # Link the programs to form an executable.
-    executable_name = re.sub(r'\.s$', '', basename)
-    object_name = re.sub(r'\.s$', '.o', basename)
-    args = [c_compiler, object_name, 'runtime.o', '-o', executable_name]
-    if arm64:
-        args += ['-arch', 'x86_64']
-    if verbose:
-        print(f'COMMAND: {" ".join(args)}')
-    proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
-
-    # Running the executable shouldn't return anything on stderr.
-    if stderr_data != '':
-        print(stderr_data)
-        raise Exception('non-empty stderr data from compiling executable')
-
-    # Remove the object files.
-    p.call('/bin/rm -f *.o', shell=True)
-
-    # Run the executable program.
-    # NOTE:
-    #   If the program requires `read` inputs,
-    #   the user must supply them manually when the program is running.
-    if verbose:
-        print(f'COMMAND: ./{executable_name}')
-    proc = p.Popen([f'./{executable_name}'], text=True,
-                   stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
-
-    # Remove the executable program.
-    p.call(f'/bin/rm -f ./{executable_name}', shell=True)
+        print(f'RUNTIME: {runtime_name}')
+
+    # The outcome of running the program only depends on the assembly
+    # code, the runtime and its environment settings, so it can come
+    # from the cache.
+    key = result_cache.make_key('run', c_compiler, runtime_flags,
+                                result_cache.file_hash(runtime_name),
+                                result_cache.runtime_env(),
+                                result_cache.file_hash(progname))
+    cached = result_cache.lookup(key)
+    if cached is not None:
+        if verbose:
+            print('CACHED: skipping assembly, linking and running')
+        (stdout_data, stderr_data, ret) = cached
+    else:
+        # Build and run the program in a private scratch directory,
+        # which is removed (along with everything in it) afterwards.
+        with scratch_dir() as builddir:
+            # Compile the assembly language program to a `.o` file.
+            object_name = \
+                os.path.join(builddir, re.sub(r'\.s$', '.o', basename))
+            args = [c_compiler, '-c', progname, '-o', object_name]
+            if arm64:
+                args += ['-arch', 'x86_64']
+            if verbose:
+                print(f'COMMAND: {" ".join(args)}')
+            proc = p.Popen(args, text=True,
+                           stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
+
+            # Compiling an assembly language program with a C compiler
+            # shouldn't return anything on stderr.
+            if stderr_data != '':
+                print(stderr_data)
+                raise Exception('non-empty stderr data from compiling '
+                                'assembly code')
+
+            # Link the programs to form an executable.
+            executable_name = \
+                os.path.join(builddir, re.sub(r'\.s$', '', basename))
+            args = [c_compiler, object_name, runtime_name,
+                    '-o', executable_name]
+            if arm64:
+                args += ['-arch', 'x86_64']
+            if verbose:
+                print(f'COMMAND: {" ".join(args)}')
+            proc = p.Popen(args, text=True,
+                           stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
+
+            # Running the executable shouldn't return anything on stderr.
+            if stderr_data != '':
+                print(stderr_data)
+                raise Exception('non-empty stderr data from compiling '
+                                'executable')
+
+            # Run the executable program.
+            # NOTE:
+            #   If the program requires `read` inputs,
+            #   the user must supply them manually
+            #   when the program is running.
+            if verbose:
+                print(f'COMMAND: {executable_name}')
+            proc = p.Popen([executable_name], text=True,
+                           stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
+            ret = proc.returncode
+        result_cache.store(key, [stdout_data, stderr_data, ret])
 
     # Running the executable shouldn't return anything on stderr.
     if stderr_data != '':
@@ -104,14 +118,13 @@ def run_assembly_program(progname, arm64=False):
             print(stdout_data)
         print('----')
 
-    ret = proc.returncode
     print(f'OUTPUT (return code): {ret}')
 
 
 def usage():
     """Print a usage message and exit."""
     progname = os.path.basename(sys.argv[0])
-    usagestr = f'usage: {progname} [-arm64] file.s'
+    usagestr = f'usage: {progname} [-arm64] [-no-cache] file.s'
     print(usagestr, file=sys.stderr)
     sys.exit(1)
 
@@ -124,6 +137,10 @@ if __name__ == '__main__':
         c_compiler = 'clang'
         args.remove('-arm64')
 
+    if '-no-cache' in args:
+        result_cache.enabled = False
+        args.remove('-no-cache')
+
     if len(args) == 0:
         usage()
 
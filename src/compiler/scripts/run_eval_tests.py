@@ -17,18 +17,27 @@ $ brew install expect
 
 '''
 
-import sys, re, glob, os.path
+import sys, re, glob, os.path, time, json, threading
 import subprocess as p
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import PIPE
+import compile_server
+from compile_server import run_compile, parse_sexp
+import result_cache
+import results
+from runtime_cache import runtime_object
+from scratch import scratch_dir
 
 
 verbose          = True
 very_verbose     = False  # :)
 compile_not_asm  = True
 compile_asm      = True
+eval_all         = True  # evaluate all passes in one compiler run
+closure_eval     = False  # evaluate with closure-compiling interpreters
 compile_arm64    = False
 timeout          = 5  # seconds
-compile_program  = './compile'
 c_compiler       = 'gcc'
 tests_subdir     = './tests'
 eval_passes      = ['lfun', 'tc1', 'sh', 'un', 'rf', 'lf', 'tc1b',
@@ -36,6 +45,32 @@ eval_passes      = ['lfun', 'tc1', 'sh', 'un', 'rf', 'lf', 'tc1b',
 reg_options      = ['', 'rcx', 'rbx', 'rcx,rbx']
 numpatt          = re.compile(r'^(\d+)')
 pause            = False
+njobs            = 1  # number of worker threads
+keep_going       = False  # keep going after a test file fails
+jsonl_file       = None  # write JSON Lines results here
+junit_file       = None  # write a JUnit XML report here
+gc_report_file   = None  # write per-test GC telemetry (JSON Lines) here
+
+
+# A single test job: one (file, input set, pass or register option) triple.
+# `kind` is either 'eval' (`option` is a pass name),
+# 'eval-all' (all of `eval_passes`; `option` is unused)
+# or 'asm' (`option` is a register option string).
+# `shared` is where the job gets its results from: a `SharedEval`
+# for the 'eval' and 'eval-all' jobs, and a `SharedBuild` for 'asm' jobs.
+Job = namedtuple('Job', ['progname', 'index', 'inputs', 'output',
+                         'kind', 'option', 'shared'])
+
+# The outcome of running a job.
+# `error` is an exception that stopped the whole job, or `None`.
+# Otherwise `outcomes` is a list of `(option, error)` pairs,
+# one per pass or register option checked, where `error` is `None`
+# if the check passed.  `times` maps stages to seconds
+# and `cached` is `True` if the outcome came from the result cache.
+# `gc` is the program's GC telemetry (see `read_gc_trace`),
+# or `None` if it wasn't collected.
+Result = namedtuple('Result', ['job', 'error', 'outcomes',
+                               'times', 'cached', 'gc'])
 
 
 class Error(Exception):
@@ -43,6 +78,15 @@ class Error(Exception):
     pass
 
 
+class Mismatch(Error):
+    """Exception class for a program producing the wrong value."""
+    def __init__(self, expected, actual):
+        super().__init__(f'invalid output; expected [{expected}] '
+                         f'but got [{actual}]')
+        self.expected = expected
+        self.actual = actual
+
+
 def get_metadata(filename):
     """Get the INPUT and OUTPUT metadata from a .src file."""
     # Get the comment lines at the front of the program.
@@ -85,182 +129,628 @@ def get_metadata(filename):
     return metadata
 
 
-def run_eval_program(progname, cpass, inputs, output):
+def timed_compile(args, inputs, info):
     """
-    Compile the program `progname` up to compiler pass `cpass`.
-    Assume that the program is in the directory `tests_subdir`.
-    Run the pass evaluator with standard input supplied by `inputs`.
-    Check that the program return value equals `output`.
+    Run the compiler with `args` and standard input `inputs`,
+    recording the time taken and whether the result was cached in `info`.
+    Return `(stdout, stderr, returncode)`.
     """
-    if verbose:
-        print(f'Running test file ({progname}) up to pass ({cpass}).')
-    args = ['./compile', progname, '-pass', cpass, '-eval']
-    proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = \
-        proc.communicate(input=inputs, timeout=timeout)
-    ret = proc.returncode
+    start = time.perf_counter()
+    compile_info = {}
+    result = run_compile(args, input=inputs, timeout=timeout,
+                         info=compile_info)
+    info['times']['compile'] = time.perf_counter() - start
+    info['cached'] = compile_info['cached']
+    return result
 
-    # These programs shouldn't return anything on stderr.
-    if stderr_data != '':
-        print(stderr_data)
-        raise Exception('non-empty stderr data')
 
-    stdout_data = stdout_data.strip()
-    output = output.strip()
-    if stdout_data != output:
-        err_msg = f'invalid output; expected [{output}] but got [{stdout_data}]'
-        raise Error(err_msg)
+def batch_input(all_inputs):
+    """
+    Return the standard input for a `-batch` compiler run
+    on the input sets `all_inputs`: the sets separated by `;;` lines.
+    """
+    return ';;\n'.join(all_inputs)
+
 
-    if ret != 0:
-        raise Exception('ERROR: nonzero return code')
+def run_eval_batch(progname, cpass, all_inputs, info):
+    """
+    Compile the program `progname` once and evaluate it on every input
+    set in `all_inputs`, either after every pass in `eval_passes`
+    (if `cpass` is `None`) or after the compiler pass `cpass`.
+    Return a list with a dict for each input set, mapping the passes
+    evaluated to `(tag, value)` pairs, where `tag` is 'value' or 'error'.
+    """
+    if cpass is None:
+        args = [progname, '-eval-all', '-batch']
+    else:
+        args = [progname, '-pass', cpass, '-eval', '-batch']
+    if closure_eval:
+        args.append('-closure-eval')
+    (stdout_data, stderr_data, ret) = \
+        timed_compile(args, batch_input(all_inputs), info)
+
+    # With `-eval-all`, each line is `(<pass> <result> ...)`,
+    # with one result per input set; with `-eval`, there is a line
+    # with the result for each input set.  A result is
+    # `(value <int>)` or `(error <msg>)`.
+    values = [{} for _ in all_inputs]
+    lines = [line for line in stdout_data.splitlines()
+             if line.startswith('(')]
+    for (i, line) in enumerate(lines):
+        sexp = parse_sexp(line.encode())
+        if cpass is None:
+            (epass, *results) = sexp
+            for (vals, (tag, value)) in zip(values, results):
+                vals[epass] = (tag, value)
+        elif i < len(values):
+            (tag, value) = sexp
+            values[i][cpass] = (tag, value)
+
+    # These programs shouldn't return anything on stderr.  A failed
+    # run is an error only for the results it didn't print.
+    if stderr_data != '':
+        message = f'non-empty stderr data\n{stderr_data}'
+    elif ret != 0:
+        message = 'nonzero return code'
+    else:
+        return values
+    if not any(values):
+        raise Error(message)
+    passes = eval_passes if cpass is None else [cpass]
+    for vals in values:
+        for epass in passes:
+            vals.setdefault(epass, ('error', message))
+    return values
 
 
-def run_assembly_program(progname, inputs, output, reg_opt, arm64=False):
+class SharedEval:
     """
-    Compile the program `progname` to assembly language.
-    Also compile `runtime.c` and link to make an executable.
-    Run it with the inputs and check the return code;
-    it should equal the output.
-    Use the registers specified in `reg_opt`;
-    if it's `''`, use all registers.
-    If `arm64` is `True`, compile on an Apple Arm64 computer
-    using Rosetta Stone.
+    The results of evaluating a program on all of its input sets,
+    after every pass in `eval_passes` (if `cpass` is `None`)
+    or after the pass `cpass`, shared by the jobs that check
+    each input set.  The first job that needs them gets them all
+    from a single `-batch` compiler run (an error doing that is
+    raised in every job); the others wait for them.
     """
-    if verbose:
-        if reg_opt == '':
-            print('Compiling to assembly language ' + \
-                  'and compiling/running the program.')
-        else:
-            print('Compiling to assembly language ' + \
-                  'and compiling/running the program ' + \
-                  'using only the register(s): ' + reg_opt)
-    basename = os.path.basename(progname)
 
-    if reg_opt == '':
-        args = ['./compile', progname]  # no command-line arguments!
-    else:
-        args = ['./compile', progname, '-regs', reg_opt]
-    proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    def __init__(self, progname, cpass, all_inputs):
+        self.progname = progname
+        self.cpass = cpass
+        self.all_inputs = all_inputs
+        self.lock = threading.Lock()
+        self.values = None  # see `run_eval_batch`
+        self.error = None
+
+    def results(self, index, info):
+        """
+        Return the dict of results for input set `index`
+        (see `run_eval_batch`), recording the time taken
+        to get them in `info` if this job got them.
+        """
+        with self.lock:
+            if self.values is None and self.error is None:
+                try:
+                    self.values = run_eval_batch(self.progname, self.cpass,
+                                                 self.all_inputs, info)
+                except Exception as e:
+                    self.error = e
+        if self.error is not None:
+            raise self.error
+        return self.values[index]
+
+
+def run_eval_program(shared, index, output, info):
+    """
+    Check that the program of `shared`, evaluated after its pass
+    on input set number `index`, returns `output`.
+    """
+    (tag, value) = shared.results(index, info).get(
+        shared.cpass, ('error', 'not evaluated'))
+    if tag == 'error':
+        raise Error(value)
+    output = output.strip()
+    if value != output:
+        raise Mismatch(output, value)
 
-    if very_verbose:
-        print(f'COMMAND: {" ".join(args)}')
 
-    (stdout_data, stderr_data) = \
-        proc.communicate(input=inputs, timeout=timeout)
+def run_eval_all_program(shared, index, output, info):
+    """
+    Check that the program of `shared`, evaluated after every pass
+    in `eval_passes` on input set number `index`, returns `output`.
+    Return a list of `(pass, error)` pairs, where `error` is `None`
+    if the pass returned the right value.
+    """
+    values = shared.results(index, info)
+    output = output.strip()
+    outcomes = []
+    for cpass in eval_passes:
+        if cpass not in values:
+            outcomes.append((cpass, Error('not evaluated')))
+            continue
+        (tag, value) = values[cpass]
+        if tag == 'error':
+            outcomes.append((cpass, Error(value)))
+        elif value != output:
+            outcomes.append((cpass, Mismatch(output, value)))
+        else:
+            outcomes.append((cpass, None))
+    return outcomes
 
-    # Compiling a program shouldn't return anything on stderr.
-    if stderr_data != '':
-        print(stderr_data)
-        raise Exception('non-empty stderr data')
 
+def build_executable(builddir, basename, asm_code, runtime_name, times,
+                     arm64=False):
+    """
+    Assemble `asm_code` (compiled from the program `basename`)
+    in the directory `builddir` and link it with the runtime object
+    `runtime_name`.  Record the time taken by each stage in `times`.
+    Return the name of the executable.
+    """
     # Copy the stdout data to a file ending in `.s`.
-    asmname = re.sub(r'\.src$', '.s', basename)
+    asmname = os.path.join(builddir, re.sub(r'\.src$', '.s', basename))
     with open(asmname, 'w') as asmfile:
-        print(stdout_data, file=asmfile, end='')
+        print(asm_code, file=asmfile, end='')
 
     # Compile the assembly language program to a `.o` file.
-    args = [c_compiler, '-c', asmname]
+    object_name = os.path.join(builddir, re.sub(r'\.src$', '.o', basename))
+    args = [c_compiler, '-c', asmname, '-o', object_name]
     if arm64:
         args += ['-arch', 'x86_64']
+    start = time.perf_counter()
     proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
     (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
+    times['assemble'] = time.perf_counter() - start
 
     # Compiling an assembly language program with a C compiler
     # shouldn't return anything on stderr.
     if stderr_data != '':
-        print(stderr_data)
-        raise Exception('non-empty stderr data from compiling assembly code')
-
-    # Compile the `runtime.c` program to a `.o` file.
-    args = [c_compiler, '-c', 'runtime.c']
-    if arm64:
-        args += ['-arch', 'x86_64']
-    proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
-
-    # Compiling 'runtime.c' with a C compiler
-    # shouldn't return anything on stderr.
-    if stderr_data != '':
-        print(stderr_data)
-        raise Exception('non-empty stderr data from compiling `runtime.c`')
+        raise Exception('non-empty stderr data from compiling '
+                        f'assembly code\n{stderr_data}')
 
     # Link the programs to form an executable.
-    executable_name = re.sub(r'\.src$', '', basename)
-    object_name = re.sub(r'\.src$', '.o', basename)
-    args = [c_compiler, object_name, 'runtime.o', '-o', executable_name]
+    executable_name = os.path.join(builddir, re.sub(r'\.src$', '', basename))
+    args = [c_compiler, object_name, runtime_name, '-o', executable_name]
     if arm64:
         args += ['-arch', 'x86_64']
+    start = time.perf_counter()
     proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
     (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
+    times['link'] = time.perf_counter() - start
 
     # Running the executable shouldn't return anything on stderr.
     if stderr_data != '':
-        print(stderr_data)
-        raise Exception('non-empty stderr data from compiling executable')
+        raise Exception('non-empty stderr data from compiling '
+                        f'executable\n{stderr_data}')
+    return executable_name
 
-    # Remove the assembly and object files.
-    p.call('/bin/rm -f *.o *.s', shell=True)
 
-    # Run the executable program.
-    proc = p.Popen([f'./{executable_name}'], text=True,
+def read_gc_trace(filename):
+    """
+    Read the GC telemetry that the runtime wrote to `filename`
+    (see `GC_TRACE` in `runtime.c`).  Return a dict of the summary's
+    fields plus the numbers of `minor` and `major` collections,
+    or `None` if there is no summary (e.g. the program crashed).
+    """
+    if not os.path.exists(filename):
+        return None
+    kinds = {'minor': 0, 'major': 0}
+    summary = None
+    with open(filename, 'rb') as f:
+        for line in f:
+            (head, *fields) = parse_sexp(line)
+            fields = dict(fields)
+            if head == 'collection':
+                kinds[fields['kind']] += 1
+            elif head == 'gc':
+                summary = {name: int(value)
+                           for (name, value) in fields.items()}
+    if summary is not None:
+        summary.update(kinds)
+    return summary
+
+
+class SharedBuild:
+    """
+    The assembly code and executable of a program compiled with one
+    register option, shared by the jobs that run it on each of the
+    program's input sets.  The first job that needs them compiles the
+    program and links the executable (an error doing either is recorded
+    and raised again in every job, so a failing build is only tried
+    once); the others wait for them.  The executable's scratch
+    directory is removed when the last job releases the build
+    (or by `cleanup`, if some jobs never ran).
+    """
+
+    def __init__(self, progname, reg_opt, nusers):
+        self.progname = progname
+        self.reg_opt = reg_opt
+        self.nusers = nusers  # jobs that haven't released the build yet
+        self.lock = threading.Lock()
+        self.compiled = None  # `(stdout, stderr)` of the compiler
+        self.compile_error = None  # the exception raised compiling
+        self.executable_name = None
+        self.error = None  # the exception raised building the executable
+        self.scratch = None
+
+    def assembly(self, info):
+        """
+        Return the program's assembly code, compiling it first
+        if no other job has (recording the time taken in `info`).
+        """
+        with self.lock:
+            if self.compiled is None and self.compile_error is None:
+                if self.reg_opt == '':
+                    args = [self.progname]  # no command-line arguments!
+                else:
+                    args = [self.progname, '-regs', self.reg_opt]
+                try:
+                    (stdout_data, stderr_data, _) = \
+                        timed_compile(args, '', info)
+                    self.compiled = (stdout_data, stderr_data)
+                except Exception as e:
+                    self.compile_error = e
+        if self.compile_error is not None:
+            raise self.compile_error
+        (asm_code, stderr_data) = self.compiled
+        # Compiling a program shouldn't return anything on stderr.
+        if stderr_data != '':
+            raise Exception(f'non-empty stderr data\n{stderr_data}')
+        return asm_code
+
+    def executable(self, asm_code, runtime_name, times, arm64=False):
+        """
+        Return the name of the program's executable, assembling
+        `asm_code` and linking it with `runtime_name` first
+        if no other job has (recording the times taken in `times`).
+        """
+        with self.lock:
+            if self.executable_name is None and self.error is None:
+                self.scratch = scratch_dir()
+                try:
+                    self.executable_name = build_executable(
+                        self.scratch.name, os.path.basename(self.progname),
+                        asm_code, runtime_name, times, arm64)
+                except Exception as e:
+                    self.error = e
+        if self.error is not None:
+            raise self.error
+        return self.executable_name
+
+    def release(self):
+        """Note that a job is done with the build."""
+        with self.lock:
+            self.nusers -= 1
+            if self.nusers == 0:
+                self.remove_scratch()
+
+    def cleanup(self):
+        """Remove the executable even if some jobs haven't released it."""
+        with self.lock:
+            self.remove_scratch()
+
+    def remove_scratch(self):
+        if self.scratch is not None:
+            self.scratch.cleanup()
+            self.scratch = None
+
+
+def run_executable(executable_name, inputs, times, trace_name=None):
+    """
+    Run an executable with standard input supplied by `inputs`.
+    Record the time taken in `times`.
+    Return the program's `(stdout, stderr, returncode, gc)`,
+    where `gc` is its GC telemetry if `trace_name` (the file
+    for the runtime to write it to) isn't `None`, and `None` otherwise.
+    """
+    # The telemetry goes to a side file, since the program's
+    # stdout and stderr are checked.
+    env = None
+    if trace_name is not None:
+        env = dict(os.environ, GC_TRACE=trace_name)
+
+    start = time.perf_counter()
+    proc = p.Popen([executable_name], text=True, env=env,
                    stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    (stdout_data, stderr_data) = proc.communicate(input=inputs, timeout=timeout)
+    (stdout_data, stderr_data) = \
+        proc.communicate(input=inputs, timeout=timeout)
+    times['run'] = time.perf_counter() - start
+    gc = read_gc_trace(trace_name) if trace_name is not None else None
+    return (stdout_data, stderr_data, proc.returncode, gc)
 
-    # Remove the executable program.
-    p.call(f'/bin/rm -f ./{executable_name}', shell=True)
+
+def run_assembly_program(build, index, inputs, output, info, arm64=False):
+    """
+    Run the program of `build`, compiled to assembly language
+    with its register option (all registers if it's `''`)
+    and linked with the cached `runtime.c` object,
+    on its input set number `index`, with the inputs `inputs`.
+    Check the return code; it should equal the output.
+    The program is only compiled and linked once for all its input sets.
+    If `arm64` is `True`, compile on an Apple Arm64 computer
+    using Rosetta Stone.
+    """
+    asm_code = build.assembly(info)
+
+    # Get the (cached) `runtime.c` object file.
+    runtime_flags = ['-arch', 'x86_64'] if arm64 else []
+    runtime_name = runtime_object(c_compiler, runtime_flags)
+
+    # The outcome of running the program only depends on the assembly
+    # code, the runtime, its environment settings and the input,
+    # so it can come from the cache.
+    # (The GC telemetry does too, apart from the pause times.)
+    gc_trace = gc_report_file is not None
+    key = result_cache.make_key('run', c_compiler, runtime_flags,
+                                result_cache.file_hash(runtime_name),
+                                result_cache.runtime_env(),
+                                asm_code, inputs, gc_trace)
+    cached = result_cache.lookup(key)
+    info['cached'] = cached is not None
+    if cached is not None:
+        (stdout_data, stderr_data, ret, gc) = cached
+    else:
+        executable_name = build.executable(asm_code, runtime_name,
+                                           info['times'], arm64)
+        # Runs on other input sets may share the directory.
+        trace_name = None
+        if gc_trace:
+            trace_name = os.path.join(os.path.dirname(executable_name),
+                                      f'gc.{index}.trace')
+        (stdout_data, stderr_data, ret, gc) = \
+            run_executable(executable_name, inputs, info['times'],
+                           trace_name)
+        result_cache.store(key, [stdout_data, stderr_data, ret, gc])
+    info['gc'] = gc
 
     # Running the executable shouldn't return anything on stderr.
     if stderr_data != '':
-        print(stderr_data)
-        raise Exception('non-empty stderr data from running executable')
+        raise Exception('non-empty stderr data from running executable\n'
+                        f'{stderr_data}')
 
     # Running the executable shouldn't return anything on stdout
     # (for this language).
     if stdout_data != '':
-        print(stdout_data)
-        raise Exception('non-empty stdout data from running executable')
+        raise Exception('non-empty stdout data from running executable\n'
+                        f'{stdout_data}')
 
-    ret = proc.returncode
     out = int(output)
-    if int(output) != ret:
-        err_msg = f'invalid output; expected [{out}] but got [{ret}]'
-        raise Exception(err_msg)
+    if out != ret:
+        raise Mismatch(out, ret)
 
 
-def run_eval_program_all(progname):
+def program_jobs(progname):
     """
-    Call `run_eval_program` with all compiler passes that can be evaluated.
+    Return the list of jobs that test the program `progname`:
+    every evaluable compiler pass and every register option
+    for each input/output pair in the program's metadata.
+    The jobs for a register option share one build of the program,
+    and the jobs for a pass (or all passes) share one evaluation.
     """
-    if verbose:
-        print('----')
-        print(f'input file: {os.path.basename(progname)}\n')
-
+    jobs = []
     progdata = get_metadata(progname)
-
+    all_inputs = [inputs for (inputs, _) in progdata]
+    builds = {}
+    if compile_asm:
+        builds = {reg_opt: SharedBuild(progname, reg_opt, len(progdata))
+                  for reg_opt in reg_options}
+    evals = {}
+    if compile_not_asm:
+        cpasses = [None] if eval_all else eval_passes
+        evals = {cpass: SharedEval(progname, cpass, all_inputs)
+                 for cpass in cpasses}
     for (i, (inputs, output)) in enumerate(progdata):
-        if verbose:
-            print(f'* input/output data #{i + 1}:\n')
-        if compile_not_asm:
+        if compile_not_asm and eval_all:
+            jobs.append(Job(progname, i, inputs, output, 'eval-all', None,
+                            evals[None]))
+        elif compile_not_asm:
             for cpass in eval_passes:
-                run_eval_program(progname, cpass, inputs, output)
+                jobs.append(Job(progname, i, inputs, output, 'eval', cpass,
+                                evals[cpass]))
         if compile_asm:
             for reg_opt in reg_options:
-                run_assembly_program(progname, inputs, output,
-                                     reg_opt, compile_arm64)
-        if verbose:
-            print()
+                jobs.append(Job(progname, i, inputs, output, 'asm', reg_opt,
+                                builds[reg_opt]))
+    return jobs
+
+
+def describe_job(job):
+    """Return a human-readable description of a job."""
+    if job.kind == 'eval':
+        return f'Running test file ({job.progname}) up to pass ({job.option}).'
+    if job.kind == 'eval-all':
+        return f'Running test file ({job.progname}) up to all passes ' + \
+               f'({" ".join(eval_passes)}).'
+    if job.option == '':
+        desc = 'Compiling to assembly language ' + \
+               'and compiling/running the program.'
+        args = ['./compile', job.progname]
+    else:
+        desc = 'Compiling to assembly language ' + \
+               'and compiling/running the program ' + \
+               'using only the register(s): ' + job.option
+        args = ['./compile', job.progname, '-regs', job.option]
+    if very_verbose:
+        desc += f'\nCOMMAND: {" ".join(args)}'
+    return desc
 
 
-def run_eval_files(input_files):
-    """Run the compiler for all passes over all input files."""
-    for file in input_files:
-        if os.path.exists(file):
-            run_eval_program_all(file)
+def run_job(job):
+    """
+    Run a single job and return its `Result`.
+    Any exception raised while running the job is recorded as its error.
+    """
+    info = {'times': {}, 'cached': False, 'gc': None}
+    try:
+        if job.kind == 'eval':
+            run_eval_program(job.shared, job.index, job.output, info)
+            outcomes = [(job.option, None)]
+        elif job.kind == 'eval-all':
+            outcomes = run_eval_all_program(job.shared, job.index,
+                                            job.output, info)
         else:
-            print(f'The test file: {file} is missing!', file=sys.stderr)
-        if pause:
-            input('Press <return> to continue...')
-            print()
+            try:
+                run_assembly_program(job.shared, job.index, job.inputs,
+                                     job.output, info, compile_arm64)
+            finally:
+                job.shared.release()
+            outcomes = [(job.option, None)]
+    except Exception as e:
+        return Result(job, e, [], info['times'], info['cached'],
+                      info['gc'])
+    return Result(job, None, outcomes, info['times'], info['cached'],
+                  info['gc'])
+
+
+def job_records(result):
+    """
+    Return the `results.Record`s for a job's result:
+    one per pass or register option checked.
+    If the whole job failed, every check it covers is an error.
+    """
+    job = result.job
+    kind = 'asm' if job.kind == 'asm' else 'eval'
+    outcomes = result.outcomes
+    if result.error is not None:
+        options = eval_passes if job.kind == 'eval-all' else [job.option]
+        outcomes = [(option, result.error) for option in options]
+    # A single `-eval-all` run checks every pass, so its time
+    # is split evenly between them to keep the totals right.
+    times = {stage: t / len(outcomes) for (stage, t) in result.times.items()}
+    expected = job.output.strip()
+    records = []
+    for (option, error) in outcomes:
+        if error is None:
+            (status, actual, message) = ('pass', expected, None)
+        elif isinstance(error, Mismatch):
+            (status, actual, message) = ('fail', str(error.actual), str(error))
+        else:
+            (status, actual, message) = ('error', None, str(error))
+        records.append(results.Record(job.progname, job.index, kind, option,
+                                      status, expected, actual, message,
+                                      times, result.cached))
+    return records
+
+
+def report_results(progname, job_results):
+    """
+    Print the results of all the jobs for the program `progname`
+    in job order, followed by a pass/fail summary line.
+    Return the `results.Record`s for all the jobs' checks.
+    """
+    if verbose:
+        print('----')
+        print(f'input file: {os.path.basename(progname)}\n')
+    index = None
+    records = []
+    for result in job_results:
+        job = result.job
+        if verbose and job.index != index:
+            if index is not None:
+                print()
+            print(f'* input/output data #{job.index + 1}:\n')
+            index = job.index
+        if verbose:
+            print(describe_job(job))
+        if result.error is not None:
+            print(f'ERROR: {result.error}')
+        for (option, error) in result.outcomes:
+            if error is None:
+                pass
+            elif job.kind == 'eval-all':
+                print(f'ERROR: pass ({option}): {error}')
+            else:
+                print(f'ERROR: {error}')
+        records += job_records(result)
+    if verbose and index is not None:
+        print()
+    nfailed = len([r for r in records if r.status != 'pass'])
+    npassed = len(records) - nfailed
+    print(f'{os.path.basename(progname)}: '
+          f'{npassed} passed, {nfailed} failed')
+    # Summarize the GC telemetry by the worst run of each measure.
+    gcs = [result.gc for result in job_results if result.gc is not None]
+    if gcs:
+        worst = {name: max(gc[name] for gc in gcs)
+                 for name in ['collections', 'copied', 'max_pause_ns',
+                              'peak_heap']}
+        print(f'{os.path.basename(progname)}: gc: '
+              f'{worst["collections"]} collections, '
+              f'{worst["copied"]} bytes copied, '
+              f'max pause {worst["max_pause_ns"] / 1e3:.1f} us, '
+              f'peak heap {worst["peak_heap"]} bytes')
+    return records
+
+
+def gc_report(result):
+    """Return a JSON-serializable dict of a job's GC telemetry."""
+    job = result.job
+    return dict(file=job.progname, input=job.index, option=job.option,
+                **result.gc)
+
+
+def write_gc_reports(filename, gc_reports):
+    """Write GC reports to `filename` as JSON Lines."""
+    with open(filename, 'w') as f:
+        for report in gc_reports:
+            print(json.dumps(report), file=f)
+
+
+def run_eval_files(input_files, records, gc_reports):
+    """
+    Run the compiler for all passes over all input files.
+    Jobs are spread over `njobs` worker threads,
+    but results are reported in file and job order.
+    Every check's `results.Record` is appended to `records`,
+    and the GC telemetry of every executable run to `gc_reports`.
+    Stop after the first file with a failing check,
+    unless `keep_going` is `True`.
+    """
+    failed_files = []
+    builds = set()
+    try:
+        with ThreadPoolExecutor(max_workers=njobs) as executor:
+            def submit(file):
+                if not os.path.exists(file):
+                    return (file, None)
+                jobs = program_jobs(file)
+                builds.update(job.shared for job in jobs if job.kind == 'asm')
+                return (file, [executor.submit(run_job, job) for job in jobs])
+
+            # Submit every job up front so the workers never go idle
+            # while earlier files are being reported, unless `-pause`
+            # should stop the work itself between files.
+            pending = map(submit, input_files)
+            if not pause:
+                pending = list(pending)
+            for (file, futures) in pending:
+                if futures is None:
+                    print(f'The test file: {file} is missing!',
+                          file=sys.stderr)
+                    records.append(results.Record(file, None, 'file', None,
+                                                  'error', None, None,
+                                                  'missing test file', {},
+                                                  False))
+                else:
+                    job_results = [f.result() for f in futures]
+                    file_records = report_results(file, job_results)
+                    records += file_records
+                    gc_reports += [gc_report(result)
+                                   for result in job_results
+                                   if result.gc is not None]
+                    if any(r.status != 'pass' for r in file_records):
+                        failed_files.append(file)
+                        if not keep_going:
+                            executor.shutdown(cancel_futures=True)
+                            raise Error(f'test file {file} failed')
+                if pause:
+                    input('Press <return> to continue...')
+                    print()
+    finally:
+        # Jobs cancelled after a failure never release their builds.
+        for build in builds:
+            build.cleanup()
+    if failed_files:
+        raise Error(f'{len(failed_files)} test file(s) failed: '
+                    f'{" ".join(failed_files)}')
 
 
 def extract_number(filename):
@@ -286,7 +776,10 @@ def sort_files_numerically(filenames):
 def usage():
     """Print a usage message and exit."""
     progname = os.path.basename(sys.argv[0])
-    usagestr = f'usage: {progname} [-no-asm] [-arm64] file1 ...'
+    usagestr = f'usage: {progname} [-no-asm] [-arm64] [-j n] [-no-server] ' + \
+               '[-no-eval-all] [-closure-eval] [-no-cache] [-keep-going] ' + \
+               '[-jsonl file] [-junit file] [-gc-report file] ' + \
+               'file1 ...'
     print(usagestr, file=sys.stderr)
     sys.exit(1)
 
@@ -315,12 +808,60 @@ if __name__ == '__main__':
         args.remove('-arm64')
     if '-pause' in args:
         pause = True
+    if '-no-server' in args:
+        compile_server.use_server = False
+        args.remove('-no-server')
+    if '-no-eval-all' in args:
+        eval_all = False
+        args.remove('-no-eval-all')
+    if '-closure-eval' in args:
+        closure_eval = True
+        args.remove('-closure-eval')
+    if '-no-cache' in args:
+        result_cache.enabled = False
+        args.remove('-no-cache')
+    if '-j' in args:
+        j_index = args.index('-j')
+        args.pop(j_index)
+        try:
+            njobs = int(args.pop(j_index))
+        except (ValueError, IndexError):
+            njobs = 0
+        if njobs <= 0:
+            print('ERROR: `-j` argument must be a positive integer',
+                  file=sys.stderr)
+            sys.exit(1)
+    if '-keep-going' in args:
+        keep_going = True
+        args.remove('-keep-going')
+    for flag in ['-jsonl', '-junit', '-gc-report']:
+        if flag in args:
+            i = args.index(flag)
+            args.pop(i)
+            if i >= len(args):
+                print(f'ERROR: no argument for `{flag}` option',
+                      file=sys.stderr)
+                sys.exit(1)
+            if flag == '-jsonl':
+                jsonl_file = args.pop(i)
+            elif flag == '-junit':
+                junit_file = args.pop(i)
+            else:
+                gc_report_file = args.pop(i)
 
     if len(args) == 0:
         usage()
 
+    records = []
+    gc_reports = []
     try:
         filenames = sort_files_numerically(args)
-        run_eval_files(filenames)
+        run_eval_files(filenames, records, gc_reports)
     except Error as e:
         print(f'ERROR: {e}')
+        sys.exit(1)
+    finally:
+        results.write_reports(records, jsonl_file, junit_file,
+                              name='run_eval_tests')
+        if gc_report_file is not None:
+            write_gc_reports(gc_report_file, gc_reports)
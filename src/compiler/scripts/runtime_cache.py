@@ -0,0 +1,66 @@
+"""
+runtime_cache.py:
+    Build the `runtime.c` object file once and reuse it for every link.
+    Cached objects are keyed on the contents of the runtime sources
+    and on the C compiler and flags used to build them,
+    so editing `runtime.c` or `runtime.h` triggers a rebuild.
+"""
+
+import hashlib, os, tempfile, threading
+import subprocess as p
+from subprocess import PIPE
+
+
+cache_dir       = '.cache/runtime'
+runtime_sources = ['runtime.c', 'runtime.h']
+timeout         = 60  # seconds
+build_lock      = threading.Lock()
+
+
+def runtime_key(c_compiler, flags):
+    """
+    Compute the cache key for a runtime object built by `c_compiler`
+    with the extra command-line flags `flags`.
+    """
+    h = hashlib.sha256()
+    h.update(c_compiler.encode())
+    for flag in flags:
+        h.update(b'\0' + flag.encode())
+    for source in runtime_sources:
+        h.update(b'\0' + source.encode() + b'\0')
+        with open(source, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def runtime_object(c_compiler, flags=()):
+    """
+    Return the path of a `runtime.o` built by `c_compiler` with `flags`,
+    compiling it first if there is no up-to-date cached copy.
+    Safe to call from several threads or processes at once.
+    """
+    flags = list(flags)
+    key = runtime_key(c_compiler, flags)
+    objname = os.path.join(cache_dir, f'runtime-{key}.o')
+    with build_lock:
+        if os.path.exists(objname):
+            return objname
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Build into a private file and rename it into place,
+        # so a concurrent run never links against a partial object.
+        (fd, tmpname) = tempfile.mkstemp(suffix='.o', dir=cache_dir)
+        os.close(fd)
+        args = [c_compiler, '-c', 'runtime.c', '-o', tmpname] + flags
+        proc = p.Popen(args, text=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        (stdout_data, stderr_data) = proc.communicate(timeout=timeout)
+
+        # Compiling 'runtime.c' with a C compiler
+        # shouldn't return anything on stderr.
+        if stderr_data != '' or proc.returncode != 0:
+            os.remove(tmpname)
+            raise Exception('non-empty stderr data from compiling '
+                            f'`runtime.c`\n{stderr_data}')
+
+        os.replace(tmpname, objname)
+        return objname
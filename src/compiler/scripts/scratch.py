@@ -0,0 +1,66 @@
+"""
+scratch.py:
+    Private scratch directories for assembling, linking and running
+    test programs, so concurrent jobs never share intermediate files.
+"""
+
+import os, stat, tempfile, threading
+import subprocess as p
+
+
+# Prefer a memory-backed filesystem for the short-lived build files.
+tmpfs_dirs = ['/dev/shm']
+
+root      = None   # the chosen scratch root, once `scratch_root` has run
+root_lock = threading.Lock()
+
+
+def can_execute_in(d):
+    """
+    Return `True` if programs can be run from the directory `d`.
+    Containers often mount `/dev/shm` `noexec`, which `os.access`
+    doesn't detect, so check the mount flags and then run a tiny
+    script from there to be sure.
+    """
+    try:
+        if os.statvfs(d).f_flag & os.ST_NOEXEC:
+            return False
+        (fd, path) = tempfile.mkstemp(prefix='probe-', dir=d)
+    except OSError:
+        return False
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write('#!/bin/sh\nexit 0\n')
+        os.chmod(path, stat.S_IRWXU)
+        return p.run([path], stdin=p.DEVNULL, stdout=p.DEVNULL,
+                     stderr=p.DEVNULL, timeout=5).returncode == 0
+    except (OSError, p.SubprocessError):
+        return False
+    finally:
+        os.remove(path)
+
+
+def scratch_root():
+    """
+    Return the directory that scratch directories are created in:
+    a writable tmpfs that programs can be run from if there is one,
+    else the system default.  The choice is only made once.
+    """
+    global root
+    with root_lock:
+        if root is None:
+            root = tempfile.gettempdir()
+            for d in tmpfs_dirs:
+                if os.path.isdir(d) and os.access(d, os.W_OK | os.X_OK) \
+                        and can_execute_in(d):
+                    root = d
+                    break
+        return root
+
+
+def scratch_dir(prefix='compile-'):
+    """
+    Return a new temporary directory context manager.
+    The directory and everything in it is removed when the context exits.
+    """
+    return tempfile.TemporaryDirectory(prefix=prefix, dir=scratch_root())
@@ -255,7 +255,7 @@ end
 
 module LocSet = SetS.Make (OrderedLoc)
 module LocMap = MapS.Make (OrderedLoc)
-module LocUgraph = Ugraph.Make (OrderedLoc)
+module LocUgraph = Bitgraph.Make (OrderedLoc)
 
 (* ----------------------------------------------------------------------
  * (Language-level) types.
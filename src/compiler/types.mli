@@ -131,7 +131,8 @@ module LocSet : SetS.S with type elt = location
 
 module LocMap : MapS.S with type key = location
 
-(** Undirected graph of locations. *)
+(** Undirected graph of locations (used for interference graphs).
+    This is a `Bitgraph`, which has the same interface as a `Ugraph`. *)
 module LocUgraph : Ugraph.S with type elt = location
 
 (** Type of types, for use in type checkers. *)
@@ -28,6 +28,40 @@ let write_set lst set =
       | _ -> acc )
     set lst
 
+(* The effects of an instruction on liveness: the arguments it writes,
+ * the arguments it reads, and the labels it can jump to.
+ * The live-before set of an instruction is its live-after set,
+ * minus the locations written, plus the locations read,
+ * plus the live-before sets of the jump targets. *)
+let instr_effects (instr : X.instr) : X.arg list * X.arg list * label list =
+  let regs rs = List.map (fun r -> X.Reg r) rs in
+  (* Calls write (clobber) the caller-saved registers
+   * and read the first `n` argument-passing registers. *)
+  let call_effects args n =
+    ( regs (RegSet.elements caller_save_regs)
+    , args @ regs (take n arg_passing_regs)
+    , [] )
+  in
+  match instr with
+  | X.Addq (arg1, arg2)
+   |X.Subq (arg1, arg2)
+   |X.Xorq (arg1, arg2)
+   |X.Andq (arg1, arg2) ->
+    ([], [arg1; arg2], [])
+  | X.Negq arg -> ([], [arg], [])
+  | X.Movq (arg1, arg2) | X.Movzbq (arg1, arg2) -> ([arg2], [arg1], [])
+  | X.Pushq _ -> ([], [], [])
+  | X.Popq arg -> ([], [arg], [])
+  | X.Leaq (_, arg) -> ([arg], [], [])
+  | X.Retq -> ([], [X.Reg Rax], [])
+  | X.Sarq (_, arg2) -> ([], [arg2], [])
+  | X.Callq (_, n) -> call_effects [] n
+  | X.IndirectCallq (arg, n) | X.TailJmp (arg, n) -> call_effects [arg] n
+  | X.Jmp label -> ([], [], [label])
+  | X.Cmpq (arg1, arg2) -> ([rflags_reg], [arg1; arg2], [])
+  | X.Set (_, arg) -> ([arg], [rflags_reg], [])
+  | X.JmpIf (_, label) -> ([], [rflags_reg], [label])
+
 (* Compute the live sets for the instructions of a single labeled block.
  * The `live_before_map` is the live-before sets for each block named
  * by the given labels. *)
@@ -35,71 +69,16 @@ let uncover_live_in_block (live_before_map : LocSet.t LabelMap.t)
   (instrs : X.instr list) : X.live =
   (* computes l_before given current instruction and l_after in a set *)
   let l_before instr (l_after : LocSet.t) =
-    match instr with
-    | X.Addq (arg1, arg2) -> read_set [arg1; arg2] l_after
-    | X.Subq (arg1, arg2) -> read_set [arg1; arg2] l_after
-    | X.Negq arg -> read_set [arg] l_after
-    | X.Movq (arg1, arg2) -> read_set [arg1] (write_set [arg2] l_after)
-    | X.Movzbq (arg1, arg2) -> read_set [arg1] (write_set [arg2] l_after)
-    | X.Pushq _ -> l_after
-    | X.Popq arg -> read_set [arg] l_after
-    | X.Leaq (_, arg) -> write_set [arg] l_after
-    | X.Retq -> read_set [X.Reg Rax] l_after
-    | X.Andq (arg1, arg2) -> read_set [arg1; arg2] l_after
-    | X.Sarq (_, arg2) -> read_set [arg2] l_after
-    (* remove (write) from caller and then add first i of callee, as according to spec*)
-    | X.Callq (_, int) ->
-      let caller_saved_conv =
-        List.map (fun r -> X.Reg r) (RegSet.elements caller_save_regs)
-      in
-      let arg_passing_conv =
-        List.map (fun r -> X.Reg r) (take int arg_passing_regs)
-      in
-      read_set arg_passing_conv (write_set caller_saved_conv l_after)
-    | X.IndirectCallq (arg, int) ->
-      let caller_saved_conv =
-        List.map (fun r -> X.Reg r) (RegSet.elements caller_save_regs)
-      in
-      let arg_passing_conv =
-        List.map (fun r -> X.Reg r) (take int arg_passing_regs)
-      in
-      read_set ([arg] @ arg_passing_conv) (write_set caller_saved_conv l_after)
-    | X.TailJmp (arg, int) ->
-      let caller_saved_conv =
-        List.map (fun r -> X.Reg r) (RegSet.elements caller_save_regs)
-      in
-      let arg_passing_conv =
-        List.map (fun r -> X.Reg r) (take int arg_passing_regs)
-      in
-      read_set ([arg] @ arg_passing_conv) (write_set caller_saved_conv l_after)
-    | X.Jmp label ->
-      let args =
-        List.map
-          (function
-            | x -> (
-              match x with
-              | VarL v -> X.Var v
-              | RegL r -> X.Reg r
-              | _ -> failwith "Shouldn't have this case" ) )
-          (LocSet.elements (LabelMap.find label live_before_map))
-      in
-      read_set args l_after
-    | X.Xorq (arg1, arg2) -> read_set [arg1; arg2] l_after
-    | X.Cmpq (arg1, arg2) ->
-      read_set [arg1; arg2] (write_set [rflags_reg] l_after)
-    | X.Set (_, arg) -> read_set [Reg Rflags] (write_set [arg] l_after)
-    | X.JmpIf (_, label) ->
-      let args =
-        List.map
-          (function
-            | x -> (
-              match x with
-              | VarL v -> X.Var v
-              | RegL r -> X.Reg r
-              | _ -> failwith "Shouldn't have this case" ) )
-          (LocSet.elements (LabelMap.find label live_before_map))
-      in
-      read_set (rflags_reg :: args) l_after
+    let writes, reads, targets = instr_effects instr in
+    List.fold_left
+      (fun acc lbl ->
+        LocSet.union acc
+          (LabelMap.find_or_fail lbl live_before_map
+             ~err_msg:
+               (Printf.sprintf "uncover_live: jump to unknown label (%s)"
+                  (string_of_label lbl) ) ) )
+      (read_set reads (write_set writes l_after))
+      targets
   in
   let afters =
     List.fold_right
@@ -110,82 +89,193 @@ let uncover_live_in_block (live_before_map : LocSet.t LabelMap.t)
   | h :: t -> {initial = h; afters = t}
   | _ -> failwith "no code?"
 
-(* Get the next jump labels, if any.
- * The jump instructions should only be at the end of the block,
- * but we can accumulate all of them, since you can have two
- * jumps at the end (one conditional, one not). *)
-let get_next_labels (block : 'a X.block) : LabelSet.t =
-  let (X.Block (_, instrs)) = block in
-  List.fold_right
-    (fun instr acc ->
-      match instr with
-      | X.Jmp lbl
-       |X.JmpIf (_, lbl) ->
-        LabelSet.add lbl acc
-      | X.TailJmp (Var arg, _) -> LabelSet.add (Label arg) acc
-      | _ -> acc )
-    instrs LabelSet.empty
+(* ----------------------------------------------------------------------
+ * Computing the live-before sets of all the blocks.
+ * ---------------------------------------------------------------------- *)
+
+(* While iterating to a fixpoint, live sets are bit vectors indexed by
+ * a dense numbering of the locations used in the function. *)
+type numbering = {index : int LocMap.t; locs : location array}
+
+let make_numbering (locs : LocSet.t) : numbering =
+  let locs = Array.of_list (LocSet.elements locs) in
+  let index =
+    Array.to_list (Array.mapi (fun i loc -> (loc, i)) locs) |> LocMap.of_list
+  in
+  {index; locs}
+
+(* The indices of the locations of some arguments. *)
+let indices_of_args (num : numbering) (args : X.arg list) : int list =
+  LocSet.elements (read_set args LocSet.empty)
+  |> List.map (fun loc -> LocMap.find loc num.index)
+
+let bits_of_locset (num : numbering) (s : LocSet.t) : Bitset.t =
+  Bitset.of_list (Array.length num.locs)
+    (List.map (fun loc -> LocMap.find loc num.index) (LocSet.elements s))
+
+let locset_of_bits (num : numbering) (b : Bitset.t) : LocSet.t =
+  Bitset.fold (fun i acc -> LocSet.add num.locs.(i) acc) b LocSet.empty
+
+(* A jump target: either a block (by index) or a label with a fixed
+ * live-before set (the function's conclusion). *)
+type target = Block of int | Fixed of Bitset.t
+
+(* The effect of a whole block on its live-before set:
+ *
+ *   live_before = gen + sum over jumps j of (live_before(target j) - kill j)
+ *
+ * where `gen` is the set of locations read before being written,
+ * and `kill j` is the set of locations written before jump `j`.
+ * Only the live-before sets of the targets change during the fixpoint
+ * iteration, so each block's instructions are only traversed once. *)
+type summary = {gen : Bitset.t; jumps : (target * Bitset.t) list}
+
+let summarize (num : numbering) (target_of : label -> target)
+  (instrs : X.instr list) : summary =
+  let n = Array.length num.locs in
+  let gen = Bitset.create n in
+  let killed = Bitset.create n in
+  let jumps =
+    List.fold_left
+      (fun jumps instr ->
+        let writes, reads, targets = instr_effects instr in
+        List.iter
+          (fun i -> if not (Bitset.mem killed i) then Bitset.add gen i)
+          (indices_of_args num reads) ;
+        (* An instruction's writes don't kill its own jump targets'
+         * live-before sets, so record the jumps first. *)
+        let jumps =
+          List.fold_left
+            (fun jumps lbl -> (target_of lbl, Bitset.copy killed) :: jumps)
+            jumps targets
+        in
+        List.iter (Bitset.add killed) (indices_of_args num writes) ;
+        jumps )
+      [] instrs
+  in
+  {gen; jumps}
 
 (* Liveness algorithm (dataflow analysis, but not generic):
- * - Create an empty (imperative) queue.
- * - Create an initial liveness map from labels to empty locsets
- *   (except for the "NAME_conclusion" label (NAME = function name),
- *    which has a fixed set of registers).
- * - Add all the labels (except "NAME_conclusion") to a queue.
- * - Repeat until the queue is empty:
- *   - Pop a label off the queue.
- *   - Get the instructions corresponding to the label.
- *   - Use the liveness map to get the old live-before set for the instructions.
- *   - Compute the new live-before set for the instructions.
- *   - If the live-before set has changed:
- *     - Update the liveness map.
- *     - Find the labels of the blocks that project to the current label's
- *       block, and add them to the queue.
- * - Return the liveness map.
- * NOTE: Make sure to never add the label "NAME_conclusion" to the queue!
- * It has no corresponding instructions.
+ * - Number all the locations used in the function, and summarize
+ *   each block (see `summary` above) using that numbering.
+ *   The "NAME_conclusion" label (NAME = function name) has no block,
+ *   but a fixed live-before set of registers.
+ * - Order the blocks so that successors usually come before their
+ *   predecessors: a postorder of a depth-first search of the
+ *   control-flow graph (i.e. a reverse postorder of the reversed graph).
+ * - Mark all the blocks as pending.
+ * - Sweep through the blocks in that order until none are pending:
+ *   - Compute the new live-before set of each pending block
+ *     from its summary and the live-before sets of its targets.
+ *   - If the live-before set has changed, update it and mark the
+ *     block's predecessors as pending (if they aren't already).
+ * - Return the liveness map (including "NAME_conclusion").
+ * The live sets only grow, so this reaches the same (least) fixpoint
+ * as any other visiting order; this order just gets there sooner.
  *)
-let compute_liveness (f_lbl : label) (g : LabelDgraph.t)
-  (imap : X.instr list LabelMap.t) : LocSet.t LabelMap.t =
-  let q = Queue.create () in
+let compute_liveness (f_lbl : label) (lbs : (label * 'a X.block) list) :
+  LocSet.t LabelMap.t =
   let (Label f) = f_lbl in
-  let init_map =
-    LabelMap.mapi (fun _ _ -> LocSet.empty) imap
-    |> LabelMap.add
-         (Label (fix_label (f ^ "_conclusion")))
-         (LocSet.of_list [RegL Rax; RegL Rsp])
+  let conclusion = Label (fix_label (f ^ "_conclusion")) in
+  let conclusion_live = LocSet.of_list [RegL Rax; RegL Rsp] in
+  let blocks = Array.of_list lbs in
+  let nblocks = Array.length blocks in
+  (* Number every location used by any instruction. *)
+  let num =
+    Array.fold_left
+      (fun acc (_, X.Block (_, instrs)) ->
+        List.fold_left
+          (fun acc instr ->
+            let writes, reads, _ = instr_effects instr in
+            read_set writes (read_set reads acc) )
+          acc instrs )
+      conclusion_live blocks
+    |> make_numbering
   in
-  let _ =
-    LabelMap.iter
-      (fun lbl _ ->
-        if lbl <> Label (fix_label (f ^ "_conclusion")) then Queue.add lbl q )
-      init_map
+  let block_index =
+    List.mapi (fun i (lbl, _) -> (lbl, i)) lbs |> LabelMap.of_list
   in
-  let rec helper map =
-    if Queue.is_empty q then map
+  let conclusion_bits = bits_of_locset num conclusion_live in
+  let target_of lbl =
+    if lbl = conclusion then Fixed conclusion_bits
     else
-      let lbl = Queue.take q in
-      let instr = LabelMap.find lbl imap in
-      let o_lbs = LabelMap.find lbl map in
-      let n_lbs = uncover_live_in_block map instr in
-      if not (LocSet.equal o_lbs n_lbs.initial) then (
-        let updated_map = LabelMap.add lbl n_lbs.initial map in
-        let predecessors = LabelDgraph.neighbors_in g lbl in
-        List.iter (fun pred_lbl -> Queue.add pred_lbl q) predecessors ;
-        helper updated_map )
-      else helper map
+      match LabelMap.find_opt lbl block_index with
+      | Some i -> Block i
+      | None ->
+        failwithf "uncover_live: jump to unknown label (%s)"
+          (string_of_label lbl)
+  in
+  let summaries =
+    Array.map
+      (fun (_, X.Block (_, instrs)) -> summarize num target_of instrs)
+      blocks
+  in
+  let successors b =
+    List.filter_map
+      (function Block s, _ -> Some s | Fixed _, _ -> None)
+      summaries.(b).jumps
   in
-  helper init_map
+  let preds = Array.make nblocks [] in
+  for b = 0 to nblocks - 1 do
+    List.iter (fun s -> preds.(s) <- b :: preds.(s)) (successors b)
+  done ;
+  (* Depth-first postorder, starting from the blocks in their
+   * original order (so unreachable blocks are included). *)
+  let visited = Array.make nblocks false in
+  let postorder = ref [] in
+  let rec visit b =
+    if not visited.(b) then (
+      visited.(b) <- true ;
+      List.iter visit (successors b) ;
+      postorder := b :: !postorder )
+  in
+  for b = 0 to nblocks - 1 do
+    visit b
+  done ;
+  let order = List.rev !postorder in
+  (* Iterate to a fixpoint. *)
+  let live_before =
+    Array.init nblocks (fun _ -> Bitset.create (Array.length num.locs))
+  in
+  let pending = Array.make nblocks true in
+  let npending = ref nblocks in
+  let scratch = Bitset.create (Array.length num.locs) in
+  while !npending > 0 do
+    List.iter
+      (fun b ->
+        if pending.(b) then (
+          pending.(b) <- false ;
+          decr npending ;
+          let {gen; jumps} = summaries.(b) in
+          Bitset.assign scratch gen ;
+          List.iter
+            (fun (target, kill) ->
+              let lb =
+                match target with
+                | Block s -> live_before.(s)
+                | Fixed lb -> lb
+              in
+              Bitset.union_diff_into scratch lb kill )
+            jumps ;
+          if not (Bitset.equal scratch live_before.(b)) then (
+            Bitset.assign live_before.(b) scratch ;
+            List.iter
+              (fun p ->
+                if not pending.(p) then (
+                  pending.(p) <- true ;
+                  incr npending ) )
+              preds.(b) ) ) )
+      order
+  done ;
+  List.mapi (fun b (lbl, _) -> (lbl, locset_of_bits num live_before.(b))) lbs
+  |> LabelMap.of_list
+  |> LabelMap.add conclusion conclusion_live
 
 let uncover_live_def (def : (X.finfo1, X.binfo1) X.def) :
   (X.finfo1, X.binfo2) X.def =
   (* Unpack the labeled block list (`lbs`) from a definition. *)
   let (X.Def (lbl, finfo, fcont)) = def in
   let X.{nparams; locals; body = lbs} = fcont in
-  (* Generate the control-flow graph from the (label, block) pairs. *)
-  let cfg =
-    LabelDgraph.of_alist lbs (fun bl -> LabelSet.elements (get_next_labels bl))
-  in
   (* Create a label->instrs map. *)
   let (imap : X.instr list LabelMap.t) =
     lbs
@@ -193,15 +283,9 @@ let uncover_live_def (def : (X.finfo1, X.binfo1) X.def) :
     |> LabelMap.of_list
   in
   (* Compute all the live-before sets. *)
-  let (live_before_sets : LocSet.t LabelMap.t) =
-    compute_liveness lbl cfg imap
-  in
-  (* We run the liveness computation one last time after computing
-   * all the live-before sets to get the full liveness information
-   * for a block.  This is a little inefficient; we could generate it
-   * in the `compute_liveness` function while computing the
-   * live-before sets and return that directly.
-   * IMO this is a bit cleaner and easier to debug. *)
+  let (live_before_sets : LocSet.t LabelMap.t) = compute_liveness lbl lbs in
+  (* Once the live-before sets of all the blocks are known,
+   * one pass over each block gives its full liveness information. *)
   let get_live (lbl : label) : X.live =
     let instrs =
       LabelMap.find_or_fail lbl imap
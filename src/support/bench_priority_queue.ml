@@ -0,0 +1,98 @@
+(* Benchmark of the `Simple` and `Heap` priority queues
+ * on the saturation-ordered (DSATUR) coloring loop of `graph_coloring`.
+ *
+ * Run it from the REPL (`make repl`) with:
+ *   #use "bench_priority_queue.ml";;
+ *
+ * Each node of a random graph with `nnodes` nodes gets edges to
+ * `degree` random nodes.  Nodes are colored in order of decreasing
+ * saturation, and every neighbor's priority is updated after each
+ * node is colored, as in `Graph_coloring.add_color`. *)
+
+open Functors
+open Printf
+open Priority_queue
+
+module OrderedIntS = struct
+  type t = int
+
+  let compare = Stdlib.compare
+
+  let t_of_sexp = Sexplib.Conv.int_of_sexp
+
+  let sexp_of_t = Sexplib.Conv.sexp_of_int
+
+  let to_string v = string_of_int v
+end
+
+module IntSet = Set.Make (Int)
+
+module Coloring (PQ : PriorityQueue with type elt = int) = struct
+  (* Color a graph given as adjacency arrays; return the colors. *)
+  let color (adj : int array array) : int array =
+    let n = Array.length adj in
+    let colors = Array.make n (-1) in
+    let saturation = Array.make n IntSet.empty in
+    let rec pick c set = if IntSet.mem c set then pick (c + 1) set else c in
+    let rec iter pq =
+      if not (PQ.is_empty pq) then (
+        let v, pq = PQ.remove_top pq in
+        let c = pick 0 saturation.(v) in
+        colors.(v) <- c ;
+        let pq =
+          Array.fold_left
+            (fun pq u ->
+              saturation.(u) <- IntSet.add c saturation.(u) ;
+              PQ.update u (IntSet.cardinal saturation.(u)) pq )
+            pq adj.(v)
+        in
+        iter pq )
+    in
+    iter (PQ.of_list (List.init n (fun v -> (v, 0)))) ;
+    colors
+end
+
+module SimpleColoring = Coloring (Simple (OrderedIntS))
+module HeapColoring = Coloring (Heap (OrderedIntS))
+
+let random_graph nnodes degree =
+  let rng = Random.State.make [|nnodes; degree|] in
+  let adj = Array.make nnodes [] in
+  for v = 0 to nnodes - 1 do
+    for _ = 1 to degree do
+      let u = Random.State.int rng nnodes in
+      if u <> v && not (List.mem u adj.(v)) then (
+        adj.(v) <- u :: adj.(v) ;
+        adj.(u) <- v :: adj.(u) )
+    done
+  done ;
+  Array.map Array.of_list adj
+
+let time f =
+  let start = Unix.gettimeofday () in
+  let result = f () in
+  (result, Unix.gettimeofday () -. start)
+
+(* The `Simple` queue takes quadratic time, so it is skipped
+ * for graphs larger than this. *)
+let max_simple = 10000
+
+let bench nnodes degree =
+  let adj = random_graph nnodes degree in
+  let hcolors, htime = time (fun () -> HeapColoring.color adj) in
+  let ncolors = 1 + Array.fold_left max 0 hcolors in
+  if nnodes <= max_simple then (
+    let scolors, stime = time (fun () -> SimpleColoring.color adj) in
+    if scolors <> hcolors then
+      failwith "bench_priority_queue: the colorings are different" ;
+    printf "%8d %7d %7d | %10.4f %10.4f\n%!" nnodes degree ncolors stime htime )
+  else printf "%8d %7d %7d | %10s %10.4f\n%!" nnodes degree ncolors "-" htime
+
+;;
+printf "%8s %7s %7s | %10s %10s\n" "nodes" "degree" "colors" "simple s"
+  "heap s"
+
+;;
+List.iter
+  (fun (nnodes, degree) -> bench nnodes degree)
+  [(1000, 10); (10000, 10); (100000, 10); (100000, 50)]
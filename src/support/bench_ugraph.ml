@@ -0,0 +1,81 @@
+(* Benchmark of the map-based (`Ugraph`) and bit matrix (`Bitgraph`)
+ * undirected graph implementations.
+ *
+ * Run it from the REPL (`make repl`) with:
+ *   #use "bench_ugraph.ml";;
+ *
+ * The graphs are built the way `build_interference` builds them:
+ * for each of `ninstrs` instructions, one written vertex gets edges to
+ * all the vertices in a live set of `nlive` vertices (out of `nvertices`).
+ * Every graph is then read the way `graph_coloring` reads it. *)
+
+open Functors
+open Printf
+
+module OrderedIntS = struct
+  type t = int
+
+  let compare = Stdlib.compare
+
+  let t_of_sexp = Sexplib.Conv.int_of_sexp
+
+  let sexp_of_t = Sexplib.Conv.sexp_of_int
+
+  let to_string v = string_of_int v
+end
+
+module MapG = Ugraph.Make (OrderedIntS)
+module BitG = Bitgraph.Make (OrderedIntS)
+
+(* The (written vertex, live vertices) pairs of a synthetic function. *)
+let make_instrs nvertices nlive ninstrs =
+  let rng = Random.State.make [|nvertices; nlive; ninstrs|] in
+  List.init ninstrs (fun _ ->
+      let w = Random.State.int rng nvertices in
+      let live = List.init nlive (fun _ -> Random.State.int rng nvertices) in
+      (w, List.filter (fun v -> v <> w) live) )
+
+let time f =
+  let start = Unix.gettimeofday () in
+  let result = f () in
+  (result, Unix.gettimeofday () -. start)
+
+let build add_edge_new empty instrs =
+  List.fold_left
+    (fun g (w, live) -> List.fold_left (fun g v -> add_edge_new g w v) g live)
+    empty instrs
+
+(* Read every vertex's neighbors, as graph coloring does. *)
+let read vertices neighbors g =
+  List.fold_left (fun n v -> n + List.length (neighbors g v)) 0 (vertices g)
+
+let bench nvertices nlive ninstrs =
+  let instrs = make_instrs nvertices nlive ninstrs in
+  let mg, mbuild = time (fun () -> build MapG.add_edge_new MapG.empty instrs) in
+  let bg, bbuild = time (fun () -> build BitG.add_edge_new BitG.empty instrs) in
+  let _, mread = time (fun () -> read MapG.vertices MapG.neighbors mg) in
+  let _, bread = time (fun () -> read BitG.vertices BitG.neighbors bg) in
+  if MapG.to_list mg <> BitG.to_list bg then
+    failwith "bench_ugraph: the graphs are different" ;
+  List.iter
+    (fun (w, _) ->
+      for v = 0 to min nvertices 100 - 1 do
+        if MapG.mem_edge mg w v <> BitG.mem_edge bg w v then
+          failwith "bench_ugraph: mem_edge differs"
+      done )
+    instrs ;
+  printf "%8d %6d %8d | %9.4f %9.4f %7.1fx | %9.4f %9.4f\n%!" nvertices nlive
+    ninstrs mbuild bbuild (mbuild /. bbuild) mread bread
+
+;;
+printf "%8s %6s %8s | %9s %9s %8s | %9s %9s\n" "vertices" "live" "instrs"
+  "map build" "bit build" "speedup" "map read" "bit read"
+
+;;
+List.iter
+  (fun (nvertices, nlive, ninstrs) -> bench nvertices nlive ninstrs)
+  [ (100, 10, 1000)
+  ; (1000, 50, 10000)
+  ; (1000, 200, 10000)
+  ; (10000, 100, 100000)
+  ; (10000, 500, 100000) ]
@@ -0,0 +1,216 @@
+(* Undirected graph implementation using bit matrices. *)
+
+open Functors
+
+module Make (Elt : OrderedTypeS) : Ugraph.S with type elt = Elt.t = struct
+  module VSet = SetS.Make (Elt)
+  module VMap = MapS.Make (Elt)
+
+  type elt = Elt.t
+
+  (* The representation used by `Ugraph`; S-expressions are converted
+   * to and from this so that they are the same for both modules. *)
+  type repr = VSet.t VMap.t [@@deriving sexp]
+
+  (* Updates to a graph, in the order they were made. *)
+  type op = Add_vertex of elt | Add_edge of int * int
+
+  (* Vertices are numbered from 0 in the order they were added.
+   * The edge between vertices `i` and `j` (with `j <= i`)
+   * is bit `i * (i + 1) / 2 + j` of `matrix`. *)
+  type store =
+    { mutable ids : int VMap.t (* vertex -> number *)
+    ; mutable elts : elt array (* number -> vertex *)
+    ; mutable adj : int array array (* number -> neighbor numbers *)
+    ; mutable degree : int array (* number -> length of adjacency vector *)
+    ; mutable matrix : Bytes.t
+    ; mutable nvertices : int
+    ; mutable log : op array
+    ; mutable nops : int }
+
+  (* A graph is the state of a store after its first `version` updates.
+   * The store is replaced by a private copy if it has been updated
+   * past that point through another graph. *)
+  type t = {mutable store : store; version : int}
+
+  (* ------------------------------------------------------------------
+   * Stores.
+   * ------------------------------------------------------------------ *)
+
+  let new_store () =
+    { ids = VMap.empty
+    ; elts = [||]
+    ; adj = [||]
+    ; degree = [||]
+    ; matrix = Bytes.empty
+    ; nvertices = 0
+    ; log = [||]
+    ; nops = 0 }
+
+  (* Return an array with room for an element at index `n`,
+   * doubling its length if necessary. *)
+  let grow arr n filler =
+    let len = Array.length arr in
+    if n < len then arr
+    else
+      let arr' = Array.make (max 8 (2 * len)) filler in
+      Array.blit arr 0 arr' 0 len ;
+      arr'
+
+  let bit_index i j =
+    if j <= i then (i * (i + 1) / 2) + j else (j * (j + 1) / 2) + i
+
+  let has_edge s i j =
+    let b = bit_index i j in
+    Char.code (Bytes.get s.matrix (b lsr 3)) land (1 lsl (b land 7)) <> 0
+
+  let log_op s op =
+    s.log <- grow s.log s.nops op ;
+    s.log.(s.nops) <- op ;
+    s.nops <- s.nops + 1
+
+  let push_vertex s e =
+    let i = s.nvertices in
+    s.ids <- VMap.add e i s.ids ;
+    s.elts <- grow s.elts i e ;
+    s.elts.(i) <- e ;
+    s.adj <- grow s.adj i [||] ;
+    s.adj.(i) <- [||] ;
+    s.degree <- grow s.degree i 0 ;
+    s.degree.(i) <- 0 ;
+    (* Vertex `i` adds a row of `i + 1` bits to the matrix. *)
+    let nbytes = (((i + 1) * (i + 2) / 2) + 7) / 8 in
+    let len = Bytes.length s.matrix in
+    if nbytes > len then (
+      let m = Bytes.make (max nbytes (2 * len)) '\000' in
+      Bytes.blit s.matrix 0 m 0 len ;
+      s.matrix <- m ) ;
+    s.nvertices <- i + 1 ;
+    log_op s (Add_vertex e)
+
+  let push_neighbor s i j =
+    let d = s.degree.(i) in
+    s.adj.(i) <- grow s.adj.(i) d j ;
+    s.adj.(i).(d) <- j ;
+    s.degree.(i) <- d + 1
+
+  let push_edge s i j =
+    let b = bit_index i j in
+    let byte = Char.code (Bytes.get s.matrix (b lsr 3)) in
+    Bytes.set s.matrix (b lsr 3) (Char.chr (byte lor (1 lsl (b land 7)))) ;
+    push_neighbor s i j ;
+    if i <> j then push_neighbor s j i ;
+    log_op s (Add_edge (i, j))
+
+  (* Make a new store from the first `n` updates of a store. *)
+  let replay s n =
+    let s' = new_store () in
+    for k = 0 to n - 1 do
+      match s.log.(k) with
+      | Add_vertex e -> push_vertex s' e
+      | Add_edge (i, j) -> push_edge s' i j
+    done ;
+    s'
+
+  (* Return the store of a graph, making sure it holds
+   * exactly the graph's updates. *)
+  let current g =
+    if g.store.nops <> g.version then g.store <- replay g.store g.version ;
+    g.store
+
+  (* ------------------------------------------------------------------
+   * Graph values and functions.
+   * ------------------------------------------------------------------ *)
+
+  let empty = {store = new_store (); version = 0}
+
+  let is_empty g = (current g).nvertices = 0
+
+  let mem g e = VMap.mem e (current g).ids
+
+  let add_vertex g e =
+    let s = current g in
+    if VMap.mem e s.ids then
+      failwith
+      @@ Printf.sprintf
+           "bitgraph: add_vertex: vertex %s is already present in graph"
+           (Elt.to_string e)
+    else (
+      push_vertex s e ;
+      {store = s; version = s.nops} )
+
+  let add_edge g e1 e2 =
+    let s = current g in
+    match (VMap.find_opt e1 s.ids, VMap.find_opt e2 s.ids) with
+    | None, _ ->
+      failwith
+      @@ Printf.sprintf
+           "bitgraph: add_edge: vertex 1 (%s) of edge is not in graph"
+           (Elt.to_string e1)
+    | _, None ->
+      failwith
+      @@ Printf.sprintf
+           "bitgraph: add_edge: vertex 2 (%s) of edge is not in graph"
+           (Elt.to_string e2)
+    | Some i, Some j ->
+      if has_edge s i j then g
+      else (
+        push_edge s i j ;
+        {store = s; version = s.nops} )
+
+  let add_edge_new g e1 e2 =
+    let ensure g e = if mem g e then g else add_vertex g e in
+    add_edge (ensure (ensure g e1) e2) e1 e2
+
+  let mem_edge g e1 e2 =
+    let s = current g in
+    match (VMap.find_opt e1 s.ids, VMap.find_opt e2 s.ids) with
+    | Some i, Some j -> has_edge s i j
+    | _ -> false
+
+  (* Neighbors are sorted, as they are in `Ugraph`. *)
+  let neighbors_of s i =
+    Array.sub s.adj.(i) 0 s.degree.(i)
+    |> Array.to_list
+    |> List.map (fun j -> s.elts.(j))
+    |> List.sort Elt.compare
+
+  let neighbors g e =
+    let s = current g in
+    match VMap.find_opt e s.ids with
+    | None ->
+      failwith
+      @@ Printf.sprintf "bitgraph: neighbors: element %s not in graph"
+           (Elt.to_string e)
+    | Some i -> neighbors_of s i
+
+  let neighbors_or_none g e =
+    let s = current g in
+    match VMap.find_opt e s.ids with
+    | None -> []
+    | Some i -> neighbors_of s i
+
+  let vertices g = VMap.keys (current g).ids
+
+  let to_list g =
+    let s = current g in
+    List.map (fun (e, i) -> (e, neighbors_of s i)) (VMap.bindings s.ids)
+
+  let of_list lst =
+    List.fold_left (fun g (x, y) -> add_edge_new g x y) empty lst
+
+  let sexp_of_t g =
+    to_list g
+    |> List.map (fun (e, ns) -> (e, VSet.of_list ns))
+    |> VMap.of_list
+    |> sexp_of_repr
+
+  let t_of_sexp sx =
+    let r = repr_of_sexp sx in
+    let g = VMap.fold (fun e _ g -> add_vertex g e) r empty in
+    VMap.fold
+      (fun e ns g -> VSet.fold (fun n g -> add_edge g e n) ns g)
+      r g
+
+  let to_string g = Utils.pretty_print (sexp_of_t g)
+end
@@ -0,0 +1,19 @@
+(* Undirected graphs stored as bit matrices.
+ *
+ * This is an implementation of `Ugraph.S` for large, dense graphs
+ * such as interference graphs.  Vertices are numbered densely;
+ * edges are stored both in a triangular bit matrix (so testing for
+ * an edge takes constant time) and in adjacency vectors (so the
+ * neighbors of a vertex can be listed without scanning the matrix).
+ *
+ * The interface is the same as `Ugraph`'s and graphs behave as if
+ * they were immutable, but the representation is updated in place.
+ * Adding to the most recent version of a graph is cheap; adding to
+ * (or querying) an older version makes a private copy of that version
+ * first, which takes time proportional to its size.  Building a graph
+ * by threading it through a fold, as the compiler does, never makes
+ * any copies. *)
+
+open Functors
+
+module Make (Elt : OrderedTypeS) : Ugraph.S with type elt = Elt.t
@@ -0,0 +1,91 @@
+(* Bit vector sets of small integers. *)
+
+(* Each word of the array holds `bits` elements; all of an OCaml int's
+ * bits are used, including the sign bit. *)
+let bits = Sys.int_size
+
+type t = {size : int; words : int array}
+
+let create size =
+  if size < 0 then invalid_arg "Bitset.create" ;
+  {size; words = Array.make ((size + bits - 1) / bits) 0}
+
+let capacity s = s.size
+
+let copy s = {size = s.size; words = Array.copy s.words}
+
+let check s i name = if i < 0 || i >= s.size then invalid_arg name
+
+let mem s i =
+  check s i "Bitset.mem" ;
+  s.words.(i / bits) land (1 lsl (i mod bits)) <> 0
+
+let add s i =
+  check s i "Bitset.add" ;
+  let w = i / bits in
+  s.words.(w) <- s.words.(w) lor (1 lsl (i mod bits))
+
+let remove s i =
+  check s i "Bitset.remove" ;
+  let w = i / bits in
+  s.words.(w) <- s.words.(w) land lnot (1 lsl (i mod bits))
+
+let clear s = Array.fill s.words 0 (Array.length s.words) 0
+
+let is_empty s = Array.for_all (fun w -> w = 0) s.words
+
+(* Count the bits of a word, clearing the lowest set bit each time. *)
+let popcount w =
+  let rec iter w n = if w = 0 then n else iter (w land (w - 1)) (n + 1) in
+  iter w 0
+
+let cardinal s = Array.fold_left (fun n w -> n + popcount w) 0 s.words
+
+let same_size s1 s2 name = if s1.size <> s2.size then invalid_arg name
+
+let equal s1 s2 =
+  same_size s1 s2 "Bitset.equal" ;
+  s1.words = s2.words
+
+let assign dst src =
+  same_size dst src "Bitset.assign" ;
+  Array.blit src.words 0 dst.words 0 (Array.length src.words)
+
+let union_into dst src =
+  same_size dst src "Bitset.union_into" ;
+  let d = dst.words in
+  Array.iteri (fun i w -> d.(i) <- d.(i) lor w) src.words
+
+let diff_into dst src =
+  same_size dst src "Bitset.diff_into" ;
+  let d = dst.words in
+  Array.iteri (fun i w -> d.(i) <- d.(i) land lnot w) src.words
+
+let union_diff_into dst a b =
+  same_size dst a "Bitset.union_diff_into" ;
+  same_size dst b "Bitset.union_diff_into" ;
+  let d = dst.words in
+  let bw = b.words in
+  Array.iteri (fun i w -> d.(i) <- d.(i) lor (w land lnot bw.(i))) a.words
+
+let fold f s init =
+  let acc = ref init in
+  Array.iteri
+    (fun i w ->
+      let w = ref w in
+      let j = ref 0 in
+      while !w <> 0 do
+        if !w land 1 <> 0 then acc := f ((i * bits) + !j) !acc ;
+        w := !w lsr 1 ;
+        incr j
+      done )
+    s.words ;
+  !acc
+
+let iter f s = fold (fun i () -> f i) s ()
+
+let of_list size lst =
+  let s = create size in
+  List.iter (add s) lst ; s
+
+let elements s = List.rev (fold (fun i acc -> i :: acc) s [])
@@ -0,0 +1,64 @@
+(* Mutable fixed-size sets of small non-negative integers,
+ * stored as bit vectors. *)
+
+type t
+(** A set of integers in the range [0, capacity). *)
+
+val create : int -> t
+(** Make a new, empty set with the given capacity. *)
+
+val capacity : t -> int
+(** Return the capacity of a set. *)
+
+val copy : t -> t
+(** Return a copy of a set. *)
+
+val mem : t -> int -> bool
+(** Return `true` if the integer is in the set. *)
+
+val add : t -> int -> unit
+(** Add an integer to the set.
+    Raise `Invalid_argument` if it is out of range. *)
+
+val remove : t -> int -> unit
+(** Remove an integer from the set.
+    Raise `Invalid_argument` if it is out of range. *)
+
+val clear : t -> unit
+(** Remove all the integers from the set. *)
+
+val is_empty : t -> bool
+(** Return `true` if the set is empty. *)
+
+val cardinal : t -> int
+(** Return the number of integers in the set. *)
+
+val equal : t -> t -> bool
+(** Return `true` if two sets of the same capacity are equal. *)
+
+val assign : t -> t -> unit
+(** `assign dst src` makes `dst` equal to `src`.
+    Both sets must have the same capacity (this applies to
+    all the functions combining two or more sets). *)
+
+val union_into : t -> t -> unit
+(** `union_into dst src` adds all the integers in `src` to `dst`. *)
+
+val diff_into : t -> t -> unit
+(** `diff_into dst src` removes all the integers in `src` from `dst`. *)
+
+val union_diff_into : t -> t -> t -> unit
+(** `union_diff_into dst a b` adds to `dst` the integers
+    that are in `a` but not in `b`, without allocating. *)
+
+val iter : (int -> unit) -> t -> unit
+(** Apply a function to every integer in the set, in increasing order. *)
+
+val fold : (int -> 'a -> 'a) -> t -> 'a -> 'a
+(** Fold a function over the integers in the set, in increasing order. *)
+
+val of_list : int -> int list -> t
+(** `of_list n lst` makes a set of capacity `n` from a list. *)
+
+val elements : t -> int list
+(** Return the integers in the set in increasing order. *)
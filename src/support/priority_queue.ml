@@ -112,4 +112,202 @@ struct
     list_of_sexp binding_of_sexp sexp
 end
 
-(* TODO: more efficient implementation based on binary trees. *)
+(** Binary heap implementation of a priority queue. *)
+module Heap (Elt : OrderedTypeS) : PriorityQueue with type elt = Elt.t =
+struct
+  module EMap = Map.Make (Elt)
+
+  type elt = Elt.t
+
+  (* Each element that has been inserted is given a slot,
+   * which holds its priority and its index in the heap array.
+   * Slots are never freed, so the position index is an array
+   * and moving elements around in the heap doesn't allocate. *)
+  type heap =
+    { mutable ids : int EMap.t (* element -> slot *)
+    ; mutable elts : elt array (* slot -> element *)
+    ; mutable prios : int array (* slot -> priority *)
+    ; mutable pos : int array (* slot -> heap index, or -1 if not queued *)
+    ; mutable heap : int array (* binary heap of slots *)
+    ; mutable size : int (* number of queued elements *)
+    ; mutable nslots : int
+    ; mutable version : int }
+
+  (* The heap is updated in place, so a queue is only valid until
+   * it is passed to an updating function; using it after that
+   * is an error.  `Empty` is the only queue that can be reused. *)
+  type t = Empty | Queue of heap * int (* heap, version *)
+
+  let empty = Empty
+
+  let get_heap name = function
+    | Empty -> None
+    | Queue (h, v) ->
+      if v <> h.version then
+        failwith
+          (Printf.sprintf "priority queue: %s: queue was already updated"
+             name ) ;
+      Some h
+
+  (* Mark a heap as updated and return the new queue. *)
+  let updated h =
+    h.version <- h.version + 1 ;
+    Queue (h, h.version)
+
+  let is_empty pq =
+    match get_heap "is_empty" pq with
+    | None -> true
+    | Some h -> h.size = 0
+
+  (* The same order as in the `Simple` queue, so that both
+   * implementations remove elements in the same order. *)
+  let has_higher_priority h s1 s2 =
+    Stdlib.compare (h.prios.(s1), h.elts.(s2)) (h.prios.(s2), h.elts.(s1)) > 0
+
+  let set h i s =
+    h.heap.(i) <- s ;
+    h.pos.(s) <- i
+
+  let rec sift_up h i =
+    let s = h.heap.(i) in
+    if i > 0 then
+      let parent = (i - 1) / 2 in
+      let ps = h.heap.(parent) in
+      if has_higher_priority h s ps then (
+        set h parent s ;
+        set h i ps ;
+        sift_up h parent )
+
+  let rec sift_down h i =
+    let s = h.heap.(i) in
+    let l = (2 * i) + 1 in
+    let r = l + 1 in
+    let best =
+      if l < h.size && has_higher_priority h h.heap.(l) s then l else i
+    in
+    let best =
+      if r < h.size && has_higher_priority h h.heap.(r) h.heap.(best) then r
+      else best
+    in
+    if best <> i then (
+      set h i h.heap.(best) ;
+      set h best s ;
+      sift_down h best )
+
+  (* Return an array with room for an element at index `n`. *)
+  let grow arr n filler =
+    let len = Array.length arr in
+    if n < len then arr
+    else
+      let arr' = Array.make (max 8 (2 * len)) filler in
+      Array.blit arr 0 arr' 0 len ;
+      arr'
+
+  let new_heap () =
+    { ids = EMap.empty
+    ; elts = [||]
+    ; prios = [||]
+    ; pos = [||]
+    ; heap = [||]
+    ; size = 0
+    ; nslots = 0
+    ; version = 0 }
+
+  let slot_of h e =
+    match EMap.find_opt e h.ids with
+    | Some s -> s
+    | None ->
+      let s = h.nslots in
+      h.ids <- EMap.add e s h.ids ;
+      h.elts <- grow h.elts s e ;
+      h.elts.(s) <- e ;
+      h.prios <- grow h.prios s 0 ;
+      h.pos <- grow h.pos s (-1) ;
+      h.pos.(s) <- -1 ;
+      h.nslots <- s + 1 ;
+      s
+
+  let insert e i pq =
+    let h =
+      match get_heap "insert" pq with
+      | None -> new_heap ()
+      | Some h -> h
+    in
+    let s = slot_of h e in
+    if h.pos.(s) >= 0 then
+      failwith "can't have duplicate elements in priority queue" ;
+    h.prios.(s) <- i ;
+    h.heap <- grow h.heap h.size s ;
+    set h h.size s ;
+    h.size <- h.size + 1 ;
+    sift_up h (h.size - 1) ;
+    updated h
+
+  (* Remove the top element of a non-empty heap. *)
+  let pop h =
+    let top = h.heap.(0) in
+    h.size <- h.size - 1 ;
+    if h.size > 0 then (
+      set h 0 h.heap.(h.size) ;
+      sift_down h 0 ) ;
+    h.pos.(top) <- -1 ;
+    top
+
+  let remove_top pq =
+    match get_heap "remove_top" pq with
+    | Some h when h.size > 0 ->
+      let top = pop h in
+      (h.elts.(top), updated h)
+    | _ -> failwith "no elements in priority queue"
+
+  let update e i pq =
+    match get_heap "update" pq with
+    | None -> pq
+    | Some h -> (
+      match EMap.find_opt e h.ids with
+      | Some s when h.pos.(s) >= 0 ->
+        let old = h.prios.(s) in
+        h.prios.(s) <- i ;
+        if i > old then sift_up h h.pos.(s)
+        else if i < old then sift_down h h.pos.(s) ;
+        updated h
+      | _ -> pq (* not in priority queue *) )
+
+  let insert_all es i pq = List.fold_left (fun pq e -> insert e i pq) pq es
+
+  let remove_all_top pq =
+    match get_heap "remove_all_top" pq with
+    | Some h when h.size > 0 ->
+      let i = h.prios.(h.heap.(0)) in
+      let rec iter best =
+        if h.size > 0 && h.prios.(h.heap.(0)) = i then
+          let s = pop h in
+          iter (h.elts.(s) :: best)
+        else best
+      in
+      let best = iter [] in
+      (best, i, updated h)
+    | _ -> failwith "no elements in priority queue"
+
+  let of_list alist =
+    List.fold_left (fun pq (e, i) -> insert e i pq) Empty alist
+
+  (* Queues are converted to and from the same S-expressions
+   * as `Simple` queues: lists of bindings in priority order. *)
+  let sexp_of_t pq =
+    let bindings =
+      match get_heap "sexp_of_t" pq with
+      | None -> []
+      | Some h ->
+        Array.to_list (Array.sub h.heap 0 h.size)
+        |> List.map (fun s -> (h.elts.(s), h.prios.(s)))
+        |> List.sort (fun (e1, i1) (e2, i2) ->
+               Stdlib.compare (i2, e1) (i1, e2) )
+    in
+    let sexp_of_binding = sexp_of_pair Elt.sexp_of_t sexp_of_int in
+    sexp_of_list sexp_of_binding bindings
+
+  let t_of_sexp sexp =
+    let binding_of_sexp = pair_of_sexp Elt.t_of_sexp int_of_sexp in
+    of_list (list_of_sexp binding_of_sexp sexp)
+end
@@ -1,4 +1,8 @@
-(* Functional priority queues. *)
+(* Priority queues.
+ * `Simple` queues are purely functional.  `Heap` queues are
+ * updated in place: a queue is invalid once it has been passed
+ * to `insert`, `remove_top`, `update`, `insert_all` or
+ * `remove_all_top`, and only the queue they return may be used. *)
 
 open Sexplib
 open Functors
@@ -54,3 +58,9 @@ end
 
 (** Simple, inefficient implementation of a priority queue. *)
 module Simple (Elt : OrderedTypeS) : PriorityQueue with type elt = Elt.t
+
+(** Binary heap implementation of a priority queue, with an index
+    from elements to heap positions.  `insert`, `remove_top` and
+    `update` take O(log n) time.  Elements are removed in the same
+    order as from a `Simple` queue. *)
+module Heap (Elt : OrderedTypeS) : PriorityQueue with type elt = Elt.t
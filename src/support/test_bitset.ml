@@ -0,0 +1,50 @@
+(* Tests of the bit vector set implementation. *)
+
+open Printf
+
+let print_set s =
+  printf "{" ;
+  List.iter (fun i -> printf " %d" i) (Bitset.elements s) ;
+  printf " } (%d elements)\n" (Bitset.cardinal s)
+
+(* Test sets spanning several words, including the sign bits. *)
+
+let n = (3 * Sys.int_size) + 5
+
+let s1 = Bitset.of_list n [0; 1; Sys.int_size - 1; Sys.int_size; n - 1] ;;
+
+print_set s1
+
+let s2 = Bitset.of_list n [1; 2; Sys.int_size - 1; (2 * Sys.int_size) - 1] ;;
+
+print_set s2
+
+let s3 = Bitset.copy s1 ;;
+
+Bitset.union_into s3 s2 ;;
+
+print_set s3 ;;
+
+Bitset.diff_into s3 s1 ;;
+
+print_set s3
+
+(* dst |= a - b *)
+
+let s4 = Bitset.of_list n [3] ;;
+
+Bitset.union_diff_into s4 s1 s2 ;;
+
+print_set s4 ;;
+
+printf "equal: %b\n" (Bitset.equal s1 (Bitset.copy s1)) ;;
+
+Bitset.remove s1 0 ;;
+
+printf "mem 0: %b, mem 1: %b\n" (Bitset.mem s1 0) (Bitset.mem s1 1) ;;
+
+Bitset.clear s1 ;;
+
+printf "empty after clear: %b\n" (Bitset.is_empty s1) ;;
+
+try Bitset.add s1 n with Invalid_argument msg -> printf "ERROR: %s\n" msg
@@ -20,6 +20,8 @@ module type S = sig
 
   val add_edge_new : t -> elt -> elt -> t
 
+  val mem_edge : t -> elt -> elt -> bool
+
   val neighbors : t -> elt -> elt list
 
   val neighbors_or_none : t -> elt -> elt list
@@ -102,6 +104,11 @@ module Make (Elt : OrderedTypeS) : S with type elt = Elt.t = struct
       let g2 = add_vertex g1 e2 in
       add_edge g2 e1 e2
 
+  let mem_edge g e1 e2 =
+    match VMap.find_opt e1 g with
+    | None -> false
+    | Some ns -> VSet.mem e2 ns
+
   let neighbors g e =
     match VMap.find_opt e g with
     | None ->
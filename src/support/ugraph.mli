@@ -29,6 +29,10 @@ module type S = sig
   (** Add an edge between two different vertices of the graph.
         If either vertex is not in the graph, it is created. *)
 
+  val mem_edge : t -> elt -> elt -> bool
+  (** Return `true` if there is an edge between two vertices.
+        Return `false` if either vertex is not in the graph. *)
+
   val neighbors : t -> elt -> elt list
   (** Return a list of all neighbors of a vertex.
         Raise a `Failure` exception if the vertex is not in the graph. *)